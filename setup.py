@@ -28,7 +28,6 @@ setuptools.setup(
         'pyyaml',
         'requests',
         'github3.py',
-        'beautifulsoup4',
     ],
     extras_require={
         'selenium': ['selenium']
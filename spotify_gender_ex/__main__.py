@@ -3,11 +3,13 @@ import os
 
 import click
 
-from spotify_gender_ex import __version__, genderex, gh_issue
+from spotify_gender_ex import __version__, genderex, gh_issue, lang_file, downloader, pipeline
 
 
 def start_genderex(apk_file='', directory='.', replacement_table='', builtin=False, no_internal=False,
-                   ks_password='', key_password='', no_interaction=False, force=False, no_verify=False, gh_token=''):
+                   ks_password='', key_password='', no_interaction=False, force=False, no_verify=False, gh_token='',
+                   processes=1, engine='tree', rt_ttl=downloader.RTABLE_CACHE_TTL, scan=False, arsc_mode=False,
+                   resume=False, segments=1):
     gh_token = arg_or_envvar(gh_token, '', 'GEX_GH_TOKEN')
     ks_password = arg_or_envvar(ks_password, '', 'GEX_KS_PASSWORD')
     key_password = arg_or_envvar(key_password, '', 'GEX_KEY_PASSWORD')
@@ -21,7 +23,7 @@ def start_genderex(apk_file='', directory='.', replacement_table='', builtin=Fal
         return
 
     gex = genderex.GenderEx(apk_file, directory, replacement_table, builtin, no_internal, no_interaction,
-                            ks_password, key_password, gotify_url)
+                            ks_password, key_password, gotify_url, processes, engine, rt_ttl, arsc_mode, resume, segments)
 
     click.echo('Spotify-Gender-Ex Version: %s' % __version__)
     click.echo('Aktuelle Spotify-Version: %s' % gex.get_spotify_store_version())
@@ -34,9 +36,16 @@ def start_genderex(apk_file='', directory='.', replacement_table='', builtin=Fal
         click.echo('Keine Spotify-App vorhanden.')
         return
 
+    if resume:
+        resume_stage = gex.resume(not no_verify)
+        if resume_stage:
+            click.echo('Setze vorherigen Durchlauf fort ab: %s' % resume_stage)
+        else:
+            click.echo('Alle Schritte des vorherigen Durchlaufs sind bereits abgeschlossen.')
+
     # Non-interactive mode is meant for automation.
     # In this case, dont process the same spotify version multiple times
-    if gex.is_latest_spotify_processed():
+    elif gex.is_latest_spotify_processed():
         click.echo('Du hast bereits die aktuellste Spotify-Version degenderifiziert.')
         if no_interaction and not force:
             click.echo('Vielen Dank.')
@@ -44,29 +53,64 @@ def start_genderex(apk_file='', directory='.', replacement_table='', builtin=Fal
 
     gex.wait_for_enter('Drücke Enter zum Starten...')
 
-    click.echo('1. HERUNTERLADEN')
-    if not gex.download():
-        return
+    # Creating the keystore is independent of the app, so it runs concurrently with the download.
+    # Verifying and decompiling the app are independent of each other and run concurrently as well.
+    # The credits contain the number of new replacements, so they are added after the replacements.
+    # The replacements are only made for a verified app. In interactive mode, they may prompt
+    # for input, so they wait for all other concurrent stages to keep their output apart.
+    downloaded = False
+    restored = False
 
-    click.echo('2. VERIFIZIEREN')
-    if no_verify:
-        click.echo('Übersprungen.')
-    else:
-        gex.verify()
+    def download():
+        nonlocal downloaded, restored
+
+        if not run_stage(gex, 'download', gex.download):
+            return False
+        downloaded = True
 
-    click.echo('3. DEKOMPILIEREN')
-    gex.decompile()
-    gex.check_compatibility()
+        # Same app and replacement tables as a previous run: use its output files
+        if not force and not scan and gex.restore_cached_output(not no_verify):
+            click.echo('Diese App wurde bereits mit den gleichen Ersetzungstabellen verarbeitet.')
+            click.echo('Vorhandene Ausgabedateien werden verwendet (--force zum erneuten Verarbeiten).')
+            restored = True
 
-    click.echo('4. DEGENDERIFIZIEREN')
-    gex.replace()
-    gex.add_credits()
+    def process(stage, *funcs):
+        # The stages after the download are skipped if the output files of a previous run are used
+        return lambda: restored or run_stage(gex, stage, *funcs)
 
-    click.echo('5. REKOMPILIEREN')
-    gex.recompile()
+    def skip_verify():
+        click.echo('Übersprungen.')
+
+    verify = skip_verify if no_verify else gex.verify
+
+    decompile = [gex.decompile, gex.check_compatibility]
+    if scan:
+        decompile.append(gex.scan)
+
+    replace_deps = ['decompile', 'verify']
+    if not no_interaction:
+        replace_deps.append('keystore')
+
+    click.echo('1-6. HERUNTERLADEN UND VERARBEITEN')
+    try:
+        pipeline.run_stages([
+            pipeline.Stage('keystore', gex.workdir.create_keystore, label='KEYSTORE'),
+            pipeline.Stage('download', download, label='HERUNTERLADEN'),
+            pipeline.Stage('verify', process('verify', verify), ['download'], label='VERIFIZIEREN'),
+            pipeline.Stage('decompile', process('decompile', *decompile), ['download'], label='DEKOMPILIEREN'),
+            pipeline.Stage('replace', process('replace', gex.replace, gex.add_credits),
+                           replace_deps, label='DEGENDERIFIZIEREN'),
+            pipeline.Stage('recompile', process('recompile', gex.recompile),
+                           ['replace'], label='REKOMPILIEREN'),
+            pipeline.Stage('sign', process('sign', gex.sign),
+                           ['recompile', 'verify', 'keystore'], label='SIGNIEREN'),
+        ])
+    except pipeline.StageException:
+        # Without the app, there is nothing to process
+        if not downloaded:
+            return
+        raise
 
-    click.echo('6. SIGNIEREN')
-    gex.sign()
     gex.notify()
 
     if gh_token and not builtin and not replacement_table and not gex.rtm.new_replacements.is_empty():
@@ -85,6 +129,14 @@ def start_genderex(apk_file='', directory='.', replacement_table='', builtin=Fal
         gex.set_github_vars()
 
 
+def run_stage(gex: genderex.GenderEx, stage: str, *funcs) -> bool:
+    """Runs a stage of the pipeline, unless it is skipped when resuming a previous run"""
+    if gex.is_stage_done(stage):
+        click.echo('Bereits abgeschlossen.')
+        return True
+    return gex.run_stage(stage, *funcs)
+
+
 def arg_or_envvar(arg, default, envvar: str):
     if arg and arg != default:
         return arg
@@ -103,15 +155,34 @@ def arg_or_envvar(arg, default, envvar: str):
 @click.option('--kypw', help='Signer: Passwort für den Key (genderex).', default='', type=click.STRING)
 @click.option('--noia', help='Keine Interaktion: Deaktiviert Eingabeaufforderungen (für Automatisierung)', is_flag=True)
 @click.option('--force',
-              help='(Nur mit --noia) Durchlauf erzwingen, auch wenn die aktuelle Spotify-Version bereits verarbeitet wurde',
+              help='Durchlauf erzwingen, auch wenn die aktuelle Spotify-Version bereits verarbeitet wurde '
+                   '(ohne --noia: vorhandene Ausgabedateien nicht wiederverwenden)',
               is_flag=True)
 @click.option('--noverify',
               help='Spotify-App-Signatur nicht verifizieren. Nur dann aktivieren, wenn du nicht die Original-Spotify-App verarbeitest.',
               is_flag=True)
 @click.option('--gh-token', help='GitHub-Token, um neue Ersetzungsregeln zu übermitteln', default='', type=click.STRING)
-def run(a, d, rt, builtin, no_internal, kspw, kypw, noia, force, noverify, gh_token):
+@click.option('-j', help='Anzahl der Prozesse, die die Sprachdateien parallel bearbeiten. Standard: 1', default=1,
+              type=click.IntRange(min=1))
+@click.option('--engine', help='Verfahren zum Bearbeiten der Sprachdateien (stream: geringerer Speicherbedarf, '
+                               'splice: nur geänderte Texte schreiben). Standard: tree',
+              default='tree', type=click.Choice(list(lang_file.ENGINES)))
+@click.option('--rt-ttl', help='Zeit in Sekunden, in der die zwischengespeicherte Ersetzungstabelle von GitHub '
+                               'ohne Aktualisierung verwendet wird. Standard: %d' % downloader.RTABLE_CACHE_TTL,
+              default=downloader.RTABLE_CACHE_TTL, type=click.IntRange(min=0))
+@click.option('--scan', help='Alle Sprachen der App nach verdächtigen Texten ohne Ersetzungsregel durchsuchen '
+                             'und einen Bericht im Ausgabeordner speichern', is_flag=True)
+@click.option('--arsc', help='Texte direkt in der resources.arsc ersetzen, ohne die App mit APKTool zu dekompilieren '
+                             'und zu rekompilieren (schneller)', is_flag=True)
+@click.option('--resume', help='Einen abgebrochenen Durchlauf beim ersten nicht abgeschlossenen Schritt fortsetzen, '
+                               'anstatt neu zu beginnen', is_flag=True)
+@click.option('--segments', help='Anzahl der gleichzeitigen Verbindungen beim Herunterladen der App '
+                                 '(falls vom Server unterstützt). Standard: 1', default=1, type=click.IntRange(min=1))
+def run(a, d, rt, builtin, no_internal, kspw, kypw, noia, force, noverify, gh_token, j, engine, rt_ttl, scan, arsc,
+        resume, segments):
     """Entferne die Gendersternchen (z.B. Künstler*innen) aus der Spotify-App für Android!"""
-    start_genderex(a, d, rt, builtin, no_internal, kspw, kypw, noia, force, noverify, gh_token)
+    start_genderex(a, d, rt, builtin, no_internal, kspw, kypw, noia, force, noverify, gh_token, j, engine, rt_ttl,
+                   scan, arsc, resume, segments)
 
 
 if __name__ == '__main__':
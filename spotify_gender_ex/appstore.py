@@ -1,9 +1,16 @@
+import abc
+import asyncio
+import functools
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import List, Set
+from html.parser import HTMLParser
+from typing import Awaitable, Callable, List, Optional, Set
 
 import requests
-from bs4 import BeautifulSoup
+
+from spotify_gender_ex import http_session
 
 URL_APKCOMBO = 'https://apkcombo.com/%s/download/apk'
 URL_APKCOMBO_CHECKIN = 'https://apkcombo.com/checkin'
@@ -12,12 +19,19 @@ URL_UPTODOWN = 'https://spotify.de.uptodown.com/android/download'
 DEFAULT_CPU = 'arm64-v8a'
 DEFAULT_UA = 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/96.0.4664.45 Safari/537.36'
 
+# Time in seconds to wait for the results of all stores
+STORE_DEADLINE = 30
+# Number of threads running the (blocking) HTTP requests of the stores
+STORE_WORKERS = 8
+
 
 @dataclass
 class App:
     version: str
     cpu_archs: Set[str]
     download_url: str
+    # Name of the store offering the app
+    store: str = ''
 
     def __eq__(self, o: 'App') -> bool:
         return self.version == o.version
@@ -26,11 +40,40 @@ class App:
         return compare_versions(self.version, o.version) > 0
 
 
+@dataclass
+class StoreResult:
+    store: str
+    app: Optional[App]
+    error: str
+    # Time in seconds until the store answered (or the deadline)
+    latency: float
+
+
 class StoreException(Exception):
     pass
 
 
-class Apkcombo:
+# Runs a blocking function in the thread pool of the store query: await run(func, *args)
+RunFunc = Callable[..., Awaitable]
+
+
+class Store(abc.ABC):
+    """
+    Base class of the app stores.
+
+    The stores are queried with asyncio. Blocking HTTP requests are run in a thread pool
+    using the given run function, so independent requests of a store can run concurrently.
+    """
+
+    @abc.abstractmethod
+    async def get_spotify_app_async(self, run: RunFunc) -> App:
+        """Queries the store for the latest Spotify app"""
+
+    def get_spotify_app(self) -> App:
+        return _run_async(self.get_spotify_app_async)
+
+
+class Apkcombo(Store):
     def __init__(self, user_agent=DEFAULT_UA, cpu_arch=DEFAULT_CPU):
         self.cpu_arch = cpu_arch
         self.headers = {
@@ -44,10 +87,10 @@ class Apkcombo:
 
     def _query_url(self, url) -> str:
         try:
-            resp = requests.get(url, headers=self.headers)
-            if resp.status_code != 200:
-                raise StoreException('HTTP status code: ' + str(resp.status_code))
-            return resp.text
+            with http_session.get(url, headers=self.headers) as resp:
+                if resp.status_code != 200:
+                    raise StoreException('HTTP status code: ' + str(resp.status_code))
+                return resp.text
         except Exception as e:
             raise StoreException(e)
 
@@ -59,43 +102,32 @@ class Apkcombo:
         return self._query_url(URL_APKCOMBO_CHECKIN)
 
     def _parse_page(self, raw_page, checkin_token) -> List[App]:
-        soup = BeautifulSoup(raw_page, 'html.parser')
+        parser = _ApkcomboPageParser()
+        parser.parse(raw_page)
 
-        arch_list_elm = soup.select_one('#variants-tab ul')
-        if arch_list_elm is None:
+        if not parser.found_list:
             raise StoreException('Could not find arch-list')
 
-        arch_list = arch_list_elm.find_all('li', recursive=False)
         parsed_apps = []
 
-        for arch_elm in arch_list:
-            raw_arch = arch_elm.select_one('.blur').get_text()
-            archs = set(map(str.strip, raw_arch.split(',')))
+        for variant in parser.variants:
+            if variant.arch_text is None:
+                raise StoreException('Could not find arch name')
+            archs = set(map(str.strip, variant.arch_text.split(',')))
 
-            file_list_elm = arch_elm.select_one('.file-list')
-            if file_list_elm is None:
-                continue
-            file_list = file_list_elm.find_all('li', recursive=False)
-
-            for file_elm in file_list:
-                file_a_elm = file_elm.find('a')
-                if file_a_elm is None or 'href' not in file_a_elm.attrs:
-                    continue
-                download_url = file_a_elm['href']
-                if not self._is_apk_path(download_url):
+            for download_url, vername in variant.files:
+                if download_url is None or not self._is_apk_path(download_url):
                     continue
-
-                vername_elm = file_elm.select_one('.vername')
-                if vername_elm is None:
+                if vername is None:
                     continue
 
                 pattern_version = r'\d+(\.\d+){3}'
-                match = re.search(pattern_version, vername_elm.get_text())
+                match = re.search(pattern_version, vername)
                 if match is None:
                     continue
                 version = match.group(0)
 
-                parsed_apps.append(App(version, archs, f'{download_url}&{checkin_token}'))
+                parsed_apps.append(App(version, archs, f'{download_url}&{checkin_token}', 'Apkcombo'))
 
         return parsed_apps
 
@@ -115,16 +147,18 @@ class Apkcombo:
 
         raise StoreException('Could not find apk for ' + self.cpu_arch)
 
-    def get_spotify_app(self) -> App:
-        checkin_token = self._query_checkin()
-        raw_page = self._query_page('spotify/com.spotify.music')
+    async def get_spotify_app_async(self, run: RunFunc) -> App:
+        # The checkin token and the page are independent, so they are queried concurrently
+        checkin_token, raw_page = await asyncio.gather(
+            run(self._query_checkin), run(self._query_page, 'spotify/com.spotify.music'))
+
         apps = self._parse_page(raw_page, checkin_token)
         app = self._pick_app(apps)
-        check_app_file(app.download_url, self.headers)
+        await run(check_app_file, app.download_url, self.headers)
         return app
 
 
-class Uptodown:
+class Uptodown(Store):
     def __init__(self,
                  user_agent=DEFAULT_UA,
                  cpu_arch=DEFAULT_CPU,
@@ -132,7 +166,7 @@ class Uptodown:
         self.download_id = download_id
         self.headers = {'User-Agent': user_agent}
 
-    def get_spotify_app(self) -> App:
+    async def get_spotify_app_async(self, run: RunFunc) -> App:
         pattern_url = re.escape(
             'https://dw.uptodown.com/dwn/') + r'(\w|\.|\/|-|\+|=)+'
         pattern_version = r'(?<=<div class=version>)(\d|\.)+'
@@ -143,12 +177,12 @@ class Uptodown:
             url = URL_UPTODOWN
 
         try:
-            r = requests.get(url)
+            page = await run(self._query_page, url)
         except Exception as e:
             raise StoreException(e)
 
-        search_url = re.search(pattern_url, r.text)
-        search_version = re.search(pattern_version, r.text)
+        search_url = re.search(pattern_url, page)
+        search_version = re.search(pattern_version, page)
 
         if not search_url or not search_version:
             raise StoreException('Could not get Spotify version')
@@ -156,26 +190,241 @@ class Uptodown:
         spotify_url = str(search_url[0])
         spotify_version = str(search_version[0])
 
-        check_app_file(spotify_url, self.headers)
+        await run(check_app_file, spotify_url, self.headers)
+
+        return App(spotify_version, {'universal'}, spotify_url, 'Uptodown')
+
+    @staticmethod
+    def _query_page(url) -> str:
+        with http_session.get(url) as r:
+            return r.text
+
+
+class _Variant:
+    """Architecture variant of the Apkcombo page"""
+
+    def __init__(self):
+        # Text of the first .blur element (architecture names)
+        self.arch_text = None
+        self.has_file_list = False
+        # Files: (href of the first link, text of the first .vername element)
+        self.files = []
+
+
+class _File:
+    def __init__(self):
+        self.href = None
+        self.has_link = False
+        self.vername = None
+
+
+class _Element:
+    def __init__(self, tag: str, roles: Set[str]):
+        self.tag = tag
+        self.roles = roles
+
+
+class _ApkcomboPageParser(HTMLParser):
+    """
+    Event-based parser for the download page of Apkcombo. Instead of building a document tree,
+    it only tracks the open elements and extracts the architecture variants:
+
+    - the direct ``li`` children of the first ``ul`` within ``#variants-tab``
+    - in each variant: the text of the first ``.blur`` element and the direct ``li`` children
+      of the first ``.file-list`` element
+    - in each file: the ``href`` of the first link and the text of the first ``.vername`` element
 
-        return App(spotify_version, {'universal'}, spotify_url)
+    Parsing stops as soon as the variant list is closed.
+    """
+
+    # Elements without an end tag
+    VOID_ELEMENTS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param',
+                     'source', 'track', 'wbr'}
+
+    # Size of the chunks fed to the parser
+    CHUNK_SIZE = 16 * 1024
+
+    def __init__(self):
+        super().__init__()
+        self.variants = []
+        self.found_list = False
+        self.done = False
+
+        self._stack = []
+        self._n_variants_tab = 0
+        self._variant = None
+        self._file = None
+        self._text_roles = set()
+
+    def parse(self, page: str):
+        for i in range(0, len(page), self.CHUNK_SIZE):
+            self.feed(page[i:i + self.CHUNK_SIZE])
+            if self.done:
+                return
+        self.close()
+
+        # Close the elements which are still open at the end of the page
+        while self._stack:
+            self._close_element(self._stack.pop())
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+
+        attrs = dict(attrs)
+        classes = (attrs.get('class') or '').split()
+        parent_roles = self._stack[-1].roles if self._stack else set()
+        roles = set()
+
+        # Variant and file enclosing this element
+        variant, file = self._variant, self._file
+
+        if tag == 'ul' and not self.found_list and self._n_variants_tab > 0:
+            roles.add('list')
+            self.found_list = True
+        elif tag == 'li' and 'list' in parent_roles:
+            roles.add('variant')
+            self._variant = _Variant()
+
+        if variant is not None:
+            if 'blur' in classes and variant.arch_text is None:
+                roles.add('arch')
+                variant.arch_text = ''
+            if 'file-list' in classes and not variant.has_file_list:
+                roles.add('file_list')
+                variant.has_file_list = True
+            elif tag == 'li' and 'file_list' in parent_roles:
+                roles.add('file')
+                self._file = _File()
+
+        if file is not None:
+            if tag == 'a' and not file.has_link:
+                file.has_link = True
+                file.href = attrs.get('href')
+            if 'vername' in classes and file.vername is None:
+                roles.add('vername')
+                file.vername = ''
+
+        if attrs.get('id') == 'variants-tab':
+            roles.add('variants_tab')
+            self._n_variants_tab += 1
+
+        element = _Element(tag, roles)
+        if tag in self.VOID_ELEMENTS:
+            self._close_element(element)
+        else:
+            self._stack.append(element)
+            self._text_roles |= roles & {'arch', 'vername'}
+
+    def handle_endtag(self, tag):
+        if self.done:
+            return
+
+        # Unmatched end tags are ignored, unclosed elements are closed with their parent
+        for i in range(len(self._stack) - 1, -1, -1):
+            if self._stack[i].tag == tag:
+                while len(self._stack) > i:
+                    self._close_element(self._stack.pop())
+                return
+
+    def handle_data(self, data):
+        if 'arch' in self._text_roles:
+            self._variant.arch_text += data
+        if 'vername' in self._text_roles:
+            self._file.vername += data
+
+    def _close_element(self, element: _Element):
+        roles = element.roles
+        self._text_roles -= roles
+
+        if 'file' in roles:
+            self._variant.files.append((self._file.href, self._file.vername))
+            self._file = None
+        if 'variant' in roles:
+            self.variants.append(self._variant)
+            self._variant = None
+        if 'list' in roles:
+            self.done = True
+        if 'variants_tab' in roles:
+            self._n_variants_tab -= 1
 
 
 STORES = [Apkcombo, Uptodown]
 
 
-def get_spotify_app(cpu_arch=DEFAULT_CPU) -> App:
-    found_apps = []
+def _run_async(func: Callable[[RunFunc], Awaitable], workers=STORE_WORKERS):
+    """
+    Runs the coroutine function func(run) in a new event loop.
 
-    for store_class in STORES:
-        store = store_class(cpu_arch=cpu_arch)
+    The blocking functions are run in a separate thread pool, which is not waited for when
+    the coroutine is finished. So requests exceeding a deadline do not block the caller.
+    The abandoned threads still delay the exit of the interpreter until their requests end,
+    so the blocking functions must only make requests with a timeout (see http_session).
+    """
+    executor = ThreadPoolExecutor(workers)
 
-        try:
-            app = store.get_spotify_app()
-            found_apps.append(app)
-            print(store_class.__name__ + ': gefundene Version ' + app.version)
-        except Exception as e:
-            print(store_class.__name__ + ': ' + str(e))
+    async def main():
+        loop = asyncio.get_running_loop()
+
+        def run(blocking_func, *args):
+            return loop.run_in_executor(executor, functools.partial(blocking_func, *args))
+
+        return await func(run)
+
+    try:
+        return asyncio.run(main())
+    finally:
+        executor.shutdown(wait=False)
+
+
+async def _query_store(store: Store, run: RunFunc) -> StoreResult:
+    start = time.monotonic()
+    name = type(store).__name__
+
+    try:
+        app = await store.get_spotify_app_async(run)
+        return StoreResult(name, app, '', time.monotonic() - start)
+    except Exception as e:
+        return StoreResult(name, None, str(e), time.monotonic() - start)
+
+
+async def _query_stores(run: RunFunc, stores: List[Store], deadline: float) -> List[StoreResult]:
+    start = time.monotonic()
+    tasks = [asyncio.ensure_future(_query_store(store, run)) for store in stores]
+    await asyncio.wait(tasks, timeout=deadline)
+
+    results = []
+    for store, task in zip(stores, tasks):
+        if task.done():
+            results.append(task.result())
+        else:
+            task.cancel()
+            results.append(StoreResult(type(store).__name__, None, 'Zeitüberschreitung', time.monotonic() - start))
+    return results
+
+
+def query_stores(cpu_arch=DEFAULT_CPU, deadline=STORE_DEADLINE) -> List[StoreResult]:
+    """
+    Queries all stores concurrently (including the independent requests of each store).
+    Returns as soon as all stores have answered or the deadline has passed.
+    """
+    stores = [store_class(cpu_arch=cpu_arch) for store_class in STORES]
+    return _run_async(lambda run: _query_stores(run, stores, deadline), max(STORE_WORKERS, 2 * len(stores)))
+
+
+def get_spotify_app(cpu_arch=DEFAULT_CPU, deadline=STORE_DEADLINE) -> App:
+    """
+    Queries all stores concurrently and returns the most recent app.
+    Stores which did not respond within the deadline are ignored.
+    """
+    found_apps = []
+
+    for result in query_stores(cpu_arch, deadline):
+        if result.app:
+            found_apps.append(result.app)
+            print('%s: gefundene Version %s (%.2f s)' % (result.store, result.app.version, result.latency))
+        else:
+            print('%s: %s (%.2f s)' % (result.store, result.error, result.latency))
 
     if len(found_apps) == 0:
         raise StoreException('Spotify-App konnte nicht abgerufen werden')
@@ -215,12 +464,12 @@ def compare_versions(version_a: str, version_b: str) -> int:
 
 
 def check_app_file(app_url: str, headers: dict):
-    file_headers = requests.get(app_url, headers=headers, stream=True).headers
-    file_type = file_headers.get('Content-Type')
-
     try:
-        file_size = int(file_headers.get('Content-Length'))
-    except TypeError or ValueError:
+        file_type, file_size = http_session.probe_file(app_url, headers)
+    except requests.RequestException as e:
+        raise StoreException(e)
+
+    if file_size is None:
         raise StoreException('Did not receive content length')
 
     if file_type != 'application/vnd.android.package-archive' and file_type != 'application/octet-stream':
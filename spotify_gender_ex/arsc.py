@@ -0,0 +1,566 @@
+# coding=utf-8
+"""
+Direct editing of the compiled resources (resources.arsc) of an APK file.
+
+Instead of decoding the app with apktool and building it again, the language fields
+are read from the resource table and the new texts are appended to its string pool.
+The resource entries of the edited language are pointed to the new strings,
+so strings shared with other languages are not affected.
+
+The texts are converted to the form apktool would write into the language files
+(see ``escape_resource_string``), so the replacement tables can be used unchanged.
+"""
+import struct
+import zipfile
+from typing import Iterator, List, Optional, Tuple
+
+from spotify_gender_ex import repack
+
+ARSC_FILE = 'resources.arsc'
+MANIFEST_FILE = 'AndroidManifest.xml'
+
+# Chunk types
+RES_STRING_POOL_TYPE = 0x0001
+RES_TABLE_TYPE = 0x0002
+RES_XML_TYPE = 0x0003
+RES_XML_START_ELEMENT_TYPE = 0x0102
+RES_XML_RESOURCE_MAP_TYPE = 0x0180
+RES_TABLE_PACKAGE_TYPE = 0x0200
+RES_TABLE_TYPE_TYPE = 0x0201
+
+# String pool flags
+SORTED_FLAG = 0x1
+UTF8_FLAG = 0x100
+
+# Type chunk flags
+FLAG_SPARSE = 0x1
+FLAG_OFFSET16 = 0x2
+
+# Entry flags
+FLAG_COMPLEX = 0x1
+FLAG_COMPACT = 0x8
+
+TYPE_STRING = 0x03
+NO_ENTRY = 0xFFFFFFFF
+NO_ENTRY16 = 0xFFFF
+
+ATTR_VERSION_NAME = 0x0101021c
+
+# Attribute ids of the plural quantities
+PLURAL_QUANTITIES = {
+    0x01000004: 'other',
+    0x01000005: 'zero',
+    0x01000006: 'one',
+    0x01000007: 'two',
+    0x01000008: 'few',
+    0x01000009: 'many',
+}
+
+# Resource types which can be edited and the names of the language files apktool writes them to
+LANGFILE_TYPES = {
+    'strings.xml': 'string',
+    'plurals.xml': 'plurals',
+}
+
+
+class ArscException(Exception):
+    pass
+
+
+class StringPool:
+    """
+    String pool chunk of a resource table or a binary XML file.
+
+    Existing strings are kept byte-identical, new strings are appended at the end.
+    """
+
+    def __init__(self, data: bytes, offset=0):
+        chunk_type, header_size, size, n_strings, n_styles, flags, strings_start, styles_start = \
+            struct.unpack_from('<HHIIIIII', data, offset)
+
+        if chunk_type != RES_STRING_POOL_TYPE:
+            raise ArscException('String-Pool erwartet bei Offset %d' % offset)
+
+        self.size = size
+        self.n_styles = n_styles
+        self.utf8 = bool(flags & UTF8_FLAG)
+
+        self._header = bytes(data[offset:offset + header_size])
+        self._offsets = list(struct.unpack_from('<%dI' % n_strings, data, offset + header_size))
+        self._style_offsets = list(struct.unpack_from('<%dI' % n_styles, data, offset + header_size + 4 * n_strings))
+
+        strings_end = styles_start if n_styles else size
+        self._string_data = bytes(data[offset + strings_start:offset + strings_end]) if n_strings else b''
+        self._style_data = bytes(data[offset + styles_start:offset + size]) if n_styles else b''
+
+        self._new_strings = []
+        self._new_index = {}
+
+    def __len__(self):
+        return len(self._offsets) + len(self._new_strings)
+
+    def get(self, index: int) -> str:
+        """Returns the string with the given index"""
+        if index >= len(self._offsets):
+            return self._new_strings[index - len(self._offsets)]
+
+        pos = self._offsets[index]
+        data = self._string_data
+
+        if self.utf8:
+            # Length in UTF-16 units (unused), then length in bytes
+            _, pos = _decode_length8(data, pos)
+            length, pos = _decode_length8(data, pos)
+            return data[pos:pos + length].decode('utf-8', errors='surrogatepass')
+
+        length, pos = _decode_length16(data, pos)
+        return data[pos:pos + length * 2].decode('utf-16-le', errors='surrogatepass')
+
+    def is_styled(self, index: int) -> bool:
+        """Styled strings (containing HTML tags) have the lowest indices"""
+        return index < self.n_styles
+
+    def add(self, string: str) -> int:
+        """Appends a new string and returns its index"""
+        index = self._new_index.get(string)
+        if index is None:
+            index = len(self)
+            self._new_strings.append(string)
+            self._new_index[string] = index
+        return index
+
+    def _encode(self, string: str) -> bytes:
+        if self.utf8:
+            encoded = string.encode('utf-8', errors='surrogatepass')
+            n_chars = len(string.encode('utf-16-le', errors='surrogatepass')) // 2
+            return _encode_length8(n_chars) + _encode_length8(len(encoded)) + encoded + b'\0'
+
+        encoded = string.encode('utf-16-le', errors='surrogatepass')
+        return _encode_length16(len(encoded) // 2) + encoded + b'\0\0'
+
+    def to_bytes(self) -> bytes:
+        """Serializes the string pool chunk"""
+        offsets = list(self._offsets)
+        string_data = bytearray(self._string_data)
+
+        for string in self._new_strings:
+            offsets.append(len(string_data))
+            string_data += self._encode(string)
+
+        string_data += b'\0' * (-len(string_data) % 4)
+
+        header_size = len(self._header)
+        strings_start = header_size + 4 * (len(offsets) + self.n_styles)
+        styles_start = strings_start + len(string_data) if self.n_styles else 0
+        size = strings_start + len(string_data) + len(self._style_data)
+
+        flags = struct.unpack_from('<I', self._header, 16)[0] & ~SORTED_FLAG
+
+        header = bytearray(self._header)
+        struct.pack_into('<IIIIII', header, 4, size, len(offsets), self.n_styles, flags,
+                         strings_start if offsets else 0, styles_start)
+
+        return bytes(header) + struct.pack('<%dI' % len(offsets), *offsets) + \
+            struct.pack('<%dI' % self.n_styles, *self._style_offsets) + bytes(string_data) + self._style_data
+
+
+class ResourceTable:
+    """Resource table (resources.arsc) of an APK file"""
+
+    def __init__(self, data: bytes):
+        chunk_type, header_size, size, _ = struct.unpack_from('<HHII', data, 0)
+        if chunk_type != RES_TABLE_TYPE:
+            raise ArscException('Keine gültige resources.arsc-Datei')
+
+        self._header = bytes(data[:header_size])
+        self.strings = StringPool(data, header_size)
+        self._pool_end = header_size + self.strings.size
+
+        # The rest of the table is patched in place
+        self._data = bytearray(data)
+
+        # Type chunks: (type name, key string pool, chunk offset)
+        self._type_chunks = []
+
+        pos = self._pool_end
+        while pos < size:
+            chunk_type, _, chunk_size = struct.unpack_from('<HHI', data, pos)
+            if chunk_type == RES_TABLE_PACKAGE_TYPE:
+                self._read_package(pos)
+            pos += chunk_size
+
+    def _read_package(self, offset: int):
+        data = self._data
+        _, header_size, size = struct.unpack_from('<HHI', data, offset)
+        type_strings_offset, _, key_strings_offset = struct.unpack_from('<III', data, offset + 268)
+
+        type_strings = StringPool(data, offset + type_strings_offset)
+        key_strings = StringPool(data, offset + key_strings_offset)
+
+        pos = offset + header_size
+        while pos < offset + size:
+            chunk_type, _, chunk_size = struct.unpack_from('<HHI', data, pos)
+            if chunk_type == RES_TABLE_TYPE_TYPE:
+                type_id = data[pos + 8]
+                self._type_chunks.append((type_strings.get(type_id - 1), key_strings, pos))
+            pos += chunk_size
+
+    def _iter_entries(self, offset: int) -> Iterator[int]:
+        """Yields the positions of all entries of a type chunk"""
+        data = self._data
+        _, header_size, _, _, flags, _, n_entries, entries_start = struct.unpack_from('<HHIBBHII', data, offset)
+        index_pos = offset + header_size
+
+        if flags & FLAG_SPARSE:
+            entry_offsets = [struct.unpack_from('<H', data, index_pos + 4 * i + 2)[0] * 4 for i in range(n_entries)]
+        elif flags & FLAG_OFFSET16:
+            entry_offsets = [o * 4 for o in struct.unpack_from('<%dH' % n_entries, data, index_pos)
+                             if o != NO_ENTRY16]
+        else:
+            entry_offsets = [o for o in struct.unpack_from('<%dI' % n_entries, data, index_pos) if o != NO_ENTRY]
+
+        for entry_offset in entry_offsets:
+            yield offset + entries_start + entry_offset
+
+    def _iter_string_refs(self, offset: int, key_strings: StringPool, plurals: bool) -> Iterator[Tuple[str, int]]:
+        """
+        Yields all string values of a type chunk: (key, position of the string index).
+        Plural items are addressed by ``name/quantity``, like in the language files.
+        """
+        data = self._data
+
+        for pos in self._iter_entries(offset):
+            size, flags, key = struct.unpack_from('<HHI', data, pos)
+
+            if flags & FLAG_COMPACT:
+                # Compact entry: key index in the size field, value type in the upper flag bits
+                if not plurals and flags >> 8 == TYPE_STRING:
+                    yield key_strings.get(size), pos + 4
+            elif flags & FLAG_COMPLEX:
+                if plurals:
+                    name = key_strings.get(key)
+                    count = struct.unpack_from('<I', data, pos + 12)[0]
+
+                    for map_pos in range(pos + size, pos + size + 12 * count, 12):
+                        attr, _, _, data_type = struct.unpack_from('<IHBB', data, map_pos)
+                        quantity = PLURAL_QUANTITIES.get(attr)
+                        if quantity and data_type == TYPE_STRING:
+                            yield '%s/%s' % (name, quantity), map_pos + 8
+            elif not plurals:
+                if data[pos + size + 3] == TYPE_STRING:
+                    yield key_strings.get(key), pos + size + 4
+
+    def _config_matches(self, offset: int, language: bytes, region: bytes) -> bool:
+        """Checks if the configuration of a type chunk only consists of the given language/region"""
+        config_pos = offset + 20
+        config_size = struct.unpack_from('<I', self._data, config_pos)[0]
+        config = self._data[config_pos:config_pos + config_size]
+
+        return config[8:10] == language and config[10:12] == region and \
+            not any(config[4:8]) and not any(config[12:])
+
+    def get_langfile(self, lfpath: str) -> Optional['ArscLangFile']:
+        """
+        Returns the language fields of the given language file (e.g. ``res/values-de/strings.xml``).
+        Returns None if the language file cannot be located in the resource table.
+        """
+        parts = lfpath.split('/')
+        if len(parts) != 3 or parts[0] != 'res' or parts[2] not in LANGFILE_TYPES:
+            return None
+
+        qualifiers = _parse_qualifiers(parts[1])
+        if qualifiers is None:
+            return None
+
+        type_name = LANGFILE_TYPES[parts[2]]
+        refs = []
+
+        for chunk_type, key_strings, offset in self._type_chunks:
+            if chunk_type == type_name and self._config_matches(offset, *qualifiers):
+                refs += self._iter_string_refs(offset, key_strings, type_name == 'plurals')
+
+        if not refs:
+            return None
+        return ArscLangFile(self, refs)
+
+    def get_string(self, pos: int) -> Tuple[int, str]:
+        """Returns the string referenced at the given position: (string index, string)"""
+        index = struct.unpack_from('<I', self._data, pos)[0]
+        return index, self.strings.get(index)
+
+    def set_string(self, pos: int, string: str):
+        """Points the string reference at the given position to a new string"""
+        struct.pack_into('<I', self._data, pos, self.strings.add(string))
+
+    def to_bytes(self) -> bytes:
+        """Serializes the resource table"""
+        pool = self.strings.to_bytes()
+        rest = self._data[self._pool_end:]
+
+        header = bytearray(self._header)
+        struct.pack_into('<I', header, 4, len(header) + len(pool) + len(rest))
+        return bytes(header) + pool + bytes(rest)
+
+
+class ArscLangFile:
+    """
+    Language file (e.g. ``res/values-de/strings.xml``) within a resource table.
+    Offers the same bulk interface as ``lang_file.LangFile``.
+    """
+
+    def __init__(self, table: ResourceTable, refs: List[Tuple[str, int]]):
+        self.table = table
+        self.refs = refs
+
+    def get_fields(self) -> Tuple[List[str], List[str], List[int]]:
+        """
+        Extract all language fields into flat lists for bulk processing.
+        The texts are escaped the same way as in the language files decoded by apktool.
+        Styled strings are skipped.
+
+        :return: Tuple: (keys, stripped texts, string reference positions as handles for ``set_texts``)
+        """
+        keys = []
+        texts = []
+        handles = []
+
+        for key, pos in self.refs:
+            index, string = self.table.get_string(pos)
+            if self.table.strings.is_styled(index):
+                continue
+
+            text = escape_resource_string(string).strip()
+            if text:
+                keys.append(key)
+                texts.append(text)
+                handles.append(pos)
+
+        return keys, texts, handles
+
+    def set_texts(self, handles: List[int], texts: List[str]):
+        """
+        Set the texts of the given language fields.
+
+        :param handles: Field handles from ``get_fields``
+        :param texts: New texts (escaped like in the language files)
+        """
+        for pos, text in zip(handles, texts):
+            self.table.set_string(pos, unescape_resource_string(text))
+
+
+class ArscApk:
+    """APK file whose resource table is edited directly"""
+
+    def __init__(self, file: str):
+        self.file = file
+        self._changed_files = {}
+
+        with zipfile.ZipFile(file) as apk:
+            self.table = ResourceTable(apk.read(ARSC_FILE))
+            self.version_name = read_version_name(apk.read(MANIFEST_FILE))
+
+    def read_file(self, name: str) -> bytes:
+        """Reads a file from the APK (including previous changes)"""
+        if name in self._changed_files:
+            return self._changed_files[name]
+
+        with zipfile.ZipFile(self.file) as apk:
+            return apk.read(name)
+
+    def write_file(self, name: str, data: bytes):
+        """Replaces a file within the APK. The change is written by ``to_file``."""
+        self._changed_files[name] = data
+
+    def to_file(self, file: str):
+        """
+        Writes the changed APK file. The unchanged entries are copied from the original APK
+        without recompressing them. The v1 signature files are removed, the APK has to be signed again.
+        """
+        changed_files = dict(self._changed_files)
+        changed_files[ARSC_FILE] = self.table.to_bytes()
+
+        repack.repack_apk(file, self.file, changed_files=changed_files)
+
+
+def read_version_name(data: bytes) -> Optional[str]:
+    """Reads the versionName attribute from a binary AndroidManifest.xml"""
+    chunk_type, header_size, size = struct.unpack_from('<HHI', data, 0)
+    if chunk_type != RES_XML_TYPE:
+        raise ArscException('Keine gültige binäre XML-Datei')
+
+    strings = None
+    resource_ids = []
+    pos = header_size
+
+    while pos < size:
+        chunk_type, chunk_header_size, chunk_size = struct.unpack_from('<HHI', data, pos)
+
+        if chunk_type == RES_STRING_POOL_TYPE:
+            strings = StringPool(data, pos)
+        elif chunk_type == RES_XML_RESOURCE_MAP_TYPE:
+            resource_ids = struct.unpack_from('<%dI' % ((chunk_size - chunk_header_size) // 4), data,
+                                              pos + chunk_header_size)
+        elif chunk_type == RES_XML_START_ELEMENT_TYPE and strings is not None:
+            ext = pos + chunk_header_size
+            name = struct.unpack_from('<I', data, ext + 4)[0]
+
+            if strings.get(name) == 'manifest':
+                attr_start, attr_size, attr_count = struct.unpack_from('<HHH', data, ext + 8)
+
+                for attr_pos in range(ext + attr_start, ext + attr_start + attr_size * attr_count, attr_size):
+                    _, attr_name, raw_value, _, _, data_type, value = struct.unpack_from('<IIIHBBI', data, attr_pos)
+
+                    attr_id = resource_ids[attr_name] if attr_name < len(resource_ids) else None
+                    if attr_id == ATTR_VERSION_NAME or strings.get(attr_name) == 'versionName':
+                        if raw_value != NO_ENTRY:
+                            return strings.get(raw_value)
+                        if data_type == TYPE_STRING:
+                            return strings.get(value)
+                return None
+
+        pos += chunk_size
+
+    return None
+
+
+def escape_resource_string(string: str) -> str:
+    """
+    Escapes a string from the resource table like apktool does when writing the language files
+    (``ResXmlEncoders.encodeAsResXmlValue``).
+    Strings with apostrophes, line breaks or multiple spaces are enclosed in double quotes.
+    """
+    if not string:
+        return string
+
+    out = []
+    if string[0] in '#@?':
+        out.append('\\')
+
+    enclose = False
+    was_space = True
+
+    for c in string:
+        if c == ' ':
+            if was_space:
+                enclose = True
+            was_space = True
+        else:
+            was_space = False
+
+            if c in '\\"':
+                out.append('\\')
+            elif c in '\'\n':
+                enclose = True
+            elif ord(c) < 0x20 or 0x7f <= ord(c) < 0xa0:
+                out.append('\\u%04x' % ord(c))
+                continue
+        out.append(c)
+
+    res = ''.join(out)
+    if enclose or was_space:
+        return '"%s"' % res
+    return res
+
+
+def unescape_resource_string(text: str) -> str:
+    """
+    Converts a text from a language file into the string stored in the resource table
+    the same way as aapt2 does: Escape sequences are resolved, double quotes are removed and
+    whitespace outside of double quotes is collapsed and trimmed.
+    """
+    out = []
+    quoted = False
+    # Whitespace outside of quotes is written as a single space before the next character
+    space_pending = False
+    i = 0
+
+    while i < len(text):
+        c = text[i]
+
+        if c == '\\' and i + 1 < len(text):
+            esc = text[i + 1]
+            i += 2
+
+            if esc == 'n':
+                c = '\n'
+            elif esc == 't':
+                c = '\t'
+            elif esc == 'u' and i + 4 <= len(text):
+                try:
+                    c = chr(int(text[i:i + 4], 16))
+                    i += 4
+                except ValueError:
+                    c = esc
+            else:
+                c = esc
+        elif c == '"':
+            quoted = not quoted
+            i += 1
+            continue
+        elif not quoted and c.isspace():
+            space_pending = bool(out)
+            i += 1
+            continue
+        else:
+            i += 1
+
+        if space_pending:
+            out.append(' ')
+            space_pending = False
+        out.append(c)
+
+    return ''.join(out)
+
+
+def _parse_qualifiers(dirname: str) -> Optional[Tuple[bytes, bytes]]:
+    """
+    Parses the name of a resource folder. Only language and region qualifiers are supported.
+
+    :return: (language, region) as stored in the resource configuration, None if not supported
+    """
+    parts = dirname.split('-')
+    if parts[0] != 'values' or len(parts) > 3:
+        return None
+
+    language = b'\0\0'
+    region = b'\0\0'
+
+    if len(parts) > 1:
+        if len(parts[1]) != 2 or not parts[1].islower():
+            return None
+        language = parts[1].encode('ascii')
+
+    if len(parts) > 2:
+        if len(parts[2]) != 3 or parts[2][0] != 'r':
+            return None
+        region = parts[2][1:].encode('ascii')
+
+    return language, region
+
+
+def _decode_length8(data: bytes, pos: int) -> Tuple[int, int]:
+    length = data[pos]
+    if length & 0x80:
+        return ((length & 0x7F) << 8) | data[pos + 1], pos + 2
+    return length, pos + 1
+
+
+def _decode_length16(data: bytes, pos: int) -> Tuple[int, int]:
+    length = struct.unpack_from('<H', data, pos)[0]
+    if length & 0x8000:
+        return ((length & 0x7FFF) << 16) | struct.unpack_from('<H', data, pos + 2)[0], pos + 4
+    return length, pos + 2
+
+
+def _encode_length8(length: int) -> bytes:
+    if length > 0x7FFF:
+        raise ArscException('String zu lang für den String-Pool')
+    if length > 0x7F:
+        return bytes(((length >> 8) | 0x80, length & 0xFF))
+    return bytes((length,))
+
+
+def _encode_length16(length: int) -> bytes:
+    if length > 0x7FFF:
+        return struct.pack('<HH', (length >> 16) | 0x8000, length & 0xFFFF)
+    return struct.pack('<H', length)
@@ -0,0 +1,203 @@
+# coding=utf-8
+"""
+Host-wide store of downloaded APK files, shared by all GenderEx working directories.
+
+The files are stored by their SHA-256 hash (blobs/<sha256>/<sha256>.apk). The index maps
+an app from a store (store, version, CPU architectures) to the hash of its file,
+each entry is a small JSON file (index/<key>.json).
+
+All files are written to a temporary file (or folder) first and then moved into place,
+so multiple GenderEx processes can use the store at the same time. Blobs are never
+modified, they are hardlinked into the working directories (copied if hardlinks are not supported).
+The least recently used blobs are evicted when the store grows too large. The last use is the
+modification time of the blob folder, so the (shared) file itself is never touched.
+"""
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from typing import Optional
+
+import click
+
+from spotify_gender_ex import cache, downloader
+from spotify_gender_ex.appstore import App
+
+# Environment variable with the location of the store
+ENV_BLOB_STORE = 'GEX_BLOB_STORE'
+
+BLOB_EXT = '.apk'
+INDEX_EXT = '.json'
+
+# Age in seconds after which temporary files of interrupted processes are removed
+STALE_TMP_AGE = 24 * 3600
+
+
+def get_default_path() -> str:
+    """Location of the store: $GEX_BLOB_STORE or ~/.cache/spotify-gender-ex/blobs"""
+    path = os.environ.get(ENV_BLOB_STORE)
+    if path:
+        return path
+
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'spotify-gender-ex', 'blobs')
+
+
+class BlobStore:
+    def __init__(self, path: str):
+        self.path = path
+        self.dir_blobs = os.path.join(path, 'blobs')
+        self.dir_index = os.path.join(path, 'index')
+
+    def get_blob(self, sha256: str) -> str:
+        return os.path.join(self.dir_blobs, sha256, sha256 + BLOB_EXT)
+
+    def lookup(self, app: App) -> Optional[str]:
+        """Returns the SHA-256 hash of the stored file of an app (None if it is not stored)"""
+        key = _get_key(app)
+        if not key:
+            return None
+
+        try:
+            with open(os.path.join(self.dir_index, key + INDEX_EXT), 'r', encoding='utf-8') as f:
+                sha256 = json.load(f)['sha256']
+        except (OSError, ValueError, KeyError):
+            return None
+
+        if not os.path.isfile(self.get_blob(sha256)):
+            return None
+        return sha256
+
+    def get(self, sha256: str, target: str) -> bool:
+        """
+        Links the stored file to target and writes its hash (see downloader.read_sha256).
+        The file is checked against its hash first, corrupted files are removed from the store.
+
+        :return: False if the file is not stored (e.g. evicted by another process) or corrupted
+        """
+        blob = self.get_blob(sha256)
+        tmp_file = _tmp_name(target)
+
+        try:
+            _link_or_copy(blob, tmp_file)
+            cache.touch_entry(os.path.dirname(blob))
+
+            if cache.sha256_file(tmp_file) != sha256:
+                click.echo('APK-Datei im APK-Speicher ist beschädigt und wird entfernt: %s' % blob)
+                cache.remove_entry(tmp_file)
+                cache.remove_entry(os.path.dirname(blob))
+                return False
+
+            os.replace(tmp_file, target)
+        except OSError:
+            cache.remove_entry(tmp_file)
+            return False
+
+        downloader.write_sha256(target, sha256)
+        return True
+
+    def insert(self, file: str, sha256: str, app: Optional[App] = None):
+        """
+        Adds a file to the store. If the app is given, it is added to the index.
+
+        :param sha256: SHA-256 hash of the file
+        :raise: OSError if the store is not writable
+        """
+        os.makedirs(self.dir_blobs, exist_ok=True)
+        blob = self.get_blob(sha256)
+        blob_dir = os.path.dirname(blob)
+
+        if not os.path.isfile(blob):
+            # The blob folder is created completely and then moved into place
+            tmp_dir = _tmp_name(blob_dir)
+            try:
+                os.makedirs(tmp_dir)
+                _link_or_copy(file, os.path.join(tmp_dir, os.path.basename(blob)))
+                os.rename(tmp_dir, blob_dir)
+            except OSError:
+                # Inserted by another process
+                if not os.path.isfile(blob):
+                    raise
+            finally:
+                cache.remove_entry(tmp_dir)
+
+        cache.touch_entry(blob_dir)
+
+        key = _get_key(app) if app else None
+        if key:
+            os.makedirs(self.dir_index, exist_ok=True)
+            index_file = os.path.join(self.dir_index, key + INDEX_EXT)
+            tmp_file = _tmp_name(index_file)
+
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump({'sha256': sha256, 'store': app.store, 'version': app.version,
+                           'cpu_archs': sorted(app.cpu_archs)}, f)
+            os.replace(tmp_file, index_file)
+
+    def evict(self, max_size: int):
+        """
+        Removes the least recently used files until the size of the store is below max_size,
+        as well as temporary files of interrupted processes and index entries of removed files.
+        """
+        now = time.time()
+
+        for folder in (self.dir_blobs, self.dir_index):
+            try:
+                names = os.listdir(folder)
+            except FileNotFoundError:
+                continue
+
+            for name in names:
+                if cache.TMP_SUFFIX in name:
+                    file = os.path.join(folder, name)
+                    try:
+                        if now - os.path.getmtime(file) > STALE_TMP_AGE:
+                            cache.remove_entry(file)
+                    except OSError:
+                        pass
+
+        n_removed, _ = cache.evict_lru(self.dir_blobs, max_size)
+        if not n_removed:
+            return
+
+        try:
+            names = os.listdir(self.dir_index)
+        except FileNotFoundError:
+            return
+
+        for name in names:
+            if not name.endswith(INDEX_EXT):
+                continue
+
+            index_file = os.path.join(self.dir_index, name)
+            try:
+                with open(index_file, 'r', encoding='utf-8') as f:
+                    sha256 = json.load(f)['sha256']
+            except (OSError, ValueError, KeyError):
+                continue
+
+            if not os.path.isfile(self.get_blob(sha256)):
+                cache.remove_entry(index_file)
+
+
+def _get_key(app: App) -> Optional[str]:
+    """Index key of an app: store-version-archs (None if the store is unknown)"""
+    if not app.store or not app.version:
+        return None
+
+    key = '%s-%s-%s' % (app.store, app.version, '+'.join(sorted(app.cpu_archs)))
+    return re.sub(r'[^\w.+-]', '_', key)
+
+
+def _tmp_name(file: str) -> str:
+    """Temporary file name, unique for each process and thread"""
+    return '%s.%d.%d%s' % (file, os.getpid(), threading.get_ident(), cache.TMP_SUFFIX)
+
+
+def _link_or_copy(src: str, dst: str):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
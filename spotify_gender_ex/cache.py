@@ -0,0 +1,118 @@
+# coding=utf-8
+"""
+Helper functions for the caches in the GenderEx working directory.
+
+Cache entries are files or folders within a cache folder. The modification time of an entry
+is its last use, the least recently used entries are evicted when the cache grows too large.
+"""
+import hashlib
+import os
+import shutil
+from typing import Tuple
+
+HASH_BUFSIZE = 1024 * 1024
+
+# Suffix of entries which are being written
+TMP_SUFFIX = '.tmp'
+
+
+def sha256_file(file: str) -> str:
+    """Returns the SHA-256 hash (hex) of a file"""
+    sha256 = hashlib.sha256()
+
+    with open(file, 'rb') as f:
+        while True:
+            chunk = f.read(HASH_BUFSIZE)
+            if not chunk:
+                break
+            sha256.update(chunk)
+
+    return sha256.hexdigest()
+
+
+def hardlink_tree(src: str, dst: str):
+    """
+    Recreates the folder tree src at dst with hardlinks to the files of src.
+    Falls back to copying if hardlinks are not supported (e.g. different filesystems).
+
+    Since the files are shared, they must never be modified in place,
+    but only replaced (written to a temporary file, then moved with os.replace).
+    """
+    use_links = True
+
+    for dirpath, _, filenames in os.walk(src):
+        target_dir = os.path.join(dst, os.path.relpath(dirpath, src))
+        os.makedirs(target_dir, exist_ok=True)
+
+        for filename in filenames:
+            src_file = os.path.join(dirpath, filename)
+            dst_file = os.path.join(target_dir, filename)
+
+            if use_links:
+                try:
+                    os.link(src_file, dst_file)
+                    continue
+                except OSError:
+                    use_links = False
+
+            shutil.copy2(src_file, dst_file)
+
+
+def entry_size(path: str) -> int:
+    """Returns the size of a cache entry (file or folder) in bytes"""
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+
+    size = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            size += os.path.getsize(os.path.join(dirpath, filename))
+    return size
+
+
+def remove_entry(path: str):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def touch_entry(path: str):
+    """Marks a cache entry as used"""
+    os.utime(path)
+
+
+def evict_lru(cache_dir: str, max_size: int) -> Tuple[int, int]:
+    """
+    Removes the least recently used entries of a cache folder until its size
+    is below max_size. The most recently used entry is always kept.
+    Entries which are being written (``.tmp`` suffix) are ignored.
+
+    :return: Tuple: (Number of removed entries, Remaining size in bytes)
+    """
+    try:
+        names = os.listdir(cache_dir)
+    except FileNotFoundError:
+        return 0, 0
+
+    entries = [os.path.join(cache_dir, name) for name in names if TMP_SUFFIX not in name]
+    entries.sort(key=os.path.getmtime, reverse=True)
+
+    total_size = 0
+    n_kept = 0
+
+    for entry in entries:
+        size = entry_size(entry)
+        if n_kept > 0 and total_size + size > max_size:
+            break
+
+        total_size += size
+        n_kept += 1
+
+    for entry in entries[n_kept:]:
+        remove_entry(entry)
+
+    return len(entries) - n_kept, total_size
@@ -0,0 +1,102 @@
+# coding=utf-8
+"""
+Checkpoints of the GenderEx pipeline.
+
+After each stage, a checkpoint is written to the manifest file (GenderEx/tmp/checkpoints.json):
+the hash of the stage inputs, the output files with their SHA-256 hashes, state values which are
+needed by the following stages and the duration of the stage.
+A resumed run skips all stages up to the first one without a valid checkpoint.
+"""
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Callable, Iterable, Optional
+
+from spotify_gender_ex import cache
+
+STAGES = ('download', 'verify', 'decompile', 'replace', 'recompile', 'sign')
+
+
+class Checkpoints:
+    """Checkpoint manifest of a GenderEx run, records are stored as {stage: record}"""
+
+    def __init__(self, file: str):
+        self.file = file
+        self.stages = {}
+
+        # Stages recorded in this run
+        self._recorded = set()
+        self._lock = threading.Lock()
+
+        try:
+            with open(file, 'r', encoding='utf-8') as f:
+                self.stages = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def get_resume_stage(self, get_inputs: Callable[[str], dict]) -> Optional[str]:
+        """
+        Returns the first stage without a valid checkpoint (None if all stages have been completed).
+
+        A checkpoint is valid if the inputs of the stage are unchanged and all output files
+        still exist with the same content.
+
+        :param get_inputs: Function returning the inputs of a stage.
+            It is called only if all previous stages have valid checkpoints.
+        """
+        for stage in STAGES:
+            record = self.stages.get(stage)
+            if not record or record['inputs'] != hash_inputs(get_inputs(stage)):
+                return stage
+
+            for file, sha256 in record['outputs'].items():
+                try:
+                    if cache.sha256_file(file) != sha256:
+                        return stage
+                except OSError:
+                    return stage
+        return None
+
+    def get_state(self, stage: str) -> dict:
+        return self.stages[stage]['state']
+
+    def record(self, stage: str, inputs: dict, outputs: Iterable[str], state: dict, duration: float,
+               digests: Optional[dict] = None):
+        """
+        Records the checkpoint of a completed stage.
+
+        The checkpoints of all following stages from a previous run are removed since their inputs
+        have changed. Stages may run concurrently, so checkpoints recorded in this run are kept.
+
+        :param digests: Known SHA-256 hashes of output files {file: sha256}, the other files are hashed
+        """
+        digests = digests or {}
+        record = {
+            'inputs': hash_inputs(inputs),
+            'outputs': {file: digests.get(file) or cache.sha256_file(file) for file in outputs},
+            'state': state,
+            'duration': round(duration, 3),
+            'finished': datetime.now().isoformat(timespec='seconds'),
+        }
+
+        with self._lock:
+            for later_stage in STAGES[STAGES.index(stage):]:
+                if later_stage not in self._recorded:
+                    self.stages.pop(later_stage, None)
+
+            self.stages[stage] = record
+            self._recorded.add(stage)
+            self._save()
+
+    def _save(self):
+        tmp_file = self.file + cache.TMP_SUFFIX
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.stages, f, indent=2)
+        os.replace(tmp_file, self.file)
+
+
+def hash_inputs(inputs: dict) -> str:
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode('utf-8')).hexdigest()
+
@@ -1,50 +1,513 @@
+import hashlib
+import json
 import os
-import urllib.request
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Tuple
 
 import click
 import requests
 from tqdm import tqdm
 
+from spotify_gender_ex import cache, http_session
+
 URL_GHAPI = 'https://api.github.com/repos/Theta-Dev/Spotify-Gender-Ex/commits/master'
 URL_RTABLE = 'https://raw.githubusercontent.com/Theta-Dev/Spotify-Gender-Ex/%s/spotify_gender_ex/res/replacements.json'
 
+# Timeout for HTTP requests: (connect, read) in seconds
+TIMEOUT = http_session.TIMEOUT
+# Time in seconds to wait for the replacement table from GitHub
+RTABLE_DEADLINE = 20
+# Time in seconds after which the cached replacement table from GitHub is checked for updates
+RTABLE_CACHE_TTL = 3600
+
+# Size of the chunks written to the file while downloading
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Number of retries after failed download requests without received data
+DOWNLOAD_RETRIES = 3
+# Delay in seconds before the first retry, doubled for every further retry
+DOWNLOAD_RETRY_DELAY = 1
+
+# Minimum size of a segment of a segmented download
+MIN_SEGMENT_SIZE = 1024 * 1024
+
+# Suffix of incomplete downloads
+PART_SUFFIX = '.part'
+# Suffix of the file containing the validator (ETag/Last-Modified) of an incomplete download
+VALIDATOR_SUFFIX = '.part.validator'
+# Suffix of the file containing the SHA-256 hash of a downloaded file
+SHA256_SUFFIX = '.sha256'
+
+# Errors after which a download is resumed (lost connection, incomplete response)
+_RETRY_EXCEPTIONS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+
+_RTABLE_CACHE_FILE = 'replacements_github.json'
+_RTABLE_CACHE_META = 'replacements_github.meta.json'
+
+
+def get_replacement_table_raw(cache_dir: Optional[str] = None, ttl=RTABLE_CACHE_TTL, timeout=TIMEOUT) -> Optional[str]:
+    """
+    Get the latest replacement table from GitHub.
+
+    If a cache directory is given, the last fetched table is stored there together with the
+    commit SHA and the ETag of the GitHub API response. Within the TTL the cached table is used
+    without any request. After that, the commit is queried conditionally (If-None-Match) and the
+    table is only downloaded again if the commit changed.
+    If GitHub cannot be reached, the cached table is used.
+
+    :param cache_dir: Cache directory (optional)
+    :param ttl: Time in seconds during which the cached table is used without checking for updates
+    :param timeout: Timeout for the HTTP requests
+    :return: Replacement table (JSON string) or None if it could not be obtained
+    """
+    cached_rtab, meta = read_rtable_cache(cache_dir)
+
+    if cached_rtab is not None and time.time() - meta.get('time', 0) < ttl:
+        return cached_rtab
 
-def get_replacement_table_raw() -> str:
     try:
+        headers = {}
+        if cached_rtab is not None and meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+
         # Get latest commit
-        sha = requests.get(URL_GHAPI).json()['sha']
-        return requests.get(URL_RTABLE % sha).text
+        with http_session.get(URL_GHAPI, headers=headers, timeout=timeout) as resp:
+            if resp.status_code == 304:
+                sha = meta.get('sha')
+            else:
+                resp.raise_for_status()
+                sha = resp.json()['sha']
+                meta['etag'] = resp.headers.get('ETag')
+
+        if cached_rtab is None or sha != meta.get('sha'):
+            with http_session.get(URL_RTABLE % sha, timeout=timeout) as resp_rtab:
+                resp_rtab.raise_for_status()
+                cached_rtab = resp_rtab.text
+
+        meta['sha'] = sha
+        meta['time'] = time.time()
+        _write_rtable_cache(cache_dir, cached_rtab, meta)
+
+        return cached_rtab
     except Exception:
+        if cached_rtab is not None:
+            click.echo(
+                'Ersetzungstabelle konnte nicht abgerufen werden. Verwende zwischengespeicherte Tabelle.'
+            )
+            return cached_rtab
+
         click.echo(
             'Ersetzungstabelle konnte nicht abgerufen werden. Verwende eingebaute Tabelle.'
         )
 
 
-# See here
-# https://stackoverflow.com/questions/15644964/python-progress-bar-and-downloads
+def read_rtable_cache(cache_dir: Optional[str]) -> Tuple[Optional[str], dict]:
+    """Returns the cached replacement table from GitHub and its metadata (None, {} if there is no cached table)"""
+    if not cache_dir:
+        return None, {}
+
+    try:
+        with open(os.path.join(cache_dir, _RTABLE_CACHE_META), encoding='utf-8') as f:
+            meta = json.load(f)
+        with open(os.path.join(cache_dir, _RTABLE_CACHE_FILE), encoding='utf-8') as f:
+            return f.read(), meta
+    except (OSError, ValueError):
+        return None, {}
+
+
+def _write_rtable_cache(cache_dir: Optional[str], rtab: str, meta: dict):
+    if not cache_dir:
+        return
 
+    os.makedirs(cache_dir, exist_ok=True)
 
-class _DownloadProgressBar(tqdm):
-    def update_to(self, b=1, bsize=1, tsize=None):
-        if tsize is not None:
-            self.total = tsize
-        self.update(b * bsize - self.n)
+    for name, content in ((_RTABLE_CACHE_FILE, rtab), (_RTABLE_CACHE_META, json.dumps(meta))):
+        file = os.path.join(cache_dir, name)
+        tmp_file = '%s.%d.tmp' % (file, os.getpid())
 
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp_file, file)
 
-def download_file(url, output_path, description='') -> bool:
+
+def download_file(url, output_path, description='', sha256: Optional[str] = None,
+                  retries=DOWNLOAD_RETRIES, segments=1) -> bool:
+    """
+    Downloads a file in chunks.
+
+    The file is written to output_path.part and moved to output_path when it is complete.
+    If the connection is lost, the download is resumed from the end of the .part file
+    (HTTP Range request), also by a later call. The SHA-256 hash of the file is computed while
+    downloading and written to output_path.sha256 (see read_sha256).
+
+    With multiple segments, the file is split into byte ranges which are downloaded concurrently
+    if the server supports range requests. Otherwise, it is downloaded with a single connection.
+    Since the segments are not written in order, the hash is computed after the download in this case.
+
+    :param sha256: Expected SHA-256 hash (hex) of the file (optional)
+    :param retries: Number of retries after failed requests without received data
+    :param segments: Number of concurrent connections
+    :return: True if the file has been downloaded
+    """
     if description:
         click.echo('Lade %s herunter: %s' % (description, url))
     else:
         click.echo('Herunterladen: ' + url)
 
-    try:
-        with _DownloadProgressBar(unit='B',
-                                  unit_scale=True,
-                                  miniters=1,
-                                  desc=description) as t:
-            urllib.request.urlretrieve(url,
-                                       filename=output_path,
-                                       reporthook=t.update_to)
-    except Exception:
+    part_file = output_path + PART_SUFFIX
+
+    with tqdm(unit='B', unit_scale=True, miniters=1, desc=description) as t:
+        download = _Download(url, part_file, t)
+
+        try:
+            if segments > 1 and not os.path.exists(part_file):
+                download.download_segments(segments, retries)
+
+            download.read_part_file()
+
+            if not download.is_complete():
+                download.download_stream(retries)
+        except Exception as e:
+            click.echo('Download fehlgeschlagen: %s' % e)
+            return False
+
+    # The size is unknown if the server did not send it
+    if download.total is not None and not download.is_complete():
+        click.echo('Download unvollständig: %d von %d Bytes' % (download.size, download.total))
+        return False
+
+    digest = download.hasher.hexdigest()
+    if sha256 and digest != sha256.lower():
+        click.echo('Prüfsumme der heruntergeladenen Datei ist ungültig')
+        download.discard()
         return False
-    return os.path.isfile(output_path)
+
+    os.replace(part_file, output_path)
+    cache.remove_entry(download.validator_file)
+    write_sha256(output_path, digest)
+    return True
+
+
+class _Download:
+    """State of a download: the .part file, its SHA-256 hash and size"""
+
+    def __init__(self, url: str, part_file: str, t: tqdm):
+        self.url = url
+        self.part_file = part_file
+        self.validator_file = part_file[:-len(PART_SUFFIX)] + VALIDATOR_SUFFIX
+        self.t = t
+        self.hasher = hashlib.sha256()
+        self.size = 0
+        self.total = None
+        # ETag/Last-Modified of the file, sent with range requests (If-Range)
+        self.validator = None
+        self._lock = threading.Lock()
+
+    def is_complete(self) -> bool:
+        """Returns True if the .part file has the size of the file on the server"""
+        return self.total is not None and self.size == self.total
+
+    def discard(self):
+        """Removes the .part file and its validator"""
+        cache.remove_entry(self.part_file)
+        cache.remove_entry(self.validator_file)
+
+    def read_part_file(self):
+        """
+        Hashes the existing .part file to continue the download.
+
+        A .part file from a previous call is only continued if the validator of the file
+        is known, so the server can check that the file has not changed (If-Range).
+        Otherwise, the file is downloaded again.
+        """
+        self.hasher = hashlib.sha256()
+        self.size = 0
+
+        if self.validator is None and os.path.exists(self.part_file):
+            try:
+                with open(self.validator_file, 'r', encoding='utf-8') as f:
+                    self.validator = f.read().strip() or None
+            except OSError:
+                pass
+
+            if self.validator is None:
+                self.discard()
+
+        try:
+            with open(self.part_file, 'rb') as f:
+                while True:
+                    chunk = f.read(cache.HASH_BUFSIZE)
+                    if not chunk:
+                        break
+                    self.hasher.update(chunk)
+                    self.size += len(chunk)
+        except FileNotFoundError:
+            pass
+
+        self.t.n = self.size
+        self.t.refresh()
+
+    def _reset(self):
+        self.hasher = hashlib.sha256()
+        self.size = 0
+        self.t.reset(self.total)
+
+    def _update_validator(self, resp):
+        etag = resp.headers.get('ETag')
+        validator = etag if etag and not etag.startswith('W/') else resp.headers.get('Last-Modified')
+
+        if not validator:
+            # A new file without validator
+            if resp.status_code != 206:
+                self.validator = None
+                cache.remove_entry(self.validator_file)
+        elif validator != self.validator:
+            self.validator = validator
+
+            # Stored for continuing the download in a later call
+            tmp_file = self.validator_file + cache.TMP_SUFFIX
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                f.write(validator)
+            os.replace(tmp_file, self.validator_file)
+
+    def _set_total(self, total: Optional[int]):
+        self.total = total
+        self.t.total = total
+        self.t.refresh()
+
+    def download_stream(self, retries: int):
+        """Downloads the rest of the file with a single connection, starting at the end of the .part file"""
+        _retry(self._download_stream_once, lambda: self.size, retries)
+
+    def _download_stream_once(self):
+        headers = {}
+        if self.size:
+            headers['Range'] = 'bytes=%d-' % self.size
+            # Only resume if the file on the server has not changed
+            if self.validator:
+                headers['If-Range'] = self.validator
+
+        with http_session.get(self.url, headers=headers, stream=True) as resp:
+            if resp.status_code == 416 and self.size and self.size == _get_range_total(resp, self.total):
+                # The .part file is already complete
+                self.total = self.size
+                return
+            resp.raise_for_status()
+
+            if self.size and resp.status_code == 206 and _get_range_start(resp) != self.size:
+                # Unexpected range, download the whole file again
+                self._reset()
+                raise _RetryNow()
+
+            if self.size and resp.status_code != 206:
+                # The server sent the whole file
+                self._reset()
+
+            self._update_validator(resp)
+            self._set_total(_get_range_total(resp, None) if resp.status_code == 206 else
+                            http_session.parse_int(resp.headers.get('Content-Length')))
+
+            with open(self.part_file, 'ab' if self.size else 'wb') as f:
+                for chunk in resp.iter_content(DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+                    self.hasher.update(chunk)
+                    self.size += len(chunk)
+                    self.t.update(len(chunk))
+
+            # Older urllib3 versions do not raise an error for incomplete responses
+            if self.total is not None and self.size < self.total:
+                raise requests.ConnectionError('Verbindung nach %d von %d Bytes unterbrochen' %
+                                               (self.size, self.total))
+
+    def download_segments(self, n_segments: int, retries: int):
+        """
+        Downloads the file in concurrent segments (byte ranges) if the server supports range requests.
+        The segments are written into the preallocated .part file.
+
+        If a segment fails, the .part file is truncated to its completed part at the beginning,
+        so that the download can be continued with a single connection.
+        """
+        try:
+            with http_session.get_session().head(self.url, timeout=http_session.TIMEOUT,
+                                                 allow_redirects=True) as resp:
+                if not resp.ok or resp.headers.get('Accept-Ranges', '').lower() != 'bytes':
+                    return
+                total = http_session.parse_int(resp.headers.get('Content-Length'))
+                self._update_validator(resp)
+        except requests.RequestException:
+            return
+
+        if not total or not self.validator:
+            return
+
+        n_segments = max(1, min(n_segments, total // MIN_SEGMENT_SIZE))
+        if n_segments == 1:
+            return
+
+        self._set_total(total)
+        bounds = [total * i // n_segments for i in range(n_segments + 1)]
+        # Position up to which each segment has been written
+        positions = bounds[:-1]
+
+        _preallocate(self.part_file, total)
+        fd = os.open(self.part_file, os.O_WRONLY | getattr(os, 'O_BINARY', 0))
+
+        def download_segment(i: int):
+            _retry(lambda: self._download_segment_once(fd, positions, i, bounds[i + 1]),
+                   lambda: positions[i], retries)
+
+        try:
+            with ThreadPoolExecutor(n_segments) as executor:
+                futures = [executor.submit(download_segment, i) for i in range(n_segments)]
+                errors = [future.exception() for future in futures]
+        finally:
+            os.close(fd)
+
+        if any(errors):
+            # Keep the downloaded data at the beginning of the file
+            complete = 0
+            for i in range(n_segments):
+                complete = positions[i]
+                if positions[i] < bounds[i + 1]:
+                    break
+
+            with open(self.part_file, 'r+b') as f:
+                f.truncate(complete)
+
+            if not any(isinstance(e, _SegmentsNotSupported) for e in errors):
+                raise next(e for e in errors if e)
+
+    def _download_segment_once(self, fd: int, positions: list, i: int, end: int):
+        start = positions[i]
+        if start >= end:
+            return
+
+        headers = {'Range': 'bytes=%d-%d' % (start, end - 1), 'If-Range': self.validator}
+
+        with http_session.get(self.url, headers=headers, stream=True) as resp:
+            resp.raise_for_status()
+
+            # The server sent the whole file (e.g. because it has changed)
+            if resp.status_code != 206 or _get_range_start(resp) != start:
+                raise _SegmentsNotSupported()
+
+            for chunk in resp.iter_content(DOWNLOAD_CHUNK_SIZE):
+                chunk = chunk[:end - positions[i]]
+                _pwrite(fd, chunk, positions[i])
+                positions[i] += len(chunk)
+
+                with self._lock:
+                    self.t.update(len(chunk))
+
+                if positions[i] >= end:
+                    break
+
+            if positions[i] < end:
+                raise requests.ConnectionError('Verbindung nach %d von %d Bytes unterbrochen' %
+                                               (positions[i] - start, end - start))
+
+
+class _RetryNow(Exception):
+    """Retry the download immediately"""
+
+
+class _SegmentsNotSupported(Exception):
+    """The server does not send the requested segment"""
+
+
+def _retry(func: Callable, get_progress: Callable[[], int], retries: int):
+    """
+    Calls func until it returns without an error from _RETRY_EXCEPTIONS.
+    The retry counter is reset as long as the download progresses.
+    """
+    failed_attempts = 0
+
+    while True:
+        start = get_progress()
+        try:
+            return func()
+        except _RetryNow:
+            pass
+        except _RETRY_EXCEPTIONS:
+            failed_attempts = 0 if get_progress() > start else failed_attempts + 1
+            if failed_attempts > retries:
+                raise
+            if failed_attempts:
+                time.sleep(DOWNLOAD_RETRY_DELAY * 2 ** (failed_attempts - 1))
+
+
+def _preallocate(file: str, size: int):
+    """Creates a file with the given size, reserving the disk space if supported"""
+    with open(file, 'wb') as f:
+        if hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(f.fileno(), 0, size)
+                return
+            except OSError:
+                pass
+        f.truncate(size)
+
+
+_pwrite_lock = threading.Lock()
+
+
+def _pwrite(fd: int, data: bytes, offset: int):
+    """Writes data to the given position of a file (positional write, emulated on Windows)"""
+    if hasattr(os, 'pwrite'):
+        while data:
+            written = os.pwrite(fd, data, offset)
+            data = data[written:]
+            offset += written
+        return
+
+    with _pwrite_lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        while data:
+            data = data[os.write(fd, data):]
+
+
+def _get_range_start(resp) -> Optional[int]:
+    """Returns the first byte position from the Content-Range header of a partial response"""
+    match = re.match(r'bytes (\d+)-', resp.headers.get('Content-Range', ''))
+    return int(match.group(1)) if match else None
+
+
+def _get_range_total(resp, default: Optional[int]) -> Optional[int]:
+    """Returns the file size from the Content-Range header (``bytes 0-99/1000`` or ``bytes */1000``)"""
+    content_range = resp.headers.get('Content-Range')
+    if not content_range:
+        return default
+    return http_session.parse_int(content_range.rpartition('/')[2])
+
+
+def write_sha256(file: str, digest: str):
+    """Writes the SHA-256 hash of a file to file.sha256 (sha256sum format)"""
+    sha_file = file + SHA256_SUFFIX
+    tmp_file = sha_file + cache.TMP_SUFFIX
+
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        f.write('%s  %s\n' % (digest, os.path.basename(file)))
+    os.replace(tmp_file, sha_file)
+
+
+def read_sha256(file: str) -> Optional[str]:
+    """
+    Returns the SHA-256 hash of a file stored by the downloader.
+    None if there is no hash or if the file has been modified after the hash was written.
+    """
+    sha_file = file + SHA256_SUFFIX
+
+    try:
+        if os.stat(sha_file).st_mtime_ns < os.stat(file).st_mtime_ns:
+            return None
+
+        with open(sha_file, 'r', encoding='utf-8') as f:
+            digest, name = f.read().rstrip('\n').split('  ', 1)
+    except (OSError, ValueError):
+        return None
+
+    if name == os.path.basename(file) and re.fullmatch(r'[0-9a-f]{64}', digest):
+        return digest
+    return None
@@ -1,6 +1,11 @@
+import hashlib
+import json
 import os
 import re
-import subprocess
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 from datetime import datetime
 from typing import Iterable, Optional
 
@@ -8,19 +13,33 @@ import click
 from importlib_resources import files
 
 from spotify_gender_ex import __version__
-from spotify_gender_ex import downloader, appstore, notify
+from spotify_gender_ex import downloader, appstore, notify, scanner, arsc, repack, cache, checkpoint, pipeline, \
+    blob_store
 from spotify_gender_ex.replacement_table import ReplacementManager, ReplacementTable
 from spotify_gender_ex.workdir import Workdir
 
 _SPOTIFY_CERT_SHA256 = '6505b181933344f93893d586e399b94616183f04349cb572a9e81a3335e28ffd'
+_LICENSES_FILE = 'assets/licenses.xhtml'
+
+# Maximum size of the decode cache in bytes
+DECODE_CACHE_MAX_SIZE = 2 * 1024 ** 3
+# Maximum size of the host-wide APK store in bytes
+BLOB_STORE_MAX_SIZE = 1024 ** 3
 
 
 class GenderEx:
     def __init__(self, apk_file='', folder_out='.', replacement_tables: Optional[Iterable[str]] = None, builtin=False,
                  no_internal=False,
-                 no_interaction=False, ks_password='', key_password='', gotify_url=''):
+                 no_interaction=False, ks_password='', key_password='', gotify_url='', processes=1,
+                 engine='tree', rt_ttl=downloader.RTABLE_CACHE_TTL, arsc_mode=False, resume=False,
+                 download_segments=1, blob_store_dir=''):
         self.spotify_version = ''
         self.noia = no_interaction
+        self.processes = processes
+        self.engine = engine
+        self.arsc_mode = arsc_mode
+        self.arsc_apk = None
+        self.download_segments = download_segments
         self.ks_password = ks_password or '12345678'
         self.key_password = key_password or '12345678'
 
@@ -28,44 +47,81 @@ class GenderEx:
         self.file_apktool = str(files('spotify_gender_ex.lib').joinpath('apktool.jar'))
         self.file_apksigner = str(files('spotify_gender_ex.lib').joinpath('uber-apk-signer-1.2.1.jar'))
 
-        self.workdir = Workdir(folder_out, self.ks_password, self.key_password)
+        self.workdir = Workdir(folder_out, self.ks_password, self.key_password, clear_tmp=not resume,
+                               create_keystore=False)
         self.rtm = ReplacementManager(self.workdir.dir_apk, self._get_missing_replacement)
 
+        # The app stores and GitHub are queried concurrently.
+        # The stores are not needed if a local APK file is given.
+        local_apk = bool(apk_file) and os.path.isfile(apk_file)
+        use_github = not no_internal and not builtin
+
+        executor = ThreadPoolExecutor(2)
+        future_app = executor.submit(appstore.get_spotify_app) if not local_apk else None
+        future_rtab = executor.submit(downloader.get_replacement_table_raw, self.workdir.dir_cache, rt_ttl) \
+            if use_github else None
+        # Requests exceeding their deadline are abandoned. Their worker threads keep running
+        # until the request ends, which the interpreter waits for on exit. This is limited by
+        # the timeouts of the HTTP session (http_session.TIMEOUT per attempt), not by the deadlines.
+        executor.shutdown(wait=False)
+
         # Downloader
         self.spotify_app = None
-        try:
-            self.spotify_app = appstore.get_spotify_app()
-        except appstore.StoreException:
-            click.echo('Spotify-App konnte nicht abgerufen werden')
+        if future_app:
+            try:
+                self.spotify_app = future_app.result(timeout=appstore.STORE_DEADLINE + 1)
+            except (appstore.StoreException, TimeoutError):
+                click.echo('Spotify-App konnte nicht abgerufen werden')
 
-        if apk_file and os.path.isfile(apk_file):
+        if local_apk:
             self.workdir.file_apk = apk_file
 
+        # Downloaded APK files shared with other working directories
+        self.blob_store = blob_store.BlobStore(blob_store_dir or blob_store.get_default_path())
+
         self.file_apkout = ''
         self.file_rtabout = ''
+        self.file_scan = ''
+
+        self.verified = False
+        self._apk_sha256 = ('', None)
+        self._apk_sha256_lock = threading.Lock()
+
+        # Stage checkpoints
+        self.checkpoints = checkpoint.Checkpoints(self.workdir.file_checkpoints)
+        self.resume_stage = checkpoint.STAGES[0]
 
         # Replacement tables
         if not no_internal:
             # If we can, use the latest replacement table from GitHub
             got_rt = False
 
-            if not builtin:
+            if use_github:
                 try:
-                    rtab_raw = downloader.get_replacement_table_raw()
-                    rt = ReplacementTable.from_string(rtab_raw)
-                    self.rtm.add_rtab(rt, 'builtin (GitHub)')
-                    got_rt = True
-                except Exception:
-                    pass
+                    rtab_raw = future_rtab.result(timeout=downloader.RTABLE_DEADLINE)
+                except TimeoutError:
+                    # Use the last table fetched from GitHub
+                    rtab_raw, _ = downloader.read_rtable_cache(self.workdir.dir_cache)
+                    click.echo('Zeitüberschreitung beim Abrufen der Ersetzungstabelle. Verwende %s Tabelle.' %
+                               ('zwischengespeicherte' if rtab_raw else 'eingebaute'))
+
+                if rtab_raw:
+                    try:
+                        rt = ReplacementTable.from_string(rtab_raw, self.workdir.dir_rtcache)
+                        self.rtm.add_rtab(rt, 'builtin (GitHub)')
+                        got_rt = True
+                    except Exception as e:
+                        click.echo('Ersetzungstabelle von GitHub ist ungültig, verwende eingebaute Tabelle: %s' % e)
 
             if not got_rt:
-                rt = ReplacementTable.from_file(files('spotify_gender_ex.res').joinpath('replacements.json'))
+                rt = ReplacementTable.from_file(files('spotify_gender_ex.res').joinpath('replacements.json'),
+                                                self.workdir.dir_rtcache)
                 self.rtm.add_rtab(rt, 'builtin (lokal)')
         if replacement_tables:
             for rtfile in replacement_tables:
                 if os.path.isfile(rtfile):
                     # If replacement table specified, make it the only table
-                    rt = ReplacementTable.from_file(rtfile)
+                    rt = ReplacementTable.from_file(rtfile, self.workdir.dir_rtcache)
                     self.rtm.add_rtab(rt, 'custom (%s)' % rtfile)
 
         # Notifier
@@ -73,11 +129,112 @@ class GenderEx:
         if gotify_url:
             self.notifier = notify.Notifier(gotify_url)
 
+    def resume(self, require_verified=True) -> Optional[str]:
+        """
+        Resumes a previous run at the first stage without a valid checkpoint.
+        The state of the completed stages is restored.
+
+        Since the replacements are made in place, an incomplete replacement stage is
+        restarted from the decompilation. In arsc mode, the modified resource table is only kept
+        in memory, so the app has to be read again to resume the replacement or recompilation.
+
+        :param require_verified: Do not skip the verification if the signature has not been verified
+        :return: Stage to resume at (None if all stages have been completed)
+        """
+        stage = self.checkpoints.get_resume_stage(self._get_stage_inputs)
+
+        if stage and self.arsc_mode and stage in ('replace', 'recompile'):
+            stage = 'decompile'
+        elif stage == 'replace':
+            stage = 'decompile'
+
+        self.resume_stage = stage
+
+        if require_verified and self.is_stage_done('verify') and \
+                not self.checkpoints.get_state('verify')['verified']:
+            self.resume_stage = 'verify'
+
+        for done_stage in checkpoint.STAGES:
+            if not self.is_stage_done(done_stage):
+                break
+            self._restore_stage_state(done_stage, self.checkpoints.get_state(done_stage))
+
+        return self.resume_stage
+
+    def is_stage_done(self, stage: str) -> bool:
+        """Returns True if the stage is skipped because it has been completed in a previous run"""
+        return self.resume_stage is None or \
+            checkpoint.STAGES.index(stage) < checkpoint.STAGES.index(self.resume_stage)
+
+    def run_stage(self, stage: str, *funcs) -> bool:
+        """
+        Runs the functions of a stage and records its checkpoint.
+        If a function returns False, the stage is aborted.
+        """
+        start = time.monotonic()
+
+        for func in funcs:
+            if func() is False:
+                return False
+
+        self.checkpoints.record(stage, self._get_stage_inputs(stage), self._get_stage_outputs(stage),
+                                self._get_stage_state(stage), time.monotonic() - start,
+                                {self.workdir.file_apk: self.get_apk_sha256()})
+        return True
+
+    def _get_stage_inputs(self, stage: str) -> dict:
+        if stage == 'download':
+            return {'apk_file': os.path.abspath(self.workdir.file_apk)}
+
+        return {
+            'apk': self.get_apk_sha256(),
+            'rt_versions': self.rtm.get_rt_versions(True),
+            'genderex_version': __version__,
+            'arsc_mode': self.arsc_mode,
+        }
+
+    def _get_stage_outputs(self, stage: str) -> list:
+        if stage == 'download':
+            return [self.workdir.file_apk]
+        if stage in ('decompile', 'replace') and not self.arsc_mode:
+            return [self.workdir.file_apktool]
+        if stage == 'recompile':
+            return [self.workdir.file_apkout]
+        if stage == 'sign':
+            return [file for file in (self.file_apkout, self.file_rtabout) if file]
+        return []
+
+    def _get_stage_state(self, stage: str) -> dict:
+        if stage == 'verify':
+            return {'verified': self.verified}
+        if stage == 'decompile':
+            return {'spotify_version': self.spotify_version}
+        if stage == 'replace':
+            return {'new_replacements': self.rtm.new_replacements.to_string()}
+        if stage == 'sign':
+            return {'file_apkout': self.file_apkout, 'file_rtabout': self.file_rtabout}
+        return {}
+
+    def _restore_stage_state(self, stage: str, state: dict):
+        if stage == 'verify':
+            self.verified = state['verified']
+        elif stage == 'decompile':
+            self.spotify_version = state['spotify_version']
+        elif stage == 'replace':
+            self.rtm.new_replacements = ReplacementTable.from_string(state['new_replacements'])
+        elif stage == 'sign':
+            self.file_apkout = state['file_apkout']
+            self.file_rtabout = state['file_rtabout']
+
     def is_operational(self) -> bool:
         return self.spotify_app is not None or os.path.isfile(self.workdir.file_apk)
 
     def is_latest_spotify_processed(self) -> bool:
         """Check if the latest spotify version is already processed"""
+        # Without the store version (e.g. with a local APK file), it is unknown
+        if not self.get_spotify_store_version():
+            return False
+
         # Check spotify_version.txt
         if os.path.isfile(self.workdir.file_version):
             with open(self.workdir.file_version, encoding='utf-8') as f:
@@ -94,7 +251,9 @@ class GenderEx:
 
     def download(self) -> bool:
         """
-        Download the Spotify app from uptodown.com if it is not present
+        Download the Spotify app from the app store if it is not present.
+        If the app has already been downloaded (by any GenderEx working directory),
+        it is taken from the host-wide APK store.
 
         Default APK location: GenderEx/tmp/app.apk
         """
@@ -102,25 +261,174 @@ class GenderEx:
             msg = 'APK-Datei existiert bereits, Download übersprungen.'
             click.echo(msg)
             return True
-        else:
-            return downloader.download_file(self.spotify_app.download_url, self.workdir.file_apk,
-                                            'Spotify ' + self.spotify_app.version)
+
+        sha256 = self.blob_store.lookup(self.spotify_app)
+        if sha256 and self.blob_store.get(sha256, self.workdir.file_apk):
+            click.echo('Spotify %s aus dem APK-Speicher übernommen: %s' %
+                       (self.spotify_app.version, self.blob_store.get_blob(sha256)))
+            return True
+
+        if not downloader.download_file(self.spotify_app.download_url, self.workdir.file_apk,
+                                        'Spotify ' + self.spotify_app.version,
+                                        segments=self.download_segments):
+            return False
+
+        try:
+            self.blob_store.insert(self.workdir.file_apk, self.get_apk_sha256(), self.spotify_app)
+            self.blob_store.evict(BLOB_STORE_MAX_SIZE)
+        except OSError as e:
+            click.echo('APK-Datei konnte nicht im APK-Speicher abgelegt werden: %s' % e)
+        return True
 
     def verify(self):
         """Check if the Spotify apk file is genuine by verifying its certificate"""
         cmd = ['java', '-jar', self.file_apksigner, '-y', '--verifySha256', _SPOTIFY_CERT_SHA256,
                '-a', self.workdir.file_apk]
 
-        subprocess.run(cmd, check=True)
+        pipeline.run_command(cmd)
+        self.verified = True
+
+    def get_apk_sha256(self) -> str:
+        """
+        Returns the SHA-256 hash of the APK file (only computed again if the file has changed).
+        The hash of a downloaded APK file is taken from the downloader.
+        """
+        with self._apk_sha256_lock:
+            stat = os.stat(self.workdir.file_apk)
+            file_id = (stat.st_size, stat.st_mtime_ns)
+
+            if self._apk_sha256[1] != file_id:
+                digest = downloader.read_sha256(self.workdir.file_apk) or cache.sha256_file(self.workdir.file_apk)
+                self._apk_sha256 = (digest, file_id)
+            return self._apk_sha256[0]
+
+    def _get_output_key(self) -> str:
+        """
+        Key of the output cache, identifies the input data of a run:
+        APK file, replacement tables, GenderEx version and processing mode
+        """
+        key_data = '\n'.join((self.get_apk_sha256(), self.rtm.get_rt_versions(True), __version__,
+                              'arsc' if self.arsc_mode else 'apktool'))
+        return hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+
+    def _read_output_manifest(self) -> dict:
+        try:
+            with open(self.workdir.file_output_manifest, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_output_manifest(self, manifest: dict):
+        tmp_file = '%s.%d.tmp' % (self.workdir.file_output_manifest, os.getpid())
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_file, self.workdir.file_output_manifest)
+
+    def restore_cached_output(self, require_verified=True) -> bool:
+        """
+        Checks if the same input data has already been processed (see output manifest in
+        GenderEx/output). If the output files of this run still exist and are unchanged
+        (verified by their SHA-256 hashes), they are used instead of running the pipeline again.
+
+        :param require_verified: Only use output created from an APK file whose signature has been verified
+        :return: True if the cached output is used
+        """
+        entry = self._read_output_manifest().get(self._get_output_key())
+        if not entry or (require_verified and not entry.get('verified')):
+            return False
+
+        files_out = {}
+        for name in ('apk', 'rtab'):
+            if not entry.get(name):
+                continue
+
+            file = os.path.join(self.workdir.dir_output, *entry[name].split('/'))
+            try:
+                if cache.sha256_file(file) != entry[name + '_sha256']:
+                    return False
+            except OSError:
+                return False
+            files_out[name] = file
+
+        if 'apk' not in files_out:
+            return False
+
+        self.spotify_version = entry['spotify_version']
+        self.file_apkout = files_out['apk']
+        self.file_rtabout = files_out.get('rtab', '')
+
+        if self.file_rtabout:
+            self.rtm.new_replacements = ReplacementTable.from_file(self.file_rtabout)
+
+        self._write_version_file()
+        return True
+
+    def _store_output(self):
+        """Adds the output files of this run to the output manifest"""
+        entry = {
+            'spotify_version': self.spotify_version,
+            'verified': self.verified,
+        }
+
+        for name, file in (('apk', self.file_apkout), ('rtab', self.file_rtabout)):
+            if file and os.path.isfile(file):
+                entry[name] = os.path.relpath(file, self.workdir.dir_output).replace(os.sep, '/')
+                entry[name + '_sha256'] = cache.sha256_file(file)
+
+        # Output files with the same name have been replaced, so their entries are invalid
+        manifest = {key: other for key, other in self._read_output_manifest().items()
+                    if other.get('apk') != entry.get('apk')}
+        manifest[self._get_output_key()] = entry
+        self._write_output_manifest(manifest)
 
     def decompile(self):
-        """Decompiles Spotify using APKTool"""
-        subprocess.run(
-            ['java', '-jar', self.file_apktool, 'd', self.workdir.file_apk, '-s', '-o', self.workdir.dir_apk],
-            check=True)
+        """
+        Decompiles Spotify using APKTool.
 
-        # Check if decompile was successful
-        assert os.path.isfile(self.workdir.file_apktool)
+        The decompiled app is stored in the decode cache (GenderEx/cache/decoded), keyed by the
+        SHA-256 hashes of the APK file and APKTool. If the same APK file has been decompiled before,
+        the decompiled app is restored from the cache using hardlinks instead of running APKTool.
+
+        In arsc mode, only the resource table is read from the APK file instead.
+        """
+        if self.arsc_mode:
+            click.echo('arsc-Modus: APKTool übersprungen, lese resources.arsc')
+            self.arsc_apk = arsc.ArscApk(self.workdir.file_apk)
+            return
+
+        dir_cached = os.path.join(self.workdir.dir_decodecache, self._get_decode_key())
+
+        # Remove the output of an incomplete previous run
+        shutil.rmtree(self.workdir.dir_apk, ignore_errors=True)
+
+        if os.path.isdir(dir_cached):
+            click.echo('Dekompilierte App aus dem Cache wiederhergestellt')
+            cache.hardlink_tree(dir_cached, self.workdir.dir_apk)
+            cache.touch_entry(dir_cached)
+        else:
+            pipeline.run_command(
+                ['java', '-jar', self.file_apktool, 'd', self.workdir.file_apk, '-s', '-o', self.workdir.dir_apk])
+
+            # Check if decompile was successful
+            assert os.path.isfile(self.workdir.file_apktool)
+
+            self._store_decoded(dir_cached)
+
+    def _get_decode_key(self) -> str:
+        return '%s-%s' % (self.get_apk_sha256(), cache.sha256_file(self.file_apktool)[:16])
+
+    def _store_decoded(self, dir_cached: str):
+        """Stores the freshly decompiled app in the decode cache"""
+        tmp_dir = '%s%s.%d' % (dir_cached, cache.TMP_SUFFIX, os.getpid())
+
+        try:
+            cache.hardlink_tree(self.workdir.dir_apk, tmp_dir)
+            os.replace(tmp_dir, dir_cached)
+        except OSError:
+            cache.remove_entry(tmp_dir)
+            return
+
+        cache.evict_lru(self.workdir.dir_decodecache, DECODE_CACHE_MAX_SIZE)
 
     def check_compatibility(self):
         """Checks if the decompiled Spotify version is compatible with all replacement tables"""
@@ -132,25 +440,61 @@ class GenderEx:
         else:
             click.echo('Erwarte, manuelle Anpassungen vornehmen zu müssen.')
 
+    def scan(self):
+        """
+        Scans the string resources of all locales for suspicious fields without replacement rules.
+
+        Output file: GenderEx/output/scan/scan-<version>.json
+        """
+        if self.arsc_mode:
+            click.echo('Der Scan benötigt die dekompilierte App und ist im arsc-Modus nicht verfügbar.')
+            return
+
+        report, unreplaceable = scanner.scan_resources(self.workdir.dir_apk, self.rtm, self.processes)
+        n_fields = sum(len(fields) for fields in report.values())
+        n_unreplaceable = sum(len(fields) for fields in unreplaceable.values())
+
+        self.file_scan = self.workdir.get_file_scan(self.spotify_version, self.rtm.get_version_string())
+        scanner.write_report(report, self.spotify_version, self.file_scan, unreplaceable)
+
+        click.echo('%d verdächtige Felder ohne Ersetzungsregel in %d Dateien gefunden' % (n_fields, len(report)))
+        if n_unreplaceable:
+            click.echo('%d verdächtige Texte können nicht ersetzt werden (Formatierungen, Listen ohne Attribute)'
+                       % n_unreplaceable)
+        click.echo('Bericht gespeichert: ' + self.file_scan)
+
     def recompile(self):
         """
         Recompiles the Spotify app using APKTool.
+        The output APK is repacked with the unchanged entries copied from the original APK.
+
+        In arsc mode, the APK file is written with the modified resource table instead.
 
         Output file: GenderEx/tmp/app_out.apk
         """
+        if self.arsc_mode:
+            click.echo('Schreibe ' + self.workdir.file_apkout)
+            self.arsc_apk.to_file(self.workdir.file_apkout)
+            return
+
         # Apply necessary patches
         self.patch_v8_8()
 
         click.echo('Rekompiliere nach ' + self.workdir.file_apkout)
-        subprocess.run(['java', '-jar', self.file_apktool, 'b', '--use-aapt2',
-                        self.workdir.dir_apk, '-o', self.workdir.file_apkout], check=True)
+        pipeline.run_command(['java', '-jar', self.file_apktool, 'b', '--use-aapt2',
+                              self.workdir.dir_apk, '-o', self.workdir.file_apkbuilt])
 
         # Check if compile was successful
-        assert os.path.isfile(self.workdir.file_apkout)
+        assert os.path.isfile(self.workdir.file_apkbuilt)
+
+        repack.repack_apk(self.workdir.file_apkout, self.workdir.file_apk, self.workdir.file_apkbuilt)
 
     def replace(self):
         """Executes all replacements"""
-        n_replaced, n_newrpl = self.rtm.do_replace()
+        if self.arsc_mode:
+            n_replaced, n_newrpl = self.rtm.do_replace_table(self.arsc_apk.table)
+        else:
+            n_replaced, n_newrpl = self.rtm.do_replace(processes=self.processes, engine=self.engine)
 
         click.echo('%d Ersetzungen vorgenommen' % n_replaced)
         click.echo('%d neue Ersetzungsregeln hinzugefügt' % n_newrpl)
@@ -192,9 +536,18 @@ class GenderEx:
             text = f.read()
 
         text = text.replace(old, new)
+        GenderEx._write_file(file, text)
 
-        with open(file, 'w', encoding='utf-8') as f:
+    @staticmethod
+    def _write_file(file, text: str):
+        """
+        Writes a file of the decompiled app. The file is replaced instead of being overwritten,
+        since it might be hardlinked to the decode cache.
+        """
+        tmp_file = file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
             f.write(text)
+        os.replace(tmp_file, file)
 
     def get_spotify_store_version(self) -> str:
         if self.spotify_app:
@@ -204,6 +557,9 @@ class GenderEx:
 
     def get_spotify_version(self) -> str:
         """Reads the Spotify version number from the decompiled app."""
+        if self.arsc_mode:
+            return self.arsc_apk.version_name
+
         with open(self.workdir.file_apktool, 'r', encoding='utf-8') as f:
             text = f.read()
 
@@ -220,12 +576,16 @@ class GenderEx:
         """
         # Read the credits file
         credits_file = files('spotify_gender_ex.res').joinpath('credits.html')
-        html_file = os.path.join(self.workdir.dir_apk, 'assets', 'licenses.xhtml')
 
         with open(credits_file, 'r', encoding='utf-8') as f:
             cred = f.read()
-        with open(html_file, 'r', encoding='utf-8') as f:
-            html = f.read()
+
+        if self.arsc_mode:
+            html = self.arsc_apk.read_file(_LICENSES_FILE).decode('utf-8')
+        else:
+            html_file = os.path.join(self.workdir.dir_apk, *_LICENSES_FILE.split('/'))
+            with open(html_file, 'r', encoding='utf-8') as f:
+                html = f.read()
 
         # Fill in template
         cred = cred.replace('{{SPOTIFY_VERSION}}', self.spotify_version)
@@ -246,17 +606,21 @@ class GenderEx:
         html = html[:pos] + cred + html[pos:]
 
         # Write back the html
-        with open(html_file, 'w', encoding='utf-8') as f:
-            f.write(html)
+        if self.arsc_mode:
+            self.arsc_apk.write_file(_LICENSES_FILE, html.encode('utf-8'))
+        else:
+            self._write_file(html_file, html)
 
     def sign(self):
         """Signs the APK file using UberAPKSigner and copies the app into the output folder"""
+        self.workdir.create_keystore()
+
         cmd = ['java', '-jar', self.file_apksigner,
                '-a', self.workdir.file_apkout, '-o', self.workdir.dir_output,
                '--ks', self.workdir.file_keystore, '--ksAlias', 'genderex', '--ksPass', self.ks_password,
                '--ksKeyPass', self.key_password]
 
-        subprocess.run(cmd, check=True)
+        pipeline.run_command(cmd)
 
         rtver = self.rtm.get_version_string()
 
@@ -264,14 +628,21 @@ class GenderEx:
         self.file_apkout = self.workdir.get_file_apkout(self.spotify_version, rtver)
         os.renames(self.workdir.file_apkout_signed, self.file_apkout)
 
-        # Write spotify_version.txt
-        with open(self.workdir.file_version, 'w', encoding='utf-8') as f:
-            f.write('%s-%s' % (self.spotify_version, self.rtm.get_rt_versions()))
+        self._write_version_file()
 
         # Save new replacements
         self.file_rtabout = self.workdir.get_file_newrepl(self.spotify_version, rtver)
         if self.rtm.write_new_replacements(self.spotify_version, self.file_rtabout):
             click.echo('Neue Ersetzungstabelle gespeichert')
+        else:
+            self.file_rtabout = ''
+
+        self._store_output()
+
+    def _write_version_file(self):
+        """Write spotify_version.txt"""
+        with open(self.workdir.file_version, 'w', encoding='utf-8') as f:
+            f.write('%s-%s' % (self.spotify_version, self.rtm.get_rt_versions()))
 
     def notify(self):
         if self.notifier is not None:
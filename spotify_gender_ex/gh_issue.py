@@ -142,7 +142,7 @@ def parse_issue(rtable: ReplacementTable, issue_body: str, comment_body: str) ->
     if len(entries) != len(original_values) or len(entries) != len(new_values):
         raise Exception('Inconsistent input data lengths')
 
-    rtable_original_json = rtable.to_string()
+    rtable_original_hash = rtable.md5_hash()
 
     rtable.spotify_addversion(spotify_version)
 
@@ -157,4 +157,4 @@ def parse_issue(rtable: ReplacementTable, issue_body: str, comment_body: str) ->
         rset = rtable.make_set_from_langfile(file)
         rset.add(key, original_val, new_val)
 
-    return rtable_original_json != rtable.to_string(), len(entries), spotify_version
+    return rtable_original_hash != rtable.md5_hash(), len(entries), spotify_version
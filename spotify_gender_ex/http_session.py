@@ -0,0 +1,91 @@
+# coding=utf-8
+"""
+Shared HTTP session for the app stores and the downloader.
+
+All requests go through one requests.Session, so connections are kept alive and reused
+(connection pool per host). Failed connections, read errors and temporary server errors
+(429/5xx) are retried with exponential backoff. Every request has a timeout.
+"""
+import threading
+from typing import Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Timeout for HTTP requests: (connect, read) in seconds
+TIMEOUT = (5, 10)
+
+RETRIES = 2
+BACKOFF_FACTOR = 0.5
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+# Maximum number of kept-alive connections per host
+POOL_SIZE = 10
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Returns the shared session (created on first use)"""
+    global _session
+
+    with _session_lock:
+        if _session is None:
+            retry = Retry(total=RETRIES, backoff_factor=BACKOFF_FACTOR, status_forcelist=RETRY_STATUS,
+                          allowed_methods=frozenset(('GET', 'HEAD')), raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retry)
+
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+
+    return _session
+
+
+def get(url: str, headers: Optional[dict] = None, timeout=TIMEOUT, **kwargs) -> requests.Response:
+    """
+    GET request using the shared session.
+    Streamed responses (stream=True) have to be closed to release the connection (use them in a with block).
+    """
+    return get_session().get(url, headers=headers, timeout=timeout, **kwargs)
+
+
+def probe_file(url: str, headers: Optional[dict] = None, timeout=TIMEOUT) -> Tuple[Optional[str], Optional[int]]:
+    """
+    Gets the content type and size of a file without downloading it.
+
+    A HEAD request is sent first. If the server does not support it or does not send
+    the size, the first byte of the file is requested instead (ranged GET).
+
+    :return: Tuple: (Content type, File size in bytes). Both are None if unknown.
+    :raise: requests.RequestException if the file is not available
+    """
+    session = get_session()
+
+    with session.head(url, headers=headers, timeout=timeout, allow_redirects=True) as resp:
+        if resp.ok and resp.headers.get('Content-Length'):
+            return resp.headers.get('Content-Type'), parse_int(resp.headers['Content-Length'])
+
+    range_headers = dict(headers or {})
+    range_headers['Range'] = 'bytes=0-0'
+
+    # The connection is closed right away, even if the server ignores the range and sends the whole file
+    with session.get(url, headers=range_headers, timeout=timeout, stream=True) as resp:
+        resp.raise_for_status()
+        file_type = resp.headers.get('Content-Type')
+
+        if resp.status_code == 206:
+            content_range = resp.headers.get('Content-Range', '')
+            return file_type, parse_int(content_range.rpartition('/')[2])
+        return file_type, parse_int(resp.headers.get('Content-Length'))
+
+
+def parse_int(value: Optional[str]) -> Optional[int]:
+    """Parses a header value as an integer (None if it is missing or invalid)"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
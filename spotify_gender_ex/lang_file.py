@@ -1,12 +1,35 @@
 # coding=utf-8
+import bisect
+import functools
+import itertools
+import mmap
+import os
 import re
-from typing import Callable, List, Optional
+import shutil
+from typing import Callable, Iterator, List, Optional, Tuple
 from xml.etree import ElementTree
+from xml.parsers import expat
 
 GENDER_REGEX = re.compile(
     r'''(\*[iIrRnN])|(\([rRnN]\))|([a-zß-ü][IRN])|(:[iIrRnN](?!nternal))''')
 CLEANR = re.compile('<.*?>|&([a-z0-9]+|#[0-9]{1,6}|#x[0-9a-f]{1,6});')
 
+# Fused scanner, equivalent to GENDER_REGEX.search(cleanhtml(string)).
+# HTML tags and entities are matched (and thereby skipped) by the first alternative.
+# The gender patterns allow tags/entities between their characters, since these would be
+# removed by cleanhtml. The tag/entity patterns cannot match differently when backtracking,
+# so they always skip the same text as CLEANR.
+_TAG = r'(?:<[^>\n]*>|&(?:[a-z0-9]+|#[0-9]{1,6}|#x[0-9a-f]{1,6});)'
+_GAP = _TAG + '*'
+SUSPICIOUS_SCANNER = re.compile(
+    _TAG + '|(' +
+    r'\*{0}[iIrRnN]|\({0}[rRnN]{0}\)|[a-zß-ü]{0}[IRN]|:{0}[iIrRnN](?!{1})'.format(
+        _GAP, ''.join(_GAP + c for c in 'nternal')) + ')')
+
+# Every suspicious string contains one of these character sequences
+SUSPICIOUS_PREFILTER = re.compile(r'[*:(]|[a-zß-ü][IRN<&]')
+SUSPICIOUS_CACHE_SIZE = 65536
+
 
 class LangFile:
 
@@ -23,41 +46,391 @@ class LangFile:
 
         :param fun_repl: Replace function: fun(key, old_value) -> new_value
         """
-        self._walk_tree(self.tree.getroot(), [], fun_repl)
+        for key, text, elm in self.iter_fields():
+            res = fun_repl(key, text)
+            if res:
+                elm.text = res
+
+    def iter_fields(self) -> Iterator[Tuple[str, str, ElementTree.Element]]:
+        """
+        Walk through the XML tree of the language file and yield all language fields.
+
+        All XML tags from the language file have an attribute, either 'name' or 'quantity' (plural file).
+        The first attribute (there is only one) becomes the key to identify the node,
+        nested nodes are addressed by joining the keys with slashes (e.g. ``plural_name/one``).
+        A node containing non-whitespace text is a language field, otherwise its child nodes are visited.
+
+        :return: Generator of language fields: (key, stripped text, XML element)
+        """
+        # Keys of the nodes above the current level and iterators over the levels' child nodes
+        key_list = []
+        stack = [iter(self.tree.getroot())]
+
+        while stack:
+            for elm in stack[-1]:
+                if elm.attrib:
+                    key_list.append(next(iter(elm.attrib.values())))
+                    text = elm.text
+
+                    if text and not text.isspace():
+                        yield '/'.join(key_list), text.strip(), elm
+                        key_list.pop()
+                    else:
+                        # Go deeper
+                        stack.append(iter(elm))
+                        break
+            else:
+                # Level finished
+                stack.pop()
+                if key_list:
+                    key_list.pop()
+
+    def get_fields(self) -> Tuple[List[str], List[str], List[ElementTree.Element]]:
+        """
+        Extract all language fields into flat lists for bulk processing.
+
+        :return: Tuple: (keys, stripped texts, XML elements as handles for ``set_texts``)
+        """
+        keys = []
+        texts = []
+        elements = []
+
+        for key, text, elm in self.iter_fields():
+            keys.append(key)
+            texts.append(text)
+            elements.append(elm)
+
+        return keys, texts, elements
+
+    def set_texts(self, handles: List[ElementTree.Element], texts: List[str]):
+        """
+        Set the texts of the given language fields.
 
-    def _walk_tree(self, tree_node: ElementTree.Element, key_list: List[str],
-                   fun_repl: Callable):
+        :param handles: Field handles from ``get_fields``
+        :param texts: New texts
         """
-        Internal recursive function for walking through the XML tree
-        and replacing language values.
-        
-        :param tree_node: Current tree node
-        :param key_list: List of keys to address the current node
+        for elm, text in zip(handles, texts):
+            elm.text = text
+
+    def to_file(self, file: Optional[str] = None):
+        if not file:
+            file = self.path
+
+        # The file is replaced instead of being overwritten, since it might be hardlinked to the decode cache
+        tmp_file = file + '.tmp'
+        self.tree.write(tmp_file, xml_declaration=True, encoding='utf-8')
+        os.replace(tmp_file, file)
+
+    def replace_to_file(self, fun_repl: Callable, file: Optional[str] = None):
+        """
+        Replace the values of the language file with the given function
+        and write the result to the given file.
+
         :param fun_repl: Replace function: fun(key, old_value) -> new_value
+        :param file: Output file (default: overwrite the language file)
+        """
+        self.replace_tree(fun_repl)
+        self.to_file(file)
+
+
+class StreamingLangFile:
+    """
+    Streaming engine for language files.
+
+    The file is read incrementally using iterparse, the language fields are replaced
+    and the output is written while reading. Already written elements are removed from
+    the tree, so memory usage does not grow with the file size.
+    The output is identical to the output of ``LangFile.replace_tree`` + ``LangFile.to_file``.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def replace_to_file(self, fun_repl: Callable, file: Optional[str] = None):
         """
-        for elm in tree_node:
-            # All XML tags from the language file have an attribute,
-            # either 'name' or 'quantity' (plural file).
-            if len(elm.attrib) > 0:
-                # The first attribute (there is only one) becomes the key to identify the node
-                # This key gets appended to the key_list to form a new key list
-                nkl = key_list + [list(elm.attrib.values())[0]]
-
-                # If the current node contains non-whitespace text, we have found a language field
-                # Call the replacement function with the key and old value
-                if elm.text and elm.text.strip():
-                    res = fun_repl('/'.join(nkl), elm.text.strip())
-                    if res:
-                        elm.text = res
-                # Otherwise we need to go deeper
+        Replace the values of the language file with the given function
+        and write the result to the given file.
+
+        :param fun_repl: Replace function: fun(key, old_value) -> new_value
+        :param file: Output file (default: overwrite the language file)
+        """
+        if not file:
+            file = self.path
+
+        # The output is written to a temporary file first,
+        # since the input file might get overwritten
+        tmp_file = file + '.tmp'
+
+        try:
+            with open(tmp_file, 'w', encoding='utf-8', errors='xmlcharrefreplace') as f:
+                f.write("<?xml version='1.0' encoding='utf-8'?>\n")
+                self._stream(f.write, fun_repl)
+        except BaseException:
+            os.remove(tmp_file)
+            raise
+
+        os.replace(tmp_file, file)
+
+    def _stream(self, write: Callable, fun_repl: Callable):
+        """
+        Internal function for streaming the language file through the replace function.
+
+        The elements are written as soon as their content is known: the start tag and the
+        text of an element either when its first child starts or when it ends, the tail of
+        an element when its next sibling starts or its parent ends.
+
+        :param write: Write function for the output
+        :param fun_repl: Replace function: fun(key, old_value) -> new_value
+        """
+        # Stack of open elements: [element, key list (None if not walked), is_opened, is_field]
+        stack = []
+
+        def open_element(entry):
+            elm, key_list = entry[0], entry[1]
+            text = elm.text
+
+            # Same rules as in LangFile.iter_fields: an element with a key list
+            # (excluding the root) and non-whitespace text is a language field
+            if key_list and text and text.strip():
+                entry[3] = True
+                res = fun_repl('/'.join(key_list), text.strip())
+                if res:
+                    text = res
+
+            write(_start_tag(elm))
+            if text:
+                write(_escape_text(text))
+            entry[2] = True
+
+        def close_child(parent):
+            child = parent[0]
+            if child.tail:
+                write(_escape_text(child.tail))
+            parent.remove(child)
+
+        xmlp = ElementTree.XMLParser(encoding="utf-8")
+        for event, elm in ElementTree.iterparse(self.path, events=('start', 'end'), parser=xmlp):
+            if event == 'start':
+                if not stack:
+                    stack.append([elm, [], False, False])
+                    continue
+
+                parent = stack[-1]
+                if parent[2]:
+                    close_child(parent[0])
+                else:
+                    open_element(parent)
+
+                key_list = None
+                if parent[1] is not None and not parent[3] and len(elm.attrib) > 0:
+                    key_list = parent[1] + [next(iter(elm.attrib.values()))]
+
+                stack.append([elm, key_list, False, False])
+            else:
+                entry = stack.pop()
+
+                if entry[2]:
+                    if len(elm):
+                        close_child(elm)
+                    write('</%s>' % elm.tag)
+                elif elm.text:
+                    open_element(entry)
+                    write('</%s>' % elm.tag)
                 else:
-                    self._walk_tree(elm, nkl, fun_repl)
+                    write(_start_tag(elm, True))
+
+
+class SpliceLangFile:
+    """
+    Byte-preserving engine for language files.
+
+    The language file is parsed with expat, recording the byte range of every language field.
+    When writing, only the changed texts are patched into a copy of the original file,
+    everything else is left byte-identical. Files without changes are not written at all.
+    """
+
+    def __init__(self, path: str):
+        """Open language file at the given path and read its fields"""
+        self.path = path
+        self.fields = self._read_fields()
+        self._splices = []
+
+    def _read_fields(self) -> List[Tuple[str, str, int, int]]:
+        """
+        Internal function for reading the language fields and their positions.
+        The fields are selected by the same rules as in ``LangFile.iter_fields``.
+
+        :return: List of language fields: (key, text, start byte, end byte)
+        """
+        fields = []
+        parser = expat.ParserCreate('utf-8')
+        parser.ordered_attributes = True
+
+        # Stack of open elements: [key list (None if not walked), text chunks, text start, is_decided, is_field]
+        stack = []
+
+        def decide(entry):
+            """Called as soon as the text of an element is complete"""
+            entry[3] = True
+            text = ''.join(entry[1])
+
+            if entry[0] and text.strip():
+                start = entry[2] if entry[2] is not None else parser.CurrentByteIndex
+                fields.append(('/'.join(entry[0]), text.strip(), start, parser.CurrentByteIndex))
+                entry[4] = True
+
+        def start_element(_name, attrs):
+            key_list = []
+
+            if stack:
+                parent = stack[-1]
+                if not parent[3]:
+                    decide(parent)
+
+                key_list = None
+                if parent[0] is not None and not parent[4] and attrs:
+                    key_list = parent[0] + [attrs[1]]
+
+            stack.append([key_list, [], None, False, False])
+
+        def end_element(_name):
+            entry = stack.pop()
+            if not entry[3]:
+                decide(entry)
+
+        def character_data(data):
+            entry = stack[-1]
+            if not entry[3]:
+                if entry[2] is None:
+                    entry[2] = parser.CurrentByteIndex
+                entry[1].append(data)
+
+        def start_cdata():
+            # The text range includes the whole CDATA section, the new text is written escaped
+            entry = stack[-1]
+            if not entry[3] and entry[2] is None:
+                entry[2] = parser.CurrentByteIndex
+
+        parser.StartElementHandler = start_element
+        parser.EndElementHandler = end_element
+        parser.CharacterDataHandler = character_data
+        parser.StartCdataSectionHandler = start_cdata
+
+        with open(self.path, 'rb') as f:
+            parser.ParseFile(f)
+
+        return fields
+
+    def replace_tree(self, fun_repl: Callable):
+        """
+        Call the given function for all language fields and record the changed values.
+
+        :param fun_repl: Replace function: fun(key, old_value) -> new_value
+        """
+        self._splices = []
+
+        for key, text, start, end in self.fields:
+            res = fun_repl(key, text)
+            if res and res != text:
+                self._splices.append((start, end, res))
+
+    def get_fields(self) -> Tuple[List[str], List[str], List[int]]:
+        """
+        Extract all language fields into flat lists for bulk processing.
+
+        :return: Tuple: (keys, stripped texts, field indices as handles for ``set_texts``)
+        """
+        if not self.fields:
+            return [], [], []
+
+        keys, texts, _, _ = (list(col) for col in zip(*self.fields))
+        return keys, texts, list(range(len(self.fields)))
+
+    def set_texts(self, handles: List[int], texts: List[str]):
+        """
+        Record the new texts of the given language fields.
+        Replaces all changes recorded previously.
+
+        :param handles: Field handles from ``get_fields`` in ascending order
+        :param texts: New texts
+        """
+        self._splices = []
+
+        for i, text in zip(handles, texts):
+            _, old, start, end = self.fields[i]
+            if text != old:
+                self._splices.append((start, end, text))
 
     def to_file(self, file: Optional[str] = None):
+        """
+        Write the language file with the changed values patched in.
+        If nothing was changed, the language file is not written (only copied to a different output file).
+        """
         if not file:
             file = self.path
 
-        self.tree.write(file, xml_declaration=True, encoding='utf-8')
+        if not self._splices:
+            if os.path.abspath(file) != os.path.abspath(self.path):
+                shutil.copyfile(self.path, file)
+            return
+
+        tmp_file = file + '.tmp'
+
+        with open(self.path, 'rb') as f_in, open(tmp_file, 'wb') as f_out:
+            with mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                data = memoryview(mm)
+                pos = 0
+
+                for start, end, text in self._splices:
+                    f_out.write(data[pos:start])
+                    f_out.write(_escape_text(text).encode('utf-8'))
+                    pos = end
+
+                f_out.write(data[pos:])
+                data.release()
+
+        os.replace(tmp_file, file)
+
+    def replace_to_file(self, fun_repl: Callable, file: Optional[str] = None):
+        """
+        Replace the values of the language file with the given function
+        and write the result to the given file.
+
+        :param fun_repl: Replace function: fun(key, old_value) -> new_value
+        :param file: Output file (default: overwrite the language file)
+        """
+        self.replace_tree(fun_repl)
+        self.to_file(file)
+
+
+def _start_tag(elm: ElementTree.Element, empty=False) -> str:
+    """Serializes the start tag of an element the same way as ElementTree"""
+    if elm.tag[:1] == '{':
+        raise ValueError('Namespaced tags are not supported: %s' % elm.tag)
+
+    res = '<' + elm.tag
+    for key, value in elm.items():
+        res += ' %s="%s"' % (key, _escape_attrib(value))
+
+    if empty:
+        return res + ' />'
+    return res + '>'
+
+
+def _escape_text(text: str) -> str:
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def _escape_attrib(text: str) -> str:
+    return _escape_text(text).replace('"', '&quot;').replace('\r', '&#13;').replace('\n', '&#10;') \
+        .replace('\t', '&#09;')
+
+
+ENGINES = {
+    'tree': LangFile,
+    'stream': StreamingLangFile,
+    'splice': SpliceLangFile,
+}
 
 
 def cleanhtml(raw_html: str) -> str:
@@ -65,5 +438,48 @@ def cleanhtml(raw_html: str) -> str:
     return re.sub(CLEANR, '', raw_html)
 
 
+@functools.lru_cache(maxsize=SUSPICIOUS_CACHE_SIZE)
 def is_suspicious(string: str) -> bool:
-    return bool(GENDER_REGEX.search(cleanhtml(string)))
+    """
+    Returns True if the string contains gender markers (e.g. Künstler*innen), ignoring HTML tags.
+    Gives the same results as ``GENDER_REGEX.search(cleanhtml(string))`` in a single pass.
+    """
+    if not SUSPICIOUS_PREFILTER.search(string):
+        return False
+
+    for match in SUSPICIOUS_SCANNER.finditer(string):
+        if match.lastindex:
+            return True
+    return False
+
+
+def find_suspicious(strings: List[str]) -> List[int]:
+    """
+    Bulk version of ``is_suspicious``: returns the indices of all suspicious strings.
+
+    The prefilter runs over all strings in a single pass, joined by NUL characters.
+    NUL cannot occur in XML text and is not matched by the prefilter, so no match spans two strings.
+    Only the strings passing the prefilter are checked with the full scanner.
+    """
+    if not strings:
+        return []
+
+    joined = '\0'.join(strings)
+    starts = list(itertools.accumulate(itertools.chain((0,), (len(s) + 1 for s in strings[:-1]))))
+    candidates = []
+    pos = 0
+
+    while True:
+        match = SUSPICIOUS_PREFILTER.search(joined, pos)
+        if not match:
+            break
+
+        i = bisect.bisect_right(starts, match.start()) - 1
+        candidates.append(i)
+
+        # Continue with the next string
+        if i + 1 == len(starts):
+            break
+        pos = starts[i + 1]
+
+    return [i for i in candidates if is_suspicious(strings[i])]
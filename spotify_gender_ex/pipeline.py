@@ -0,0 +1,165 @@
+# coding=utf-8
+"""
+Concurrent executor for the stages of the GenderEx pipeline.
+
+The stages form a dependency graph. Each stage is started on a thread pool as soon as
+all of its dependencies have completed, so independent stages (e.g. verifying and decompiling
+the app) run at the same time. Console output is prefixed with the label of the stage that wrote it,
+this includes the output of external programs started with run_command.
+
+If a stage fails, all stages depending on it are cancelled, while independent stages are completed.
+"""
+import subprocess
+import sys
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Iterable, List, Optional
+
+import click
+
+_local = threading.local()
+
+
+class StageException(Exception):
+    pass
+
+
+class Stage:
+    def __init__(self, name: str, func: Callable, deps: Iterable[str] = (), label=''):
+        """
+        :param name: Name of the stage, referenced by the dependencies of other stages
+        :param func: Function running the stage. The stage fails if it raises an exception or returns False.
+        :param deps: Names of the stages which have to be completed before
+        :param label: Prefix of the console output (default: name)
+        """
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.label = label or name
+
+
+class _StageOutput:
+    """
+    Replacement for sys.stdout/sys.stderr while the stages are running.
+    Each line written by a stage is prefixed with the label of the stage.
+    """
+
+    def __init__(self, stream, lock: threading.Lock):
+        self.stream = stream
+        self._lock = lock
+        self._state = threading.local()
+
+    def write(self, text):
+        label = get_stage_label()
+        if label is None or not isinstance(text, str):
+            return self.stream.write(text)
+
+        chunks = []
+        for line in text.splitlines(True):
+            if getattr(self._state, 'line_start', True):
+                chunks.append('[%s] ' % label)
+            chunks.append(line)
+            self._state.line_start = line.endswith('\n')
+
+        with self._lock:
+            self.stream.write(''.join(chunks))
+        return len(text)
+
+    def flush(self):
+        with self._lock:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def get_stage_label() -> Optional[str]:
+    """Returns the label of the stage running in the current thread"""
+    return getattr(_local, 'label', None)
+
+
+def run_command(cmd: List[str]):
+    """
+    Runs an external program and raises subprocess.CalledProcessError if it fails.
+
+    Within a stage, the output of the program is forwarded line by line (with the stage prefix).
+    Otherwise, the program writes directly to the console.
+    """
+    if get_stage_label() is None:
+        subprocess.run(cmd, check=True)
+        return
+
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT) as proc:
+        for line in proc.stdout:
+            click.echo(line.decode('utf-8', 'replace').rstrip('\r\n'))
+
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+
+
+def _run_stage(stage: Stage):
+    _local.label = stage.label
+    try:
+        if stage.func() is False:
+            raise StageException('Schritt %s nicht erfolgreich' % stage.label)
+    finally:
+        _local.label = None
+
+
+def run_stages(stages: List[Stage], max_workers: Optional[int] = None):
+    """
+    Runs the stages, each one as soon as its dependencies have completed.
+
+    :param stages: Stages to run
+    :param max_workers: Maximum number of stages running at the same time (default: all)
+    :raise: Exception of the first failed stage (after all independent stages have finished)
+    """
+    names = {stage.name for stage in stages}
+    for stage in stages:
+        for dep in stage.deps:
+            if dep not in names:
+                raise ValueError('Unbekannte Abhängigkeit von %s: %s' % (stage.name, dep))
+
+    done = set()
+    cancelled = set()
+    failed = {}
+    pending = list(stages)
+    running = {}
+
+    lock = threading.Lock()
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = _StageOutput(stdout, lock)
+    sys.stderr = _StageOutput(stderr, lock)
+
+    try:
+        with ThreadPoolExecutor(max_workers or len(stages) or 1) as executor:
+            while pending or running:
+                for stage in list(pending):
+                    if any(dep in failed or dep in cancelled for dep in stage.deps):
+                        pending.remove(stage)
+                        cancelled.add(stage.name)
+                        click.echo('[%s] Abgebrochen' % stage.label)
+                    elif all(dep in done for dep in stage.deps):
+                        pending.remove(stage)
+                        running[executor.submit(_run_stage, stage)] = stage
+
+                if not running:
+                    if pending:
+                        raise ValueError('Zyklische Abhängigkeit: %s' % ', '.join(s.name for s in pending))
+                    break
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    stage = running.pop(future)
+                    exc = future.exception()
+
+                    if exc is None:
+                        done.add(stage.name)
+                    else:
+                        failed[stage.name] = exc
+                        click.echo('[%s] Fehlgeschlagen: %s' % (stage.label, exc))
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+
+    if failed:
+        raise next(iter(failed.values()))
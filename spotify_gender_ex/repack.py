@@ -0,0 +1,196 @@
+# coding=utf-8
+"""
+Repacking of APK files by copying the raw zip entries.
+
+Unchanged entries are copied with their compressed bytes straight from the original APK,
+without decompressing and compressing them again. Only the changed entries are taken from
+the APK built by apktool (also as raw bytes) or compressed from the given data.
+Uncompressed entries are aligned (like zipalign) by padding the extra field of their local header.
+"""
+import struct
+import zipfile
+import zlib
+from typing import BinaryIO, Dict, List, Optional
+
+# Files of the v1 APK signature, which become invalid when the APK is changed
+SIGNATURE_FILE_EXT = ('.SF', '.RSA', '.DSA', '.EC')
+
+# Files which have to be stored uncompressed (the resource table since Android 11)
+STORED_FILES = ('resources.arsc',)
+
+ALIGNMENT = 4
+ALIGNMENT_SO = 4096
+
+COPY_BUFSIZE = 1024 * 1024
+
+_LOCAL_HEADER = struct.Struct('<4sHHHHHIIIHH')
+_CENTRAL_HEADER = struct.Struct('<4sBBHHHHHIIIHHHHHII')
+_END_RECORD = struct.Struct('<4sHHHHIIH')
+
+_FLAG_DATA_DESCRIPTOR = 0x08
+_FLAG_UTF8 = 0x800
+
+
+class _Entry:
+    """Entry of the new zip file"""
+
+    def __init__(self, info: zipfile.ZipInfo, offset: int):
+        self.info = info
+        self.offset = offset
+
+
+def repack_apk(file_out: str, file_orig: str, file_built: Optional[str] = None,
+               changed_files: Optional[Dict[str, bytes]] = None):
+    """
+    Builds a new APK file from the original APK.
+
+    :param file_out: Output file
+    :param file_orig: Original APK file
+    :param file_built: APK file built by apktool. If given, it determines the entries of the new APK.
+        Entries with the same content (CRC and size) as in the original APK are copied from the original.
+    :param changed_files: Entries with new content: {name: data}
+    """
+    changed_files = changed_files or {}
+
+    with zipfile.ZipFile(file_orig) as zip_orig, open(file_orig, 'rb') as f_orig:
+        zip_built = zipfile.ZipFile(file_built) if file_built else None
+        f_built = open(file_built, 'rb') if file_built else None
+
+        try:
+            orig_infos = {info.filename: info for info in zip_orig.infolist()}
+            infos = (zip_built or zip_orig).infolist()
+
+            with open(file_out, 'wb') as f_out:
+                entries = []
+
+                for info in infos:
+                    if _is_signature_file(info.filename):
+                        continue
+
+                    data = changed_files.get(info.filename)
+                    if data is not None:
+                        entries.append(_write_data(f_out, info, data))
+                        continue
+
+                    f_src = f_built if zip_built else f_orig
+                    orig_info = orig_infos.get(info.filename)
+
+                    if zip_built and orig_info and orig_info.CRC == info.CRC and \
+                            orig_info.file_size == info.file_size:
+                        info, f_src = orig_info, f_orig
+
+                    if info.filename in STORED_FILES and info.compress_type != zipfile.ZIP_STORED:
+                        zip_src = zip_built if f_src is f_built else zip_orig
+                        entries.append(_write_data(f_out, info, zip_src.read(info)))
+                    else:
+                        entries.append(_copy_raw(f_out, f_src, info))
+
+                _write_central_directory(f_out, entries)
+        finally:
+            if zip_built:
+                zip_built.close()
+                f_built.close()
+
+
+def _is_signature_file(name: str) -> bool:
+    if not name.startswith('META-INF/'):
+        return False
+    return name == 'META-INF/MANIFEST.MF' or name.upper().endswith(SIGNATURE_FILE_EXT)
+
+
+def _encode_name(info: zipfile.ZipInfo) -> bytes:
+    if info.flag_bits & _FLAG_UTF8:
+        return info.filename.encode('utf-8')
+    return info.filename.encode('cp437')
+
+
+def _dos_datetime(info: zipfile.ZipInfo):
+    year, month, day, hour, minute, second = info.date_time
+    return (hour << 11) | (minute << 5) | (second // 2), ((year - 1980) << 9) | (month << 5) | day
+
+
+def _write_local_header(f_out: BinaryIO, info: zipfile.ZipInfo) -> int:
+    """Writes the local file header of an entry, returns the offset of the header"""
+    offset = f_out.tell()
+    name = _encode_name(info)
+
+    if info.compress_size >= 0xFFFFFFFF or info.file_size >= 0xFFFFFFFF or offset >= 0xFFFFFFFF:
+        raise ValueError('Zip64 wird nicht unterstützt: %s' % info.filename)
+
+    # Align uncompressed entries by padding the extra field
+    extra = b''
+    if info.compress_type == zipfile.ZIP_STORED:
+        alignment = ALIGNMENT_SO if info.filename.endswith('.so') else ALIGNMENT
+        data_offset = offset + _LOCAL_HEADER.size + len(name)
+        extra = b'\0' * (-data_offset % alignment)
+
+    dostime, dosdate = _dos_datetime(info)
+    f_out.write(_LOCAL_HEADER.pack(b'PK\x03\x04', info.extract_version, info.flag_bits & ~_FLAG_DATA_DESCRIPTOR,
+                                   info.compress_type, dostime, dosdate, info.CRC, info.compress_size,
+                                   info.file_size, len(name), len(extra)))
+    f_out.write(name)
+    f_out.write(extra)
+    return offset
+
+
+def _copy_raw(f_out: BinaryIO, f_src: BinaryIO, info: zipfile.ZipInfo) -> _Entry:
+    """Copies the compressed bytes of an entry from the source zip file"""
+    # The data begins after the local header, whose extra field may differ from the central directory
+    f_src.seek(info.header_offset)
+    header = _LOCAL_HEADER.unpack(f_src.read(_LOCAL_HEADER.size))
+    f_src.seek(header[9] + header[10], 1)
+
+    entry = _Entry(info, _write_local_header(f_out, info))
+
+    remaining = info.compress_size
+    while remaining > 0:
+        chunk = f_src.read(min(remaining, COPY_BUFSIZE))
+        if not chunk:
+            raise zipfile.BadZipFile('Unerwartetes Dateiende: %s' % info.filename)
+        f_out.write(chunk)
+        remaining -= len(chunk)
+
+    return entry
+
+
+def _write_data(f_out: BinaryIO, src_info: zipfile.ZipInfo, data: bytes) -> _Entry:
+    """Writes an entry with new content, using the compression method of the source entry"""
+    info = zipfile.ZipInfo(src_info.filename, src_info.date_time)
+    info.flag_bits = src_info.flag_bits & _FLAG_UTF8
+    info.external_attr = src_info.external_attr
+    info.create_system = src_info.create_system
+    info.CRC = zlib.crc32(data)
+    info.file_size = len(data)
+
+    if src_info.compress_type == zipfile.ZIP_STORED or src_info.filename in STORED_FILES:
+        info.compress_type = zipfile.ZIP_STORED
+    else:
+        info.compress_type = zipfile.ZIP_DEFLATED
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        data = compressor.compress(data) + compressor.flush()
+        info.extract_version = max(info.extract_version, 20)
+
+    info.compress_size = len(data)
+
+    entry = _Entry(info, _write_local_header(f_out, info))
+    f_out.write(data)
+    return entry
+
+
+def _write_central_directory(f_out: BinaryIO, entries: List[_Entry]):
+    cd_offset = f_out.tell()
+
+    for entry in entries:
+        info = entry.info
+        name = _encode_name(info)
+        dostime, dosdate = _dos_datetime(info)
+
+        f_out.write(_CENTRAL_HEADER.pack(
+            b'PK\x01\x02', info.create_version, info.create_system, info.extract_version,
+            info.flag_bits & ~_FLAG_DATA_DESCRIPTOR, info.compress_type, dostime, dosdate, info.CRC,
+            info.compress_size, info.file_size, len(name), 0, 0, 0, info.internal_attr, info.external_attr,
+            entry.offset))
+        f_out.write(name)
+
+    cd_size = f_out.tell() - cd_offset
+    f_out.write(_END_RECORD.pack(b'PK\x05\x06', 0, 0, len(entries), len(entries), cd_size, cd_offset, 0))
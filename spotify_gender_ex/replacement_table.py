@@ -1,19 +1,35 @@
 # coding=utf-8
 import hashlib
 import json
+import marshal
 import os
-from typing import Optional, Tuple, Dict, Callable
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple, Dict, Callable, List, Iterator
 
 import click
 
 from spotify_gender_ex import lang_file
 
+_encode_json_str = json.encoder.encode_basestring
+
+# Compiled replacement table cache
+# The marshal format depends on the Python version, so it is part of the header
+RTCACHE_MAGIC = ('GEXRT3 %d.%d %d\n' % (sys.version_info[0], sys.version_info[1], marshal.version)).encode()
+RTCACHE_EXT = '.rtc'
+RTCACHE_MAX_FILES = 10
+# Files changed less than this time (ns) before they were cached may change again without a new
+# modification time (coarse timestamps), so their cache entries are verified by the content hash
+RTCACHE_RACY_NS = 2 * 10 ** 9
+
 
 class ReplacementManager:
     """ReplacementManager holds multiple ReplacementTables"""
 
     def __init__(self, dir_apk: str, get_missing_replacement: Optional[Callable] = None):
         self._rtabs = {}
+        self._index = None
         self.dir_apk = dir_apk
         self.new_replacements = ReplacementTable.from_scratch()
 
@@ -32,14 +48,35 @@ class ReplacementManager:
         Sets the mutable replacement table if specified.
         """
         self._rtabs[name] = rtab
+        self._index = None
+
+    def _get_index(self) -> Dict[str, Dict[Tuple[str, str], str]]:
+        """
+        Returns the merged replacement index of all loaded tables
+        (``{lfpath: {(key, old): new}}``), building it if necessary.
+
+        Tables added first take priority, so the index is filled in reverse order.
+        Empty replacement values are skipped, just like in the lookup over the single tables.
+        """
+        if self._index is None:
+            rtabs = list(self._rtabs.values())
+
+            if len(rtabs) == 1:
+                # The index of the table can be used directly, it is only read
+                index = rtabs[0].get_index()
+            else:
+                index = {}
+                for rtab in reversed(rtabs):
+                    for lfpath, rtab_lf_index in rtab.get_index().items():
+                        index.setdefault(lfpath, {}).update(rtab_lf_index)
+
+            self._index = index
+        return self._index
 
     def get_replacement(self, lfpath: str, key: str, old: str) -> str:
-        for rtab in self._rtabs.values():
-            rset = rtab.set_from_langfile(lfpath)
-            if rset:
-                new_string = rset.get_replacement(key, old)
-                if new_string:
-                    return new_string
+        lf_index = self._get_index().get(lfpath)
+        if lf_index:
+            return lf_index.get((key, old))
 
     def insert_replacement(self, lfpath: str, key: str, old: str, new: str):
         """Inserts a new replacement into the mutable replacement table"""
@@ -101,7 +138,7 @@ class ReplacementManager:
         click.echo('Verdächtig: %s' % old)
         return old
 
-    def do_replace(self, dir_out=None) -> Tuple[int, int]:
+    def do_replace(self, dir_out=None, processes=1, engine='tree') -> Tuple[int, int]:
         """
         Iterates through all language files.
         For each language field in every file, it tries to find a replacement.
@@ -112,6 +149,14 @@ class ReplacementManager:
         The new replacements can be written back into the replacement table
         using write_replacement_table(spotify_version).
 
+        If more than one process is requested, the language files are processed
+        by a worker pool. Files containing suspicious fields without replacement
+        are handed back to the main process, so that prompting still works.
+
+        The engine used for reading and writing the language files can be chosen
+        from ``lang_file.ENGINES`` (``tree``: ElementTree, ``stream``: iterparse streaming,
+        ``splice``: patch only the changed texts into the original file).
+
         Returns a tuple: (Number of replaced fields, Number of new replacements)
         """
 
@@ -119,45 +164,133 @@ class ReplacementManager:
         self.n_newrpl = 0
 
         # Accumulate language files
-        lfpaths = set()
-        for rtab in self._rtabs.values():
-            for s in rtab.sets:
-                lfpaths.add(s.path)
+        lfpaths = sorted(self._get_index())
+
+        if processes > 1 and len(lfpaths) > 1:
+            lfpaths = self._do_replace_parallel(lfpaths, dir_out, processes, engine)
 
         # Iterate through all language files
         for lfpath in lfpaths:
-            # Get language file
-            langfile = lang_file.LangFile(os.path.join(self.dir_apk, ReplacementSet.get_realpath(lfpath)))
+            self._replace_langfile(lfpath, dir_out, engine)
 
-            def fun_replace(key: str, old: str) -> str:
-                new_string = self.get_replacement(lfpath, key, old)
-                if new_string:
-                    self.n_replaced += 1
-                    return new_string
-
-                if lang_file.is_suspicious(old):
-                    # Create a new replacement and obtain the new value
-                    new_string = str(self.get_missing_replacement(key, old))
+        return self.n_replaced, self.n_newrpl
 
-                    # Replace using new replacement and add it to the table
-                    self.insert_replacement(lfpath, key, old, new_string)
+    def do_replace_table(self, table) -> Tuple[int, int]:
+        """
+        Replaces the language fields directly within the compiled resource table
+        of the app (``arsc.ResourceTable``) instead of the decompiled language files.
+        Suspicious fields are handled the same way as in ``do_replace``.
 
-                    self.n_replaced += 1
-                    self.n_newrpl += 1
-                    return new_string
+        Returns a tuple: (Number of replaced fields, Number of new replacements)
+        """
+        self.n_replaced = 0
+        self.n_newrpl = 0
 
-            # Do the replacement
-            langfile.replace_tree(fun_replace)
+        for lfpath in sorted(self._get_index()):
+            langfile = table.get_langfile(lfpath)
 
-            # Write back modified language file
-            target_file = None
-            if dir_out:
-                target_file = os.path.join(dir_out, os.path.basename(ReplacementSet.get_realpath(lfpath)))
+            if langfile is None:
+                click.echo('Sprachdatei %s nicht in resources.arsc gefunden' % lfpath)
+                continue
 
-            langfile.to_file(target_file)
+            self._replace_fields(lfpath, langfile)
 
         return self.n_replaced, self.n_newrpl
 
+    def _get_langfile_path(self, lfpath: str) -> str:
+        return os.path.join(self.dir_apk, ReplacementSet.get_realpath(lfpath))
+
+    @staticmethod
+    def _get_target_file(lfpath: str, dir_out=None) -> Optional[str]:
+        if dir_out:
+            return os.path.join(dir_out, os.path.basename(ReplacementSet.get_realpath(lfpath)))
+        return None
+
+    def _replace_langfile(self, lfpath: str, dir_out=None, engine='tree'):
+        """Replaces all fields of a single language file and writes it back"""
+        # Get language file
+        langfile = lang_file.ENGINES[engine](self._get_langfile_path(lfpath))
+        target_file = self._get_target_file(lfpath, dir_out)
+
+        if not hasattr(langfile, 'get_fields'):
+            self._replace_langfile_callback(lfpath, langfile, target_file)
+            return
+
+        self._replace_fields(lfpath, langfile)
+        langfile.to_file(target_file)
+
+    def _replace_fields(self, lfpath: str, langfile):
+        """
+        Replaces all fields of a language file using its bulk interface (``get_fields``/``set_texts``).
+        The changes are not written.
+        """
+        # Resolve all fields in bulk, only the misses are checked and prompted for
+        keys, texts, handles = langfile.get_fields()
+        new_texts, suspicious = _resolve_fields(self._get_index().get(lfpath, {}), keys, texts)
+        self.n_replaced += len(new_texts) - new_texts.count(None)
+
+        for i in suspicious:
+            # Create a new replacement and obtain the new value
+            new_texts[i] = str(self.get_missing_replacement(keys[i], texts[i]))
+
+            # Add the new replacement to the table
+            self.insert_replacement(lfpath, keys[i], texts[i], new_texts[i])
+            self.n_replaced += 1
+            self.n_newrpl += 1
+
+        hits = [i for i, new_text in enumerate(new_texts) if new_text]
+
+        # Apply the hits
+        langfile.set_texts([handles[i] for i in hits], [new_texts[i] for i in hits])
+
+    def _replace_langfile_callback(self, lfpath: str, langfile, target_file: Optional[str]):
+        """Replaces the fields of a language file field by field (for engines without bulk access)"""
+        def fun_replace(key: str, old: str) -> str:
+            new_string = self.get_replacement(lfpath, key, old)
+            if new_string:
+                self.n_replaced += 1
+                return new_string
+
+            if lang_file.is_suspicious(old):
+                # Create a new replacement and obtain the new value
+                new_string = str(self.get_missing_replacement(key, old))
+
+                # Replace using new replacement and add it to the table
+                self.insert_replacement(lfpath, key, old, new_string)
+
+                self.n_replaced += 1
+                self.n_newrpl += 1
+                return new_string
+
+        # Do the replacement and write back modified language file
+        langfile.replace_to_file(fun_replace, target_file)
+
+    def _do_replace_parallel(self, lfpaths: List[str], dir_out, processes: int, engine: str) -> List[str]:
+        """
+        Replaces the given language files using a pool of worker processes.
+        The replacement index is shipped once to every worker.
+
+        Returns the paths of the language files which could not be finished by the workers
+        because they contain suspicious fields that need to be prompted for.
+        """
+        index = self._get_index()
+        pending = []
+
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_replace_worker,
+                                 initargs=(index,)) as executor:
+            jobs = [executor.submit(_replace_worker, lfpath, self._get_langfile_path(lfpath),
+                                    self._get_target_file(lfpath, dir_out), engine) for lfpath in lfpaths]
+
+            for job in jobs:
+                lfpath, n_replaced, suspicious = job.result()
+
+                if suspicious:
+                    pending.append(lfpath)
+                else:
+                    self.n_replaced += n_replaced
+
+        return pending
+
     def write_new_replacements(self, spotify_version: str, file: str) -> bool:
         """Write back new replacements if there are any"""
         if not self.new_replacements.is_empty():
@@ -167,6 +300,154 @@ class ReplacementManager:
         return False
 
 
+# Replacement index of the worker processes, set by _init_replace_worker
+_worker_index = None
+
+
+def _init_replace_worker(index: Dict[str, Dict[Tuple[str, str], str]]):
+    global _worker_index
+    _worker_index = index
+
+
+def _replace_worker(lfpath: str, file: str, target_file: Optional[str], engine: str) -> Tuple[str, int, bool]:
+    """
+    Replaces the fields of a language file within a worker process.
+
+    If the language file contains suspicious fields without replacement,
+    the file is not written and has to be processed by the main process.
+
+    Returns a tuple: (lfpath, Number of replaced fields, Has suspicious fields)
+    """
+    lf_index = _worker_index.get(lfpath, {})
+    langfile = lang_file.ENGINES[engine](file)
+    target_file = target_file or file
+
+    if hasattr(langfile, 'get_fields'):
+        keys, texts, handles = langfile.get_fields()
+        new_texts, suspicious = _resolve_fields(lf_index, keys, texts)
+        if suspicious:
+            return lfpath, 0, True
+
+        # The fields are resolved before writing, so the file is written like in the main process
+        # (the splice engine does not write files without changes)
+        hits = [i for i, new_text in enumerate(new_texts) if new_text]
+        langfile.set_texts([handles[i] for i in hits], [new_texts[i] for i in hits])
+        langfile.to_file(target_file)
+        return lfpath, len(hits), False
+
+    # Write into a scratch file first, it gets discarded if the file has to be processed again
+    scratch_file = target_file + '.part'
+
+    n_replaced = 0
+    has_suspicious = False
+
+    def fun_replace(key: str, old: str) -> str:
+        nonlocal n_replaced, has_suspicious
+
+        new_string = lf_index.get((key, old))
+        if new_string:
+            n_replaced += 1
+            return new_string
+
+        if lang_file.is_suspicious(old):
+            has_suspicious = True
+
+    langfile.replace_to_file(fun_replace, scratch_file)
+
+    if has_suspicious:
+        os.remove(scratch_file)
+        return lfpath, 0, True
+
+    os.replace(scratch_file, target_file)
+    return lfpath, n_replaced, False
+
+
+def _resolve_fields(lf_index: Dict[Tuple[str, str], str], keys: List[str],
+                    texts: List[str]) -> Tuple[List[Optional[str]], List[int]]:
+    """
+    Resolves the fields of a language file against its replacement index in one bulk pass.
+
+    :param lf_index: Replacement index of the language file: {(key, old): new}
+    :param keys: Field keys
+    :param texts: Field texts
+    :return: Tuple: (New texts (None for misses), Indices of the suspicious misses)
+    """
+    new_texts = list(map(lf_index.get, zip(keys, texts)))
+    misses = [i for i, new_text in enumerate(new_texts) if new_text is None]
+    suspicious = lang_file.find_suspicious([texts[i] for i in misses])
+    return new_texts, [misses[i] for i in suspicious]
+
+
+def _build_index(sets: List['ReplacementSet']) -> Dict[str, Dict[Tuple[str, str], str]]:
+    """
+    Builds the replacement index of a table: ``{lfpath: {(key, old): new}}``.
+    Empty replacement values are skipped. Like set_from_langfile, only the first set
+    of a language file is used, further sets with the same path are ignored.
+    """
+    index = {}
+
+    for rset in sets:
+        if rset.path in index:
+            continue
+        lf_index = index[rset.path] = {}
+
+        for rkey, new in rset.replace.items():
+            if new:
+                lf_index[tuple(rkey.split('|', 1))] = new
+
+    return index
+
+
+def _get_cache_file(cache_dir: str, source_id: tuple) -> str:
+    return os.path.join(cache_dir, hashlib.sha256(repr(source_id).encode('utf-8')).hexdigest() + RTCACHE_EXT)
+
+
+def _read_table_cache(cache_file: str, source_id: tuple) -> Optional[tuple]:
+    """
+    Reads a compiled table from the cache.
+
+    :return: Tuple: (SHA-256 hash of the JSON data, needs verification, table data, replacement index)
+        or None if the table is not cached
+    """
+    try:
+        with open(cache_file, 'rb') as f:
+            cache_data = f.read()
+
+        if cache_data.startswith(RTCACHE_MAGIC):
+            cached_id, digest, racy, data, index = marshal.loads(cache_data[len(RTCACHE_MAGIC):])
+            if cached_id == source_id:
+                os.utime(cache_file)
+                return digest, racy, data, index
+    except Exception:
+        pass
+    return None
+
+
+def _write_table_cache(cache_file: str, source_id: tuple, digest: str, racy: bool, data: dict, index: dict):
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+
+        # Write to a temporary file first, so that concurrent runs never read a partial cache file
+        tmp_file = '%s.%d.tmp' % (cache_file, os.getpid())
+        with open(tmp_file, 'wb') as f:
+            f.write(RTCACHE_MAGIC)
+            marshal.dump((source_id, digest, racy, data, index), f)
+        os.replace(tmp_file, cache_file)
+
+        _prune_table_cache(os.path.dirname(cache_file))
+    except OSError:
+        pass
+
+
+def _prune_table_cache(cache_dir: str):
+    """Removes the least recently used cache files if there are more than RTCACHE_MAX_FILES"""
+    cache_files = [os.path.join(cache_dir, f) for f in os.listdir(cache_dir) if f.endswith(RTCACHE_EXT)]
+    cache_files.sort(key=os.path.getmtime, reverse=True)
+
+    for cache_file in cache_files[RTCACHE_MAX_FILES:]:
+        os.remove(cache_file)
+
+
 class ReplacementTable:
     """
     A ReplacementTable contains multiple replacement sets as well as version information
@@ -179,12 +460,33 @@ class ReplacementTable:
         self.sets = [ReplacementSet(**f) for f in files]
         self.path = None
 
+        # Serialized table: (state, JSON string, MD5 hash)
+        self._json_cache = None
+        # Replacement index: (state, {lfpath: {(key, old): new}})
+        self._index = None
+
     @classmethod
-    def from_file(cls, file: str) -> 'ReplacementTable':
+    def from_file(cls, file: str, cache_dir: Optional[str] = None) -> 'ReplacementTable':
+        """
+        Load a replacement table from a JSON file.
+
+        With a cache directory, the compiled table is keyed by the path, size, inode and change times
+        of the file, so a cached table is loaded without reading the JSON file. If the file was
+        changed just before it was cached, its timestamps are not reliable and the cached table
+        is checked against the SHA-256 hash of the file.
+
+        :param file: Path of the JSON file. If it does not exist, an empty table is created.
+        :param cache_dir: Directory for the compiled table cache (optional)
+        """
         if os.path.isfile(file):
-            with open(file, 'r', encoding='utf-8') as json_file:
-                data = json.load(json_file)
-                rtab = cls(**data)
+            stat = os.stat(file)
+            source_id = ('file', os.path.abspath(file), stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns, stat.st_ino)
+
+            def read_raw():
+                with open(file, 'rb') as json_file:
+                    return json_file.read()
+
+            rtab = cls._load(source_id, read_raw, cache_dir, max(stat.st_mtime_ns, stat.st_ctime_ns))
         else:
             rtab = cls.from_scratch()
 
@@ -192,9 +494,76 @@ class ReplacementTable:
         return rtab
 
     @classmethod
-    def from_string(cls, string: str) -> 'ReplacementTable':
-        data = json.loads(string)
-        return cls(**data)
+    def from_string(cls, string: str, cache_dir: Optional[str] = None) -> 'ReplacementTable':
+        """
+        Load a replacement table from a JSON string.
+
+        :param string: JSON string
+        :param cache_dir: Directory for the compiled table cache (optional), keyed by the hash of the string
+        """
+        raw = string.encode('utf-8')
+        source_id = ('sha256', hashlib.sha256(raw).hexdigest())
+        return cls._load(source_id, lambda: raw, cache_dir)
+
+    @classmethod
+    def _load(cls, source_id: tuple, read_raw: Callable[[], bytes], cache_dir: Optional[str],
+              changed_ns: Optional[int] = None) -> 'ReplacementTable':
+        """
+        Loads a table from the compiled cache or, if it is not cached, from the JSON data.
+
+        The cache holds the table data together with its replacement index in marshal format,
+        so neither the JSON parser nor the index builder is needed for a cached table.
+        The JSON data is used as a fallback if the cache file is missing or unreadable.
+
+        :param source_id: Cache key of the JSON data
+        :param read_raw: Function returning the JSON data
+        :param changed_ns: Last change of the source file. Entries cached within RTCACHE_RACY_NS
+            after a change are verified by the hash of the JSON data.
+        """
+        if not cache_dir:
+            return cls(**json.loads(read_raw().decode('utf-8')))
+
+        def is_racy():
+            return changed_ns is not None and changed_ns > time.time_ns() - RTCACHE_RACY_NS
+
+        cache_file = _get_cache_file(cache_dir, source_id)
+        cached = _read_table_cache(cache_file, source_id)
+        raw = None
+
+        if cached:
+            digest, racy, data, index = cached
+
+            if racy:
+                racy = is_racy()
+                raw = read_raw()
+
+                if hashlib.sha256(raw).hexdigest() != digest:
+                    cached = None
+                elif not racy:
+                    # The file has not been changed since, so the entry does not need to be verified any more
+                    _write_table_cache(cache_file, source_id, digest, False, data, index)
+
+        if cached:
+            rtab = cls(**data)
+            rtab._index = (rtab._get_state(), index)
+            return rtab
+
+        if raw is None:
+            racy = is_racy()
+            raw = read_raw()
+
+        data = json.loads(raw.decode('utf-8'))
+        rtab = cls(**data)
+        _write_table_cache(cache_file, source_id, hashlib.sha256(raw).hexdigest(), racy, data, rtab.get_index())
+        return rtab
+
+    def get_index(self) -> Dict[str, Dict[Tuple[str, str], str]]:
+        """Returns the replacement index of the table: ``{lfpath: {(key, old): new}}`` (rebuilt after changes)"""
+        state = self._get_state()
+
+        if self._index is None or self._index[0] != state:
+            self._index = (state, _build_index(self.sets))
+        return self._index[1]
 
     @classmethod
     def from_scratch(cls) -> 'ReplacementTable':
@@ -224,12 +593,63 @@ class ReplacementTable:
             file = self.path
 
         with open(file, 'w', encoding='utf-8') as outfile:
-            json.dump(self, outfile,
-                      default=lambda obj: getattr(obj.__class__, "to_json")(obj), indent=2, ensure_ascii=False)
+            outfile.write(self.to_string())
 
     def to_string(self) -> str:
-        return json.dumps(self,
-                          default=lambda obj: getattr(obj.__class__, "to_json")(obj), indent=2, ensure_ascii=False)
+        """Returns the canonical JSON representation of the table (cached until the table is mutated)"""
+        state = self._get_state()
+
+        if self._json_cache is None or self._json_cache[0] != state:
+            string = ''.join(self._iter_json())
+            self._json_cache = (state, string, hashlib.md5(string.encode('utf-8')).hexdigest())
+        return self._json_cache[1]
+
+    def _iter_json(self) -> Iterator[str]:
+        """
+        Serializes the table in chunks.
+        The output is identical to ``json.dumps(self.to_json(), indent=2, ensure_ascii=False)``.
+        """
+        yield '{\n  "version": %s,\n  "spotify_versions": ' % json.dumps(self.version)
+        yield from self._iter_json_list(self.spotify_versions, '  ')
+        yield ',\n  "files": '
+
+        if not self.sets:
+            yield '[]'
+        else:
+            sep = '[\n    {\n      "path": '
+            for rset in self.sets:
+                yield sep
+                yield _encode_json_str(rset.path)
+                yield ',\n      "replace": '
+
+                if not rset.replace:
+                    yield '{}'
+                else:
+                    dict_sep = '{\n        '
+                    for key, val in rset.replace.items():
+                        yield dict_sep + _encode_json_str(key) + ': ' + _encode_json_str(val)
+                        dict_sep = ',\n        '
+                    yield '\n      }'
+                sep = '\n    },\n    {\n      "path": '
+            yield '\n    }\n  ]'
+        yield '\n}'
+
+    @staticmethod
+    def _iter_json_list(items: list, indent: str) -> Iterator[str]:
+        if not items:
+            yield '[]'
+            return
+
+        sep = '[\n  ' + indent
+        for item in items:
+            yield sep + json.dumps(item, ensure_ascii=False)
+            sep = ',\n  ' + indent
+        yield '\n' + indent + ']'
+
+    def _get_state(self) -> tuple:
+        """Returns a value which changes whenever the table is mutated"""
+        return (self.version, tuple(self.spotify_versions),
+                tuple((id(rset), rset.path, rset.revision, len(rset.replace)) for rset in self.sets))
 
     def spotify_compatible(self, version: str) -> bool:
         return version in self.spotify_versions or self.is_empty()
@@ -259,7 +679,9 @@ class ReplacementTable:
         return n
 
     def md5_hash(self) -> str:
-        return hashlib.md5(self.to_string().encode('utf-8')).hexdigest()
+        """Returns the MD5 hash of the JSON representation (cached until the table is mutated)"""
+        self.to_string()
+        return self._json_cache[2]
 
     def to_json(self) -> dict:
         return {
@@ -280,6 +702,13 @@ class ReplacementSet:
         self.realpath = self.get_realpath(path)
         self.replace = replace
 
+        # Gets incremented on every change
+        self.revision = 0
+
+        # Number of suspicious replacement values.
+        # Counted on first request, then kept up to date by add().
+        self._n_suspicious = None
+
     @staticmethod
     def get_realpath(path: str) -> str:
         return os.path.join(*path.split('/'))
@@ -289,7 +718,16 @@ class ReplacementSet:
         return key + '|' + old
 
     def add(self, key: str, old: str, new: str):
-        self.replace[self._get_key(key, old)] = new
+        rkey = self._get_key(key, old)
+
+        if self._n_suspicious is not None:
+            if rkey in self.replace and lang_file.is_suspicious(self.replace[rkey]):
+                self._n_suspicious -= 1
+            if lang_file.is_suspicious(new):
+                self._n_suspicious += 1
+
+        self.replace[rkey] = new
+        self.revision += 1
 
     def get_replacement(self, key: str, old: str) -> str:
         return self.replace.get(self._get_key(key, old))
@@ -298,15 +736,16 @@ class ReplacementSet:
         return not bool(self.replace)
 
     def n_replacements(self) -> int:
-        return len(self.replace.items())
+        return len(self.replace)
 
     def n_suspicious(self) -> int:
-        n = 0
+        if self._n_suspicious is None:
+            self._n_suspicious = 0
 
-        for _, val in self.replace.items():
-            if lang_file.is_suspicious(val):
-                n += 1
-        return n
+            for val in self.replace.values():
+                if lang_file.is_suspicious(val):
+                    self._n_suspicious += 1
+        return self._n_suspicious
 
     def to_json(self) -> dict:
         return {'path': self.path, 'replace': self.replace}
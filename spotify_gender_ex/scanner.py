@@ -0,0 +1,152 @@
+# coding=utf-8
+"""
+Discovery scan of the decompiled app.
+
+Walks all string resources (strings, plurals, arrays) of every locale in the res folder
+and reports the suspicious fields which are not covered by the loaded replacement tables.
+Suspicious texts which the replacement cannot reach (inline tags, array items without attributes)
+are reported separately.
+"""
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+from xml.etree import ElementTree
+
+from spotify_gender_ex import lang_file
+from spotify_gender_ex.replacement_table import ReplacementManager
+
+RESOURCE_FILES = ('strings.xml', 'plurals.xml', 'arrays.xml')
+ARRAY_TAGS = ('string-array', 'array')
+
+# Number of language files sent to a worker process at once
+SCAN_CHUNKSIZE = 4
+
+
+def find_resource_files(dir_apk: str) -> List[str]:
+    """
+    Returns the paths (relative to the decompiled app, e.g. ``res/values-de/strings.xml``)
+    of all string resource files.
+    """
+    dir_res = os.path.join(dir_apk, 'res')
+    lfpaths = []
+
+    for dirname in sorted(os.listdir(dir_res)):
+        if dirname != 'values' and not dirname.startswith('values-'):
+            continue
+
+        for filename in RESOURCE_FILES:
+            if os.path.isfile(os.path.join(dir_res, dirname, filename)):
+                lfpaths.append('res/%s/%s' % (dirname, filename))
+
+    return lfpaths
+
+
+def iter_resource_fields(file: str) -> Iterator[Tuple[str, str]]:
+    """
+    Yields the fields of a string resource file which can be replaced: (key, stripped text).
+    These are exactly the fields processed by the replacement (``LangFile.iter_fields``).
+    """
+    for key, text, _ in lang_file.LangFile(file).iter_fields():
+        yield key, text
+
+
+def iter_unreplaceable_fields(root: ElementTree.Element, fields: Dict[str, str]) -> Iterator[Tuple[str, str]]:
+    """
+    Yields the string resources which are not (completely) covered by the replaceable fields:
+    (key, stripped text including the text of inline tags).
+
+    These are texts with inline tags (only the text before the first tag can be replaced)
+    and array items without attributes, which are addressed by ``name/index``.
+
+    :param root: Root element of the resource file
+    :param fields: Replaceable fields of the file {key: text}
+    """
+    for elm in root:
+        name = elm.get('name')
+        if name is None:
+            continue
+
+        if len(elm) and (elm.tag == 'plurals' or elm.tag in ARRAY_TAGS):
+            entries = [('%s/%s' % (name, item.get('quantity', str(i))), item) for i, item in enumerate(elm)]
+        else:
+            entries = [(name, elm)]
+
+        for key, entry in entries:
+            text = _get_text(entry)
+            if text and fields.get(key) != text:
+                yield key, text
+
+
+def _get_text(elm: ElementTree.Element) -> str:
+    """Returns the stripped text of an element including the text of inline tags"""
+    if len(elm):
+        return ''.join(elm.itertext()).strip()
+    if elm.text:
+        return elm.text.strip()
+    return ''
+
+
+def _scan_file(lfpath: str, file: str) -> Tuple[str, List[Tuple[str, str]], List[Tuple[str, str]]]:
+    """
+    Returns the suspicious fields of a resource file:
+    (lfpath, [(key, text)] replaceable, [(key, text)] not replaceable)
+    """
+    lfile = lang_file.LangFile(file)
+    fields = [(key, text) for key, text, _ in lfile.iter_fields()]
+    others = list(iter_unreplaceable_fields(lfile.tree.getroot(), dict(fields)))
+
+    suspicious = lang_file.find_suspicious([text for _, text in fields])
+    suspicious_others = lang_file.find_suspicious([text for _, text in others])
+    return lfpath, [fields[i] for i in suspicious], [others[i] for i in suspicious_others]
+
+
+def scan_resources(dir_apk: str, rtm: Optional[ReplacementManager] = None,
+                   processes=1) -> Tuple[Dict[str, Dict[str, str]], Dict[str, Dict[str, str]]]:
+    """
+    Scans all string resources of the decompiled app for suspicious fields.
+
+    :param dir_apk: Folder of the decompiled app
+    :param rtm: ReplacementManager: fields with an existing replacement are not reported
+    :param processes: Number of worker processes
+    :return: Tuple: (Suspicious fields without replacement: {lfpath: {key: text}},
+        Suspicious texts which cannot be replaced by a rule: {lfpath: {key: text}})
+    """
+    lfpaths = find_resource_files(dir_apk)
+    files = [os.path.join(dir_apk, lfpath) for lfpath in lfpaths]
+
+    if processes > 1 and len(lfpaths) > 1:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            results = list(executor.map(_scan_file, lfpaths, files, chunksize=SCAN_CHUNKSIZE))
+    else:
+        results = list(map(_scan_file, lfpaths, files))
+
+    report = {}
+    unreplaceable = {}
+    for lfpath, fields, others in results:
+        lf_fields = {key: text for key, text in fields
+                     if rtm is None or not rtm.get_replacement(lfpath, key, text)}
+        if lf_fields:
+            report[lfpath] = lf_fields
+        if others:
+            unreplaceable[lfpath] = dict(others)
+
+    return report, unreplaceable
+
+
+def write_report(report: Dict[str, Dict[str, str]], spotify_version: str, file: str,
+                 unreplaceable: Optional[Dict[str, Dict[str, str]]] = None):
+    """Writes the scan report as a JSON file"""
+    unreplaceable = unreplaceable or {}
+    data = {
+        'spotify_version': spotify_version,
+        'n_files': len(report),
+        'n_fields': sum(len(fields) for fields in report.values()),
+        'files': report,
+        # Texts with inline tags and array items without attributes, rules cannot match these
+        'n_unreplaceable': sum(len(fields) for fields in unreplaceable.values()),
+        'unreplaceable': unreplaceable,
+    }
+
+    with open(file, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
@@ -1,30 +1,49 @@
 # coding=utf-8
 import os
 import shutil
-import subprocess
+
+from spotify_gender_ex import pipeline
 
 
 class Workdir:
-    def __init__(self, pathin, ks_password='12345678', key_password='12345678'):
-        """Create the required files and directories if needed"""
+    def __init__(self, pathin, ks_password='12345678', key_password='12345678', clear_tmp=True,
+                 create_keystore=True):
+        """
+        Create the required files and directories if needed
+
+        :param clear_tmp: Clear the temporary folder. Disabled to resume a previous run.
+        :param create_keystore: Create the keystore now. Otherwise, it is created by calling create_keystore
+        """
         self.ks_password = ks_password
         self.key_password = key_password
 
         self.dir_root = self._get_dir(os.path.join(pathin, 'GenderEx'))
         self.dir_output = self._get_dir(os.path.join(self.dir_root, 'output'))
 
+        self.dir_cache = os.path.join(self.dir_root, 'cache')
+        self.dir_rtcache = os.path.join(self.dir_cache, 'rtables')
+        self.dir_decodecache = os.path.join(self.dir_cache, 'decoded')
+
         self.dir_tmp = os.path.join(self.dir_root, 'tmp')
-        self._clear_tmp_folder()
+        if clear_tmp:
+            self._clear_tmp_folder()
+        else:
+            self._get_dir(self.dir_tmp)
 
-        self.file_keystore = self._get_file(os.path.join(self.dir_root, 'genderex.keystore'), self._create_keystore)
+        self.file_keystore = os.path.join(self.dir_root, 'genderex.keystore')
+        if create_keystore:
+            self.create_keystore()
         self.file_rtable = os.path.join(self.dir_root, 'replacements.json')
         self.file_version = os.path.join(self.dir_root, 'spotify_version.txt')
+        self.file_output_manifest = os.path.join(self.dir_output, 'manifest.json')
 
         self.file_apk = os.path.join(self.dir_tmp, 'app.apk')
+        self.file_apkbuilt = os.path.join(self.dir_tmp, 'app_built.apk')
         self.file_apkout = os.path.join(self.dir_tmp, 'app_out.apk')
         self.file_apkout_signed = os.path.join(self.dir_output, 'app_out-aligned-signed.apk')
         self.dir_apk = os.path.join(self.dir_tmp, 'app')
         self.file_apktool = os.path.join(self.dir_apk, 'apktool.yml')
+        self.file_checkpoints = os.path.join(self.dir_tmp, 'checkpoints.json')
 
     @staticmethod
     def _output_basename(spotify_version, rt_version):
@@ -49,6 +68,9 @@ class Workdir:
     def get_file_newrepl(self, spotify_version, rt_version):
         return self._output_file(spotify_version, rt_version, 'repl', 'json', 'repl')
 
+    def get_file_scan(self, spotify_version, rt_version):
+        return self._output_file(spotify_version, rt_version, 'scan', 'json', 'scan')
+
     def _clear_tmp_folder(self):
         try:
             shutil.rmtree(self.dir_tmp)
@@ -86,11 +108,15 @@ class Workdir:
             # Keytool on Linux
             return 'keytool'
 
+    def create_keystore(self):
+        """Create the keystore for signing the app if it does not exist"""
+        self._get_file(self.file_keystore, self._create_keystore)
+
     def _create_keystore(self, keystorepath):
-        subprocess.run([self._keytool_base(), '-keystore', keystorepath, '-genkey', '-alias', 'genderex',
-                        '-keyalg', 'RSA', '-keysize', '2048', '-validity', '50000',
-                        '-storepass', self.ks_password, '-keypass', self.key_password, '-dname',
-                        'CN=spotify-gender-ex'], check=True)
+        pipeline.run_command([self._keytool_base(), '-keystore', keystorepath, '-genkey', '-alias', 'genderex',
+                              '-keyalg', 'RSA', '-keysize', '2048', '-validity', '50000',
+                              '-storepass', self.ks_password, '-keypass', self.key_password, '-dname',
+                              'CN=spotify-gender-ex'])
 
         # Check if keystore generation was successful
         assert os.path.isfile(keystorepath), 'Keystore konnte nicht erzeugt werden'
@@ -1,5 +1,7 @@
+import atexit
 import os
 import shutil
+import tempfile
 
 # Test cases to run
 TEST_DOWNLOAD = False
@@ -18,6 +20,11 @@ DIR_LANG = os.path.join(DIR_TESTFILES, 'lang')
 DIR_REPLACE = os.path.join(DIR_TESTFILES, 'replace')
 DIR_MAKE = os.path.join(DIR_TESTFILES, 'make')
 
+# The tests must not write into the APK store of the user
+DIR_BLOB_STORE = tempfile.mkdtemp(prefix='gex-blobs-')
+os.environ['GEX_BLOB_STORE'] = DIR_BLOB_STORE
+atexit.register(shutil.rmtree, DIR_BLOB_STORE, True)
+
 
 def clear_tmp_folder():
     try:
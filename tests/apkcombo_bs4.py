@@ -0,0 +1,51 @@
+"""
+Previous BeautifulSoup-based parser of the Apkcombo download page.
+Reference for the event-based parser in appstore (test and benchmark only, bs4 is not a dependency).
+"""
+import re
+from typing import List
+
+from bs4 import BeautifulSoup
+
+from spotify_gender_ex import appstore
+
+
+def parse_page(raw_page: str, checkin_token: str) -> List[appstore.App]:
+    soup = BeautifulSoup(raw_page, 'html.parser')
+
+    arch_list_elm = soup.select_one('#variants-tab ul')
+    if arch_list_elm is None:
+        raise appstore.StoreException('Could not find arch-list')
+
+    arch_list = arch_list_elm.find_all('li', recursive=False)
+    parsed_apps = []
+
+    for arch_elm in arch_list:
+        raw_arch = arch_elm.select_one('.blur').get_text()
+        archs = set(map(str.strip, raw_arch.split(',')))
+
+        file_list_elm = arch_elm.select_one('.file-list')
+        if file_list_elm is None:
+            continue
+        file_list = file_list_elm.find_all('li', recursive=False)
+
+        for file_elm in file_list:
+            file_a_elm = file_elm.find('a')
+            if file_a_elm is None or 'href' not in file_a_elm.attrs:
+                continue
+            download_url = file_a_elm['href']
+            if not appstore.Apkcombo._is_apk_path(download_url):
+                continue
+
+            vername_elm = file_elm.select_one('.vername')
+            if vername_elm is None:
+                continue
+
+            match = re.search(r'\d+(\.\d+){3}', vername_elm.get_text())
+            if match is None:
+                continue
+            version = match.group(0)
+
+            parsed_apps.append(appstore.App(version, archs, f'{download_url}&{checkin_token}'))
+
+    return parsed_apps
@@ -0,0 +1,70 @@
+"""
+Local HTTP server standing in for GitHub and the app stores in the unit tests.
+
+Routes map a request path (without query string) to a handler function
+fun(request: BaseHTTPRequestHandler), which has to send the complete response.
+All requests are recorded in ``LocalServer.requests`` as (method, path, headers),
+the client addresses of all connections in ``LocalServer.connections``.
+"""
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict
+
+
+class LocalServer:
+    def __init__(self, routes: Dict[str, Callable]):
+        self.routes = routes
+        self.requests = []
+        self.connections = set()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _handle(self):
+                path = self.path.split('?')[0]
+                server.requests.append((self.command, path, dict(self.headers)))
+                server.connections.add(self.client_address)
+
+                route = server.routes.get(path)
+                if route is None:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                else:
+                    route(self)
+
+            do_GET = _handle
+            do_HEAD = _handle
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return 'http://127.0.0.1:%d' % self.httpd.server_address[1]
+
+    def __enter__(self) -> 'LocalServer':
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def send_data(request: BaseHTTPRequestHandler, data: bytes, status=200, headers=None):
+    """Sends a complete response with the given body (no body for HEAD requests)"""
+    request.send_response(status)
+    request.send_header('Content-Length', str(len(data)))
+    for key, val in (headers or {}).items():
+        request.send_header(key, val)
+    request.end_headers()
+
+    if request.command != 'HEAD':
+        request.wfile.write(data)
@@ -0,0 +1,159 @@
+"""
+Builder for small synthetic APK files with a compiled resource table (resources.arsc)
+and a binary AndroidManifest.xml, used to test the arsc mode without apktool.
+
+Resources are given as {qualifier: {type: {name: value}}}, e.g.
+{'': {'string': {'hello': 'Hello'}}, 'de': {'plurals': {'n': {'one': 'Eins', 'other': 'Viele'}}}}.
+Strings listed in ``styled`` get a bold style span.
+"""
+import struct
+import zipfile
+from typing import Dict, List, Optional
+
+QUANTITY_IDS = {'other': 0x01000004, 'zero': 0x01000005, 'one': 0x01000006,
+                'two': 0x01000007, 'few': 0x01000008, 'many': 0x01000009}
+
+TYPES = ['string', 'plurals']
+
+
+def _pad4(data: bytes) -> bytes:
+    return data + b'\0' * (-len(data) % 4)
+
+
+def _len8(n: int) -> bytes:
+    return bytes(((n >> 8) | 0x80, n & 0xFF)) if n > 0x7F else bytes((n,))
+
+
+def string_pool(strings: List[str], utf8=True, styles: Optional[List[List[tuple]]] = None) -> bytes:
+    styles = styles or []
+    data = b''
+    offsets = []
+
+    for string in strings:
+        offsets.append(len(data))
+        if utf8:
+            encoded = string.encode('utf-8')
+            data += _len8(len(string.encode('utf-16-le')) // 2) + _len8(len(encoded)) + encoded + b'\0'
+        else:
+            encoded = string.encode('utf-16-le')
+            data += struct.pack('<H', len(encoded) // 2) + encoded + b'\0\0'
+    data = _pad4(data)
+
+    style_data = b''
+    style_offsets = []
+    for spans in styles:
+        style_offsets.append(len(style_data))
+        for span in spans:
+            style_data += struct.pack('<III', *span)
+        style_data += struct.pack('<I', 0xFFFFFFFF)
+    if styles:
+        style_data += struct.pack('<II', 0xFFFFFFFF, 0xFFFFFFFF)
+
+    header_size = 28
+    strings_start = header_size + 4 * (len(strings) + len(styles))
+    styles_start = strings_start + len(data) if styles else 0
+    size = strings_start + len(data) + len(style_data)
+
+    return struct.pack('<HHIIIIII', 0x0001, header_size, size, len(strings), len(styles),
+                       0x100 if utf8 else 0, strings_start, styles_start) + \
+        struct.pack('<%dI' % len(offsets), *offsets) + struct.pack('<%dI' % len(style_offsets), *style_offsets) + \
+        data + style_data
+
+
+def _config(qualifier: str) -> bytes:
+    config = bytearray(64)
+    struct.pack_into('<I', config, 0, 64)
+    if qualifier:
+        parts = qualifier.split('-')
+        config[8:10] = parts[0].encode()
+        if len(parts) > 1:
+            config[10:12] = parts[1][1:].encode()
+    return bytes(config)
+
+
+def build_arsc(resources: Dict[str, Dict[str, dict]], styled=(), utf8=True) -> bytes:
+    # Global string pool, styled strings first
+    values = []
+    for types in resources.values():
+        for rtype, entries in types.items():
+            for value in entries.values():
+                values += value.values() if isinstance(value, dict) else [value]
+
+    strings = list(styled) + sorted(set(v for v in values if v not in styled)) + ['b']
+    styles = [[(len(strings) - 1, 0, 1)] for _ in styled]
+    pool = string_pool(strings, utf8, styles)
+
+    # Keys and entry ids per type
+    names = {rtype: sorted(set(name for types in resources.values() for name in types.get(rtype, {})))
+             for rtype in TYPES}
+    keys = sorted(set(n for type_names in names.values() for n in type_names))
+
+    type_pool = string_pool(TYPES)
+    key_pool = string_pool(keys)
+
+    chunks = b''
+    for type_id, rtype in enumerate(TYPES, 1):
+        n_entries = len(names[rtype])
+        chunks += struct.pack('<HHIBBHI', 0x0202, 16, 16 + 4 * n_entries, type_id, 0, 0, n_entries) + \
+            b'\0' * (4 * n_entries)
+
+        for qualifier, types in resources.items():
+            entries = types.get(rtype)
+            if not entries:
+                continue
+
+            offsets = []
+            entry_data = b''
+            for name in names[rtype]:
+                if name not in entries:
+                    offsets.append(0xFFFFFFFF)
+                    continue
+
+                offsets.append(len(entry_data))
+                value = entries[name]
+                if isinstance(value, dict):
+                    entry_data += struct.pack('<HHIII', 16, 1, keys.index(name), 0, len(value))
+                    for quantity, text in value.items():
+                        entry_data += struct.pack('<IHBBI', QUANTITY_IDS[quantity], 8, 0, 3, strings.index(text))
+                else:
+                    entry_data += struct.pack('<HHI', 8, 0, keys.index(name)) + \
+                        struct.pack('<HBBI', 8, 0, 3, strings.index(value))
+
+            header_size = 20 + 64
+            entries_start = header_size + 4 * n_entries
+            chunks += struct.pack('<HHIBBHII', 0x0201, header_size, entries_start + len(entry_data), type_id, 0, 0,
+                                  n_entries, entries_start) + _config(qualifier) + \
+                struct.pack('<%dI' % n_entries, *offsets) + entry_data
+
+    header_size = 288
+    package_name = 'com.spotify.music'.encode('utf-16-le').ljust(256, b'\0')
+    package = struct.pack('<HHII', 0x0200, header_size, header_size + len(type_pool) + len(key_pool) + len(chunks),
+                          0x7f) + package_name + \
+        struct.pack('<IIIII', header_size, len(TYPES), header_size + len(type_pool), len(keys), 0) + \
+        type_pool + key_pool + chunks
+
+    return struct.pack('<HHII', 0x0002, 12, 12 + len(pool) + len(package), 1) + pool + package
+
+
+def build_manifest(version_name: str) -> bytes:
+    strings = ['versionName', 'android', 'http://schemas.android.com/apk/res/android', 'manifest', version_name]
+    pool = string_pool(strings, utf8=False)
+    resource_map = struct.pack('<HHII', 0x0180, 8, 12, 0x0101021c)
+
+    attr = struct.pack('<IIIHBBI', 2, 0, 4, 8, 0, 3, 4)
+    start_element = struct.pack('<HHIII', 0x0102, 16, 16 + 20 + len(attr), 1, 0xFFFFFFFF) + \
+        struct.pack('<IIHHHHHH', 0xFFFFFFFF, 3, 20, 20, 1, 0, 0, 0) + attr
+    end_element = struct.pack('<HHIIIII', 0x0103, 16, 24, 1, 0xFFFFFFFF, 0xFFFFFFFF, 3)
+
+    body = pool + resource_map + start_element + end_element
+    return struct.pack('<HHI', 0x0003, 8, 8 + len(body)) + body
+
+
+def build_apk(file: str, resources: Dict[str, Dict[str, dict]], version_name: str, styled=(), utf8=True,
+              files: Optional[Dict[str, bytes]] = None):
+    with zipfile.ZipFile(file, 'w') as apk:
+        apk.writestr('AndroidManifest.xml', build_manifest(version_name), zipfile.ZIP_DEFLATED)
+        apk.writestr('resources.arsc', build_arsc(resources, styled, utf8), zipfile.ZIP_STORED)
+
+        for name, data in (files or {}).items():
+            apk.writestr(name, data, zipfile.ZIP_DEFLATED)
@@ -1,15 +1,19 @@
 import unittest
 import os
+import shutil
+import tempfile
 import time
+import tracemalloc
+import zipfile
 import tests
-from spotify_gender_ex import replacement_table
+from spotify_gender_ex import replacement_table, lang_file, scanner, repack, appstore
 
 DIR_PERFORMANCE = os.path.join(tests.DIR_TESTFILES, 'performance')
 
 
 @unittest.skipUnless(tests.TEST_PERFORMANCE, 'performance testing skipped')
 class PerformanceTest(unittest.TestCase):
-    def _performance_test(self, folder):
+    def _performance_test(self, folder, engine='tree'):
         tests.clear_tmp_folder()
 
         DIR_INPUT = os.path.join(DIR_PERFORMANCE, folder)
@@ -26,10 +30,10 @@ class PerformanceTest(unittest.TestCase):
             i += 1
 
         start_time = time.time_ns()
-        manager.do_replace(tests.DIR_TMP)
+        manager.do_replace(tests.DIR_TMP, engine=engine)
 
         runtime = time.time_ns() - start_time
-        print('%s test took %d ms' % (folder, (runtime / 1000000)))
+        print('%s test (%s) took %d ms' % (folder, engine, (runtime / 1000000)))
 
         tests.assert_files_equal(self, os.path.join(DIR_INPUT, 'lang_nogender.xml'),
                                  os.path.join(tests.DIR_TMP, 'lang.xml'))
@@ -42,3 +46,192 @@ class PerformanceTest(unittest.TestCase):
 
     def test_performance_100k(self):
         self._performance_test('100k')
+
+    def test_performance_10k_stream(self):
+        self._performance_test('10k', 'stream')
+
+    def test_performance_10k_splice(self):
+        self._performance_test('10k', 'splice')
+
+    def test_performance_is_suspicious(self):
+        # All language fields and replacement values from the 10k test files
+        lfile = lang_file.LangFile(os.path.join(DIR_PERFORMANCE, '10k', 'lang.xml'))
+        strings = [elm.text for elm in lfile.tree.iter() if elm.text]
+
+        for i in (1, 2):
+            rt = replacement_table.ReplacementTable.from_file(
+                os.path.join(DIR_PERFORMANCE, '10k', 'replacements_%d.json' % i))
+            for rset in rt.sets:
+                strings += rset.replace.values()
+
+        def is_suspicious_2pass(string):
+            return bool(lang_file.GENDER_REGEX.search(lang_file.cleanhtml(string)))
+
+        start_time = time.time_ns()
+        verdicts_2pass = [is_suspicious_2pass(string) for string in strings]
+        runtime_2pass = time.time_ns() - start_time
+
+        lang_file.is_suspicious.cache_clear()
+        start_time = time.time_ns()
+        verdicts = [lang_file.is_suspicious(string) for string in strings]
+        runtime = time.time_ns() - start_time
+
+        start_time = time.time_ns()
+        verdicts_cached = [lang_file.is_suspicious(string) for string in strings]
+        runtime_cached = time.time_ns() - start_time
+
+        print('is_suspicious (%d strings): 2-pass %d ms, fused %d ms, cached %d ms' % (
+            len(strings), runtime_2pass / 1000000, runtime / 1000000, runtime_cached / 1000000))
+
+        self.assertEqual(verdicts_2pass, verdicts)
+        self.assertEqual(verdicts_2pass, verdicts_cached)
+
+    def test_performance_table_cache(self):
+        tests.clear_tmp_folder()
+        dir_cache = os.path.join(tests.DIR_TMP, 'cache')
+        rt_files = [os.path.join(DIR_PERFORMANCE, '100k', 'replacements_%d.json' % i) for i in (1, 2)]
+
+        # Loading the tables and building the replacement index
+        def load_tables(cache):
+            start_time = time.time_ns()
+            rtabs = [replacement_table.ReplacementTable.from_file(file, cache) for file in rt_files]
+            for rtab in rtabs:
+                rtab.get_index()
+            return rtabs, time.time_ns() - start_time
+
+        rtabs_json, runtime_json = load_tables(None)
+        rtabs_cold, runtime_cold = load_tables(dir_cache)
+        rtabs_warm, runtime_warm = load_tables(dir_cache)
+
+        print('Replacement table loading: JSON %d ms, cold cache %d ms, warm cache %d ms' % (
+            runtime_json / 1000000, runtime_cold / 1000000, runtime_warm / 1000000))
+
+        for i in range(len(rt_files)):
+            self.assertEqual(rtabs_json[i].to_string(), rtabs_warm[i].to_string())
+            self.assertEqual(rtabs_json[i].get_index(), rtabs_warm[i].get_index())
+
+    def test_performance_bulk_replace(self):
+        # Replacement stage only (without parsing and writing), field by field vs. in bulk
+        dir_input = os.path.join(DIR_PERFORMANCE, '10k')
+        manager = replacement_table.ReplacementManager(dir_input)
+        for i in (1, 2):
+            manager.add_rtab(replacement_table.ReplacementTable.from_file(
+                os.path.join(dir_input, 'replacements_%d.json' % i)), str(i))
+
+        lf_index = manager._get_index()['lang.xml']
+        lf_callback = lang_file.LangFile(os.path.join(dir_input, 'lang.xml'))
+        lf_bulk = lang_file.LangFile(os.path.join(dir_input, 'lang.xml'))
+
+        def fun_replace(key, old):
+            new_string = manager.get_replacement('lang.xml', key, old)
+            if new_string:
+                return new_string
+            lang_file.is_suspicious(old)
+
+        lang_file.is_suspicious.cache_clear()
+        start_time = time.time_ns()
+        lf_callback.replace_tree(fun_replace)
+        runtime_callback = time.time_ns() - start_time
+
+        lang_file.is_suspicious.cache_clear()
+        start_time = time.time_ns()
+        keys, texts, handles = lf_bulk.get_fields()
+        new_texts, suspicious = replacement_table._resolve_fields(lf_index, keys, texts)
+        hits = [i for i, new_text in enumerate(new_texts) if new_text]
+        lf_bulk.set_texts([handles[i] for i in hits], [new_texts[i] for i in hits])
+        runtime_bulk = time.time_ns() - start_time
+
+        print('Replacing %d fields: callback %d ms (%.2f µs/field), bulk %d ms (%.2f µs/field)' % (
+            len(keys), runtime_callback / 1000000, runtime_callback / 1000 / len(keys),
+            runtime_bulk / 1000000, runtime_bulk / 1000 / len(keys)))
+
+        self.assertEqual(suspicious, [])
+        self.assertEqual([elm.text for elm in lf_callback.tree.iter()], [elm.text for elm in lf_bulk.tree.iter()])
+
+    def test_performance_scan(self):
+        # Decompiled app with 80 locales, each containing the 10k language file
+        tests.clear_tmp_folder()
+        for i in range(80):
+            dir_values = os.path.join(tests.DIR_TMP, 'res', 'values-l%d' % i)
+            os.makedirs(dir_values)
+            shutil.copyfile(os.path.join(DIR_PERFORMANCE, '10k', 'lang.xml'), os.path.join(dir_values, 'strings.xml'))
+
+        runtimes = []
+        reports = []
+        for processes in (1, max(2, os.cpu_count() or 1)):
+            lang_file.is_suspicious.cache_clear()
+            start_time = time.time_ns()
+            reports.append(scanner.scan_resources(tests.DIR_TMP, processes=processes)[0])
+            runtimes.append((processes, time.time_ns() - start_time))
+
+        print('Scan of 80 language files: ' + ', '.join(
+            '%d process(es) %d ms' % (processes, runtime / 1000000) for processes, runtime in runtimes))
+
+        self.assertEqual(80, len(reports[0]))
+        self.assertEqual(reports[0], reports[1])
+
+    def test_performance_repack(self):
+        # APK with 40 MB of compressed dex files and 20 MB of uncompressed native libraries
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        file_orig = os.path.join(tmp_dir.name, 'orig.apk')
+        file_out = os.path.join(tmp_dir.name, 'out.apk')
+
+        with zipfile.ZipFile(file_orig, 'w') as z:
+            for i in range(4):
+                z.writestr('classes%d.dex' % i, os.urandom(1024) * 10240, zipfile.ZIP_DEFLATED)
+                z.writestr('lib/arm64-v8a/lib%d.so' % i, os.urandom(5 * 1024 * 1024), zipfile.ZIP_STORED)
+            z.writestr('resources.arsc', b'arsc', zipfile.ZIP_STORED)
+
+        changed_files = {'resources.arsc': b'new arsc'}
+
+        start_time = time.time_ns()
+        with zipfile.ZipFile(file_orig) as z_in, zipfile.ZipFile(file_out, 'w') as z_out:
+            for info in z_in.infolist():
+                z_out.writestr(info, changed_files.get(info.filename) or z_in.read(info))
+        runtime_zipfile = time.time_ns() - start_time
+
+        start_time = time.time_ns()
+        repack.repack_apk(file_out, file_orig, changed_files=changed_files)
+        runtime_repack = time.time_ns() - start_time
+
+        print('Repacking a 60 MB APK: zipfile %d ms, raw copy %d ms' % (
+            runtime_zipfile / 1000000, runtime_repack / 1000000))
+
+        with zipfile.ZipFile(file_out) as z:
+            self.assertIsNone(z.testzip())
+            self.assertEqual(b'new arsc', z.read('resources.arsc'))
+
+    def test_performance_apkcombo_page(self):
+        from tests import apkcombo_bs4
+
+        # Download page with about 350 KB of other content (app cards) before and after the variant list
+        with open(os.path.join(tests.DIR_TESTFILES, 'apkcombo', 'spotify.html'), 'r', encoding='utf-8') as f:
+            page = f.read()
+
+        card = '<div class="app-card"><a href="/app/%d/"><img src="/img/%d.png" alt="App"><span class="name">' \
+               'App %d</span><span class="vername">1.0.%d</span></a><p>Description<br>text</p></div>\n'
+        filler = ''.join(card % (i, i, i, i) for i in range(1000))
+        pos = page.index('<div class="tabs">')
+        page = page[:pos] + filler + page[pos:].replace('<footer>', filler + '<footer>')
+
+        def measure(parse):
+            start_time = time.time_ns()
+            apps = parse(page, 'token')
+            runtime = time.time_ns() - start_time
+
+            # Separate run, since tracing slows down the parsers
+            tracemalloc.start()
+            parse(page, 'token')
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            return apps, runtime, peak
+
+        apps_bs4, runtime_bs4, peak_bs4 = measure(apkcombo_bs4.parse_page)
+        apps, runtime, peak = measure(appstore.Apkcombo()._parse_page)
+
+        print('Parsing the Apkcombo page (%d KB): BeautifulSoup %d ms (peak %d KB), event parser %d ms (peak %d KB)' % (
+            len(page) / 1024, runtime_bs4 / 1000000, peak_bs4 / 1024, runtime / 1000000, peak / 1024))
+
+        self.assertEqual([(a.version, a.cpu_archs, a.download_url) for a in apps_bs4],
+                         [(a.version, a.cpu_archs, a.download_url) for a in apps])
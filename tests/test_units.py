@@ -1,14 +1,29 @@
+import asyncio
+import contextlib
+import hashlib
+import io
+import json
 import os
+import re
 import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
+import zipfile
 from unittest import mock
+from xml.etree import ElementTree
 import pytest
 
 import github3
 from github3 import GitHub
 
 import tests
-from spotify_gender_ex import downloader, appstore, workdir, replacement_table, lang_file, gh_issue
+from tests import local_server, synthetic_apk
+from spotify_gender_ex import downloader, appstore, workdir, replacement_table, lang_file, gh_issue, scanner, arsc, \
+    repack, cache, genderex, checkpoint, pipeline, http_session, blob_store
 
 RT_STRING = '''{
   "version": 1,
@@ -45,6 +60,439 @@ class DownloaderTest(unittest.TestCase):
         self.assertTrue(len(rtab.spotify_versions) > 0)
 
 
+class HttpSessionTest(unittest.TestCase):
+    def setUp(self):
+        tests.clear_tmp_folder()
+        self.n_flaky = 0
+
+        def apk_headers(request, status=200, headers=None):
+            request.send_response(status)
+            request.send_header('Content-Type', 'application/vnd.android.package-archive')
+            for key, val in (headers or {}).items():
+                request.send_header(key, val)
+            request.end_headers()
+
+        def head(request):
+            apk_headers(request, headers={'Content-Length': '2000000'})
+            if request.command == 'GET':
+                request.wfile.write(b'\0' * 2000000)
+
+        def no_head(request):
+            if request.command == 'HEAD':
+                local_server.send_data(request, b'', 405)
+            else:
+                self.assertEqual('bytes=0-0', request.headers.get('Range'))
+                apk_headers(request, 206, {'Content-Length': '1', 'Content-Range': 'bytes 0-0/2000000'})
+                request.wfile.write(b'\0')
+
+        def small(request):
+            apk_headers(request, headers={'Content-Length': '0'})
+
+        def html(request):
+            local_server.send_data(request, b'<html></html>', headers={'Content-Type': 'text/html'})
+
+        def flaky(request):
+            self.n_flaky += 1
+            local_server.send_data(request, b'ok', 503 if self.n_flaky == 1 else 200)
+
+        self.server = local_server.LocalServer({'/head.apk': head, '/nohead.apk': no_head, '/small.apk': small,
+                                                '/html': html, '/flaky': flaky})
+        self.server.__enter__()
+
+    def tearDown(self):
+        self.server.__exit__()
+
+    def _get_requests(self):
+        return [req[:2] for req in self.server.requests]
+
+    def test_check_app_file(self):
+        appstore.check_app_file(self.server.url + '/head.apk', {})
+        self.assertEqual([('HEAD', '/head.apk')], self._get_requests())
+
+        appstore.check_app_file(self.server.url + '/nohead.apk', {})
+        self.assertEqual([('HEAD', '/nohead.apk'), ('GET', '/nohead.apk')], self._get_requests()[1:])
+
+        with self.assertRaises(appstore.StoreException):
+            appstore.check_app_file(self.server.url + '/small.apk', {})
+        with self.assertRaises(appstore.StoreException):
+            appstore.check_app_file(self.server.url + '/html', {})
+        with self.assertRaises(appstore.StoreException):
+            appstore.check_app_file(self.server.url + '/missing.apk', {})
+
+    def test_keep_alive(self):
+        for _ in range(3):
+            with http_session.get(self.server.url + '/html') as resp:
+                self.assertEqual(b'<html></html>', resp.content)
+
+        self.assertEqual(3, len(self.server.requests))
+        self.assertEqual(1, len(self.server.connections))
+
+    def test_retry(self):
+        with http_session.get(self.server.url + '/flaky') as resp:
+            self.assertEqual(200, resp.status_code)
+        self.assertEqual(2, self.n_flaky)
+
+    def test_download_file(self):
+        path = os.path.join(tests.DIR_TMP, 'app.apk')
+        self.assertTrue(downloader.download_file(self.server.url + '/head.apk', path))
+        self.assertEqual(2000000, os.path.getsize(path))
+
+        self.assertFalse(downloader.download_file(self.server.url + '/missing.apk', path + '2'))
+
+
+class ResumableDownloadTest(unittest.TestCase):
+    def setUp(self):
+        tests.clear_tmp_folder()
+        self.data = bytes(range(256)) * 1200
+        self.etag = '"v1"'
+        # Number of bytes sent before the connection is dropped (None: complete response)
+        self.drop_after = None
+        self.support_range = True
+        self.after_response = None
+
+        def apk(request):
+            data = self.data
+            status = 200
+            headers = {'ETag': self.etag}
+            if self.support_range:
+                headers['Accept-Ranges'] = 'bytes'
+
+            range_match = re.fullmatch(r'bytes=(\d+)-(\d*)', request.headers.get('Range', ''))
+            if_range = request.headers.get('If-Range')
+
+            if self.support_range and range_match and if_range in (None, self.etag):
+                start = int(range_match.group(1))
+                end = int(range_match.group(2) or len(self.data) - 1)
+                if start >= len(self.data):
+                    headers['Content-Range'] = 'bytes */%d' % len(self.data)
+                    local_server.send_data(request, b'', 416, headers)
+                    return
+
+                data = self.data[start:end + 1]
+                status = 206
+                headers['Content-Range'] = 'bytes %d-%d/%d' % (start, start + len(data) - 1, len(self.data))
+
+            request.send_response(status)
+            request.send_header('Content-Length', str(len(data)))
+            for key, val in headers.items():
+                request.send_header(key, val)
+            request.end_headers()
+
+            if request.command == 'HEAD':
+                pass
+            elif self.drop_after is not None and self.drop_after < len(data):
+                request.wfile.write(data[:self.drop_after])
+                request.close_connection = True
+            else:
+                request.wfile.write(data)
+
+            if self.after_response:
+                self.after_response()
+
+        self.server = local_server.LocalServer({'/app.apk': apk})
+        self.server.__enter__()
+
+        self.url = self.server.url + '/app.apk'
+        self.path = os.path.join(tests.DIR_TMP, 'app.apk')
+
+        self.patch_delay = mock.patch.object(downloader, 'DOWNLOAD_RETRY_DELAY', 0)
+        self.patch_delay.start()
+
+    def tearDown(self):
+        self.patch_delay.stop()
+        self.server.__exit__()
+
+    def _get_ranges(self):
+        return [req[2].get('Range') for req in self.server.requests]
+
+    def _assert_downloaded(self):
+        with open(self.path, 'rb') as f:
+            self.assertEqual(self.data, f.read())
+
+        self.assertFalse(os.path.exists(self.path + downloader.PART_SUFFIX))
+        self.assertFalse(os.path.exists(self.path + downloader.VALIDATOR_SUFFIX))
+        self.assertEqual(hashlib.sha256(self.data).hexdigest(), downloader.read_sha256(self.path))
+
+    def test_dropped_connection(self):
+        # The incomplete last chunk of a response is discarded
+        self.drop_after = 2 * downloader.DOWNLOAD_CHUNK_SIZE + 1000
+
+        self.assertTrue(downloader.download_file(self.url, self.path))
+        self._assert_downloaded()
+
+        self.assertEqual([None, 'bytes=%d-' % (2 * downloader.DOWNLOAD_CHUNK_SIZE),
+                          'bytes=%d-' % (4 * downloader.DOWNLOAD_CHUNK_SIZE)], self._get_ranges())
+        self.assertEqual({None, self.etag}, {req[2].get('If-Range') for req in self.server.requests})
+
+    def _write_part_file(self, data: bytes, validator=None):
+        with open(self.path + downloader.PART_SUFFIX, 'wb') as f:
+            f.write(data)
+        if validator:
+            with open(self.path + downloader.VALIDATOR_SUFFIX, 'w') as f:
+                f.write(validator)
+
+    def test_resume_part_file(self):
+        self._write_part_file(self.data[:1000], self.etag)
+
+        self.assertTrue(downloader.download_file(self.url, self.path))
+        self._assert_downloaded()
+        self.assertEqual(['bytes=1000-'], self._get_ranges())
+        self.assertEqual(self.etag, self.server.requests[0][2].get('If-Range'))
+        self.assertFalse(os.path.exists(self.path + downloader.VALIDATOR_SUFFIX))
+
+    def test_resume_part_file_changed(self):
+        # The file has changed on the server since the previous call
+        self._write_part_file(self.data[:1000], self.etag)
+        self.data = bytes(reversed(self.data))
+        self.etag = '"v2"'
+
+        self.assertTrue(downloader.download_file(self.url, self.path))
+        self._assert_downloaded()
+        self.assertEqual(['bytes=1000-'], self._get_ranges())
+
+    def test_resume_part_file_no_validator(self):
+        # Without validator, the server cannot check if the file has changed
+        self._write_part_file(b'x' * 1000)
+
+        self.assertTrue(downloader.download_file(self.url, self.path))
+        self._assert_downloaded()
+        self.assertEqual([None], self._get_ranges())
+
+    def test_resume_interrupted(self):
+        # Download interrupted in a previous call
+        self.drop_after = 2 * downloader.DOWNLOAD_CHUNK_SIZE + 1000
+
+        def fail():
+            self.drop_after = 0
+
+        self.after_response = fail
+        self.assertFalse(downloader.download_file(self.url, self.path, retries=0))
+        with open(self.path + downloader.VALIDATOR_SUFFIX) as f:
+            self.assertEqual(self.etag, f.read())
+
+        self.drop_after = None
+        self.after_response = None
+        self.server.requests.clear()
+
+        self.assertTrue(downloader.download_file(self.url, self.path))
+        self._assert_downloaded()
+        self.assertEqual([('bytes=%d-' % (2 * downloader.DOWNLOAD_CHUNK_SIZE), self.etag)],
+                         [(req[2].get('Range'), req[2].get('If-Range')) for req in self.server.requests])
+
+    def test_resume_complete_part_file(self):
+        self._write_part_file(self.data, self.etag)
+
+        self.assertTrue(downloader.download_file(self.url, self.path))
+        self._assert_downloaded()
+        self.assertEqual(['bytes=307200-'], self._get_ranges())
+
+    def test_no_range_support(self):
+        self.support_range = False
+        with open(self.path + downloader.PART_SUFFIX, 'wb') as f:
+            f.write(b'x' * 1000)
+
+        # The whole file is downloaded again
+        self.assertTrue(downloader.download_file(self.url, self.path))
+        self._assert_downloaded()
+
+    def test_changed_file(self):
+        self.drop_after = 2 * downloader.DOWNLOAD_CHUNK_SIZE + 1000
+
+        def change_file():
+            self.data = bytes(reversed(self.data))
+            self.etag = '"v2"'
+            self.drop_after = None
+            self.after_response = None
+
+        # The file changes on the server after the connection was dropped
+        self.after_response = change_file
+
+        self.assertTrue(downloader.download_file(self.url, self.path))
+        self._assert_downloaded()
+
+        self.assertEqual([None, 'bytes=%d-' % (2 * downloader.DOWNLOAD_CHUNK_SIZE)], self._get_ranges())
+        self.assertEqual('"v1"', self.server.requests[1][2].get('If-Range'))
+
+    def test_give_up(self):
+        self.drop_after = 0
+
+        self.assertFalse(downloader.download_file(self.url, self.path, retries=2))
+        self.assertEqual(3, len(self.server.requests))
+        self.assertFalse(os.path.exists(self.path))
+
+        self.assertFalse(downloader.download_file(self.server.url + '/missing.apk', self.path))
+        self.assertEqual(4, len(self.server.requests))
+
+    def test_checksum(self):
+        self.assertFalse(downloader.download_file(self.url, self.path, sha256='0' * 64))
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(os.path.exists(self.path + downloader.PART_SUFFIX))
+
+        self.assertTrue(downloader.download_file(self.url, self.path, sha256=hashlib.sha256(self.data).hexdigest()))
+        self._assert_downloaded()
+
+    def test_segments(self):
+        with mock.patch.object(downloader, 'MIN_SEGMENT_SIZE', 50000):
+            self.assertTrue(downloader.download_file(self.url, self.path, segments=4))
+        self._assert_downloaded()
+
+        self.assertEqual('HEAD', self.server.requests[0][0])
+        self.assertEqual(['bytes=0-76799', 'bytes=76800-153599', 'bytes=153600-230399', 'bytes=230400-307199'],
+                         sorted(self._get_ranges()[1:], key=lambda r: int(r[6:].split('-')[0])))
+        self.assertEqual({'"v1"'}, {req[2].get('If-Range') for req in self.server.requests[1:]})
+
+        # Small file: single connection
+        os.remove(self.path)
+        self.assertTrue(downloader.download_file(self.url, self.path, segments=4))
+        self._assert_downloaded()
+        self.assertEqual([None], self._get_ranges()[6:])
+
+    def test_segments_dropped_connection(self):
+        self.drop_after = downloader.DOWNLOAD_CHUNK_SIZE + 1000
+
+        with mock.patch.object(downloader, 'MIN_SEGMENT_SIZE', 50000):
+            self.assertTrue(downloader.download_file(self.url, self.path, segments=4))
+        self._assert_downloaded()
+
+        # Each segment is resumed after the first chunk
+        self.assertEqual(9, len(self.server.requests))
+        self.assertIn('bytes=%d-76799' % downloader.DOWNLOAD_CHUNK_SIZE, self._get_ranges())
+
+    def test_segments_no_range_support(self):
+        self.support_range = False
+
+        with mock.patch.object(downloader, 'MIN_SEGMENT_SIZE', 50000):
+            self.assertTrue(downloader.download_file(self.url, self.path, segments=4))
+        self._assert_downloaded()
+        self.assertEqual([('HEAD', None), ('GET', None)], [(req[0], req[2].get('Range'))
+                                                           for req in self.server.requests])
+
+    def test_segments_changed_file(self):
+        def change_file():
+            self.data = bytes(reversed(self.data))
+            self.etag = '"v2"'
+            self.after_response = None
+
+        # The file changes after the HEAD request, the server sends the whole file
+        # for the segment requests. It is downloaded again with a single connection.
+        self.after_response = change_file
+
+        with mock.patch.object(downloader, 'MIN_SEGMENT_SIZE', 50000):
+            self.assertTrue(downloader.download_file(self.url, self.path, segments=4))
+        self._assert_downloaded()
+        self.assertEqual(6, len(self.server.requests))
+
+    def test_segments_no_pwrite(self):
+        pwrite = getattr(os, 'pwrite', None)
+        if pwrite:
+            del os.pwrite
+
+        try:
+            with mock.patch.object(downloader, 'MIN_SEGMENT_SIZE', 50000):
+                self.assertTrue(downloader.download_file(self.url, self.path, segments=4))
+        finally:
+            if pwrite:
+                os.pwrite = pwrite
+        self._assert_downloaded()
+
+    def test_read_sha256(self):
+        self.assertTrue(downloader.download_file(self.url, self.path))
+        digest = hashlib.sha256(self.data).hexdigest()
+
+        with open(self.path + downloader.SHA256_SUFFIX, 'r', encoding='utf-8') as f:
+            self.assertEqual(digest + '  app.apk\n', f.read())
+
+        # Hash is used by GenderEx
+        gex = genderex.GenderEx(folder_out=tests.DIR_TMP, no_internal=True, no_interaction=True,
+                                apk_file=self.path)
+        with mock.patch.object(cache, 'sha256_file') as sha256_file:
+            self.assertEqual(digest, gex.get_apk_sha256())
+        sha256_file.assert_not_called()
+
+        # File modified after the hash was written
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertIsNone(downloader.read_sha256(self.path))
+
+        os.remove(self.path + downloader.SHA256_SUFFIX)
+        self.assertIsNone(downloader.read_sha256(self.path))
+
+
+class ReplacementTableDownloadTest(unittest.TestCase):
+    def setUp(self):
+        tests.clear_tmp_folder()
+        self.dir_cache = os.path.join(tests.DIR_TMP, 'cache')
+        self.sha = 'sha1'
+        self.delay = 0
+
+        def ghapi(request):
+            time.sleep(self.delay)
+            etag = '"%s"' % self.sha
+            if request.headers.get('If-None-Match') == etag:
+                local_server.send_data(request, b'', 304)
+            else:
+                local_server.send_data(request, json.dumps({'sha': self.sha}).encode(), headers={'ETag': etag})
+
+        def rtable(request):
+            local_server.send_data(request, RT_STRING.replace('"version": 1', '"version": %s' % request.path[-1])
+                                   .encode())
+
+        self.server = local_server.LocalServer({'/commits': ghapi, '/sha1': rtable, '/sha2': rtable})
+        self.server.__enter__()
+
+        self.urls = downloader.URL_GHAPI, downloader.URL_RTABLE
+        downloader.URL_GHAPI = self.server.url + '/commits'
+        downloader.URL_RTABLE = self.server.url + '/%s'
+
+    def tearDown(self):
+        downloader.URL_GHAPI, downloader.URL_RTABLE = self.urls
+        self.server.__exit__()
+
+    def _get_version(self, **kwargs) -> int:
+        rpl_text = downloader.get_replacement_table_raw(self.dir_cache, **kwargs)
+        return replacement_table.ReplacementTable.from_string(rpl_text).version
+
+    def _get_requests(self):
+        return [req[1] for req in self.server.requests]
+
+    def test_cache(self):
+        self.assertEqual(1, self._get_version())
+        self.assertEqual(['/commits', '/sha1'], self._get_requests())
+
+        # Within TTL: no requests
+        self.assertEqual(1, self._get_version())
+        self.assertEqual(2, len(self.server.requests))
+
+        # TTL expired: conditional request
+        self.assertEqual(1, self._get_version(ttl=0))
+        self.assertEqual(['/commits', '/sha1', '/commits'], self._get_requests())
+        self.assertEqual('"sha1"', self.server.requests[-1][2].get('If-None-Match'))
+
+        # New commit
+        self.sha = 'sha2'
+        self.assertEqual(2, self._get_version(ttl=0))
+        self.assertEqual(['/commits', '/sha1', '/commits', '/commits', '/sha2'], self._get_requests())
+
+    def test_timeout(self):
+        self.delay = 1
+
+        # No cached table
+        self.assertIsNone(downloader.get_replacement_table_raw(self.dir_cache, timeout=0.2))
+
+        # Use cached table
+        self.delay = 0
+        self.assertEqual(1, self._get_version())
+        self.sha = 'sha2'
+        self.delay = 1
+        self.assertEqual(1, self._get_version(ttl=0, timeout=0.2))
+
+    def test_no_cache(self):
+        self.assertEqual(1, self._get_version())
+        self.assertEqual(1, replacement_table.ReplacementTable.from_string(
+            downloader.get_replacement_table_raw()).version)
+        self.assertEqual(['/commits', '/sha1', '/commits', '/sha1'], self._get_requests())
+
+
 class AppstoreTest(unittest.TestCase):
     # Store sites dont work on GH actions because Cloudflare
     @pytest.mark.skipif(tests.ON_GH_ACTIONS, reason='GH Actions')
@@ -67,6 +515,108 @@ class AppstoreTest(unittest.TestCase):
         self.assertEqual(len(app.version.split('.')), 4)
         self.assertTrue(app.download_url.startswith('https://'))
     
+    def test_get_spotify_app_concurrent(self):
+        class Store(appstore.Store):
+            def __init__(self, cpu_arch):
+                pass
+
+        class SlowStore(Store):
+            async def get_spotify_app_async(self, run):
+                await run(time.sleep, 2)
+                return appstore.App('9.0.0.0', {'universal'}, 'https://slow')
+
+        class FastStore(Store):
+            async def get_spotify_app_async(self, run):
+                # Independent requests run concurrently
+                await asyncio.gather(run(time.sleep, 0.2), run(time.sleep, 0.2))
+                return appstore.App('8.8.0.1', {'universal'}, 'https://fast')
+
+        class FailingStore(Store):
+            async def get_spotify_app_async(self, run):
+                raise appstore.StoreException('fail')
+
+        with mock.patch.object(appstore, 'STORES', [SlowStore, FastStore, FailingStore]):
+            start = time.monotonic()
+            results = appstore.query_stores(deadline=0.5)
+            self.assertLess(time.monotonic() - start, 0.8)
+
+            self.assertEqual(['SlowStore', 'FastStore', 'FailingStore'], [r.store for r in results])
+            self.assertEqual([None, '8.8.0.1', None], [r.app.version if r.app else None for r in results])
+            self.assertEqual(['Zeitüberschreitung', '', 'fail'], [r.error for r in results])
+            self.assertGreater(results[0].latency, 0.45)
+            self.assertLess(results[1].latency, 0.35)
+
+            app = appstore.get_spotify_app(deadline=0.5)
+            self.assertEqual('https://fast', app.download_url)
+
+        # Returns as soon as all stores have answered
+        with mock.patch.object(appstore, 'STORES', [FastStore, FastStore]):
+            start = time.monotonic()
+            appstore.get_spotify_app()
+            self.assertLess(time.monotonic() - start, 0.5)
+
+        with mock.patch.object(appstore, 'STORES', [SlowStore, FailingStore]):
+            with self.assertRaises(appstore.StoreException):
+                appstore.get_spotify_app(deadline=0.2)
+
+        self.assertEqual('8.8.0.1', FastStore(None).get_spotify_app().version)
+
+    def test_apkcombo_parse_page(self):
+        with open(os.path.join(tests.DIR_TESTFILES, 'apkcombo', 'spotify.html'), 'r', encoding='utf-8') as f:
+            page = f.read()
+
+        apps = appstore.Apkcombo()._parse_page(page, 'token')
+        url = 'https://download.apkcombo.com/com.spotify.music/Spotify_8.8.0.347_apkcombo.com.apk?ecp=%s' \
+              '&iat=1658000000&token'
+
+        self.assertEqual([('8.8.0.347', {'arm64-v8a'}, url % 'Y29tLnNwb3RpZnkubXVzaWM='),
+                          ('8.8.0.347', {'armeabi-v7a'}, url % 'Y29tLnNwb3RpZnkubXVzaWMvYXJt'),
+                          ('8.8.0.347', {'x86', 'x86_64'}, url % 'eDg2')],
+                         [(app.version, app.cpu_archs, app.download_url) for app in apps])
+
+        with self.assertRaises(appstore.StoreException):
+            appstore.Apkcombo()._parse_page(page.replace('id="variants-tab"', ''), 'token')
+
+    def test_apkcombo_parse_page_bs4(self):
+        # Same result as the previous BeautifulSoup parser
+        apkcombo_bs4 = pytest.importorskip('tests.apkcombo_bs4')
+
+        with open(os.path.join(tests.DIR_TESTFILES, 'apkcombo', 'spotify.html'), 'r', encoding='utf-8') as f:
+            page = f.read()
+
+        variations = [page, page.replace('</li>', ''), page.replace('</ul>', '', 2),
+                      page.replace('class="blur"', 'class="x blur"').replace('<p>', '<p class="file-list">')]
+
+        for variation in variations:
+            self.assertEqual([(a.version, a.cpu_archs, a.download_url)
+                              for a in apkcombo_bs4.parse_page(variation, 'token')],
+                             [(a.version, a.cpu_archs, a.download_url)
+                              for a in appstore.Apkcombo()._parse_page(variation, 'token')])
+
+    def test_apkcombo_local(self):
+        with open(os.path.join(tests.DIR_TESTFILES, 'apkcombo', 'spotify.html'), 'r', encoding='utf-8') as f:
+            page = f.read()
+
+        def apk(request):
+            request.send_response(200)
+            request.send_header('Content-Type', 'application/vnd.android.package-archive')
+            request.send_header('Content-Length', '2000000')
+            request.end_headers()
+
+        with local_server.LocalServer({'/checkin': lambda r: local_server.send_data(r, b'token'),
+                                       '/page': lambda r: local_server.send_data(r, page.encode()),
+                                       '/app.apk': apk}) as server:
+            page = page.replace('https://download.apkcombo.com/com.spotify.music/Spotify_8.8.0.347_apkcombo.com.apk',
+                                server.url + '/app.apk')
+
+            with mock.patch.object(appstore, 'URL_APKCOMBO', server.url + '/page?app=%s'), \
+                    mock.patch.object(appstore, 'URL_APKCOMBO_CHECKIN', server.url + '/checkin'):
+                app = appstore.Apkcombo().get_spotify_app()
+
+        self.assertEqual('8.8.0.347', app.version)
+        self.assertEqual(server.url + '/app.apk?ecp=Y29tLnNwb3RpZnkubXVzaWM=&iat=1658000000&token', app.download_url)
+        self.assertEqual(['/app.apk', '/checkin', '/page'], sorted(req[1] for req in server.requests))
+
     def test_compare_versions(self):
         self.assertEqual(0, appstore.compare_versions('8.6.4.971', '8.6.4.971'))
         self.assertEqual(1, appstore.compare_versions('8.6.5.971', '8.6.4.1000'))
@@ -91,6 +641,558 @@ class WorkdirTest(unittest.TestCase):
         self.assertTrue(os.path.isdir(os.path.join(dir_root, 'output')))
 
 
+class GenderExInitTest(unittest.TestCase):
+    def setUp(self):
+        tests.clear_tmp_folder()
+
+    @staticmethod
+    def _get_spotify_app():
+        time.sleep(0.5)
+        return appstore.App('8.8.0.1', {'universal'}, 'https://example.com/app.apk')
+
+    @staticmethod
+    def _get_replacement_table_raw(cache_dir, ttl):
+        time.sleep(0.5)
+        return replacement_table.ReplacementTable(7, [], []).to_string()
+
+    def test_concurrent(self):
+        with mock.patch.object(appstore, 'get_spotify_app', side_effect=self._get_spotify_app), \
+                mock.patch.object(downloader, 'get_replacement_table_raw', side_effect=self._get_replacement_table_raw):
+            start = time.monotonic()
+            gex = genderex.GenderEx(folder_out=tests.DIR_TMP, no_interaction=True)
+            self.assertLess(time.monotonic() - start, 0.9)
+
+        self.assertEqual('8.8.0.1', gex.get_spotify_store_version())
+        self.assertEqual(['builtin (GitHub)'], list(gex.rtm._rtabs))
+
+    def test_local_apk(self):
+        file_apk = os.path.join(tests.DIR_TMP, 'local.apk')
+        with open(file_apk, 'wb') as f:
+            f.write(b'apk')
+
+        with mock.patch.object(appstore, 'get_spotify_app') as get_spotify_app:
+            gex = genderex.GenderEx(file_apk, folder_out=tests.DIR_TMP, builtin=True, no_interaction=True)
+
+        get_spotify_app.assert_not_called()
+        self.assertTrue(gex.is_operational())
+        self.assertFalse(gex.is_latest_spotify_processed())
+
+    def test_rtable_deadline(self):
+        with mock.patch.object(appstore, 'get_spotify_app', side_effect=appstore.StoreException), \
+                mock.patch.object(downloader, 'get_replacement_table_raw', side_effect=self._get_replacement_table_raw), \
+                mock.patch.object(downloader, 'RTABLE_DEADLINE', 0.1):
+            gex = genderex.GenderEx(folder_out=tests.DIR_TMP, no_interaction=True)
+
+        self.assertEqual(['builtin (lokal)'], list(gex.rtm._rtabs))
+
+    def test_rtable_deadline_cached(self):
+        # After a timeout, the last table fetched from GitHub is used
+        downloader._write_rtable_cache(os.path.join(tests.DIR_TMP, 'GenderEx', 'cache'),
+                                       replacement_table.ReplacementTable(9, [], []).to_string(), {'sha': 'sha1'})
+
+        with mock.patch.object(appstore, 'get_spotify_app', side_effect=appstore.StoreException), \
+                mock.patch.object(downloader, 'get_replacement_table_raw', side_effect=self._get_replacement_table_raw), \
+                mock.patch.object(downloader, 'RTABLE_DEADLINE', 0.1):
+            gex = genderex.GenderEx(folder_out=tests.DIR_TMP, no_interaction=True)
+
+        self.assertEqual(['builtin (GitHub)'], list(gex.rtm._rtabs))
+        self.assertEqual(9, gex.rtm._rtabs['builtin (GitHub)'].version)
+
+    def test_rtable_invalid(self):
+        out = io.StringIO()
+        with mock.patch.object(appstore, 'get_spotify_app', side_effect=appstore.StoreException), \
+                mock.patch.object(downloader, 'get_replacement_table_raw', return_value='{"version": 1'), \
+                contextlib.redirect_stdout(out):
+            gex = genderex.GenderEx(folder_out=tests.DIR_TMP, no_interaction=True)
+
+        self.assertEqual(['builtin (lokal)'], list(gex.rtm._rtabs))
+        self.assertIn('Ersetzungstabelle von GitHub ist ungültig', out.getvalue())
+
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        tests.clear_tmp_folder()
+
+    def _write(self, path, data: bytes, mtime=None):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        if mtime is not None:
+            os.utime(path, (mtime, mtime))
+
+    def test_sha256_file(self):
+        file = os.path.join(tests.DIR_TMP, 'x.bin')
+        data = os.urandom(3 * cache.HASH_BUFSIZE + 5)
+        self._write(file, data)
+        self.assertEqual(hashlib.sha256(data).hexdigest(), cache.sha256_file(file))
+
+    def test_hardlink_tree(self):
+        src = os.path.join(tests.DIR_TMP, 'src')
+        self._write(os.path.join(src, 'a.txt'), b'a')
+        self._write(os.path.join(src, 'res', 'values-de', 'strings.xml'), b'strings')
+        os.makedirs(os.path.join(src, 'empty'))
+
+        dst = os.path.join(tests.DIR_TMP, 'dst')
+        cache.hardlink_tree(src, dst)
+
+        for path in ('a.txt', os.path.join('res', 'values-de', 'strings.xml')):
+            self.assertTrue(os.path.samefile(os.path.join(src, path), os.path.join(dst, path)))
+        self.assertTrue(os.path.isdir(os.path.join(dst, 'empty')))
+
+        # Copy if hardlinks are not supported
+        dst_copy = os.path.join(tests.DIR_TMP, 'dst_copy')
+        with mock.patch('os.link', side_effect=OSError):
+            cache.hardlink_tree(src, dst_copy)
+
+        self.assertFalse(os.path.samefile(os.path.join(src, 'a.txt'), os.path.join(dst_copy, 'a.txt')))
+        with open(os.path.join(dst_copy, 'res', 'values-de', 'strings.xml'), 'rb') as f:
+            self.assertEqual(b'strings', f.read())
+
+    def test_evict_lru(self):
+        dir_cache = os.path.join(tests.DIR_TMP, 'cache')
+        now = time.time()
+
+        self._write(os.path.join(dir_cache, 'new'), b'x' * 400, now)
+        self._write(os.path.join(dir_cache, 'dir', 'a'), b'x' * 300)
+        self._write(os.path.join(dir_cache, 'dir', 'b'), b'x' * 200)
+        os.utime(os.path.join(dir_cache, 'dir'), (now - 10, now - 10))
+        self._write(os.path.join(dir_cache, 'old'), b'x' * 100, now - 20)
+        self._write(os.path.join(dir_cache, 'writing.tmp.1'), b'x' * 1000, now - 30)
+
+        self.assertEqual((0, 1000), cache.evict_lru(dir_cache, 1000))
+
+        # Entries older than the first entry exceeding the size are removed as well
+        self.assertEqual((2, 400), cache.evict_lru(dir_cache, 800))
+        self.assertEqual(['new', 'writing.tmp.1'], sorted(os.listdir(dir_cache)))
+
+        # The most recently used entry is kept
+        self.assertEqual((0, 400), cache.evict_lru(dir_cache, 10))
+        self.assertEqual((0, 0), cache.evict_lru(os.path.join(tests.DIR_TMP, 'nonexistent'), 10))
+
+
+class DecodeCacheTest(unittest.TestCase):
+    def setUp(self):
+        tests.clear_tmp_folder()
+
+        with mock.patch.object(appstore, 'get_spotify_app', side_effect=appstore.StoreException):
+            self.gex = genderex.GenderEx(folder_out=tests.DIR_TMP, builtin=True, no_interaction=True)
+
+        self.gex.file_apktool = os.path.join(tests.DIR_TMP, 'apktool.jar')
+        with open(self.gex.file_apktool, 'wb') as f:
+            f.write(b'apktool')
+        with open(self.gex.workdir.file_apk, 'wb') as f:
+            f.write(b'apk')
+
+        self.n_decompiled = 0
+
+    def _run_apktool(self, cmd, **kwargs):
+        self.assertEqual('d', cmd[3])
+        self.n_decompiled += 1
+
+        os.makedirs(os.path.join(self.gex.workdir.dir_apk, 'res', 'values-de'))
+        with open(self.gex.workdir.file_apktool, 'w', encoding='utf-8') as f:
+            f.write('versionName: 8.8.0.1\n')
+        shutil.copyfile(os.path.join(tests.DIR_LANG, 'file1_withgender.xml'),
+                        os.path.join(self.gex.workdir.dir_apk, 'res', 'values-de', 'strings.xml'))
+
+    def test_decode_cache(self):
+        file_lang = os.path.join(self.gex.workdir.dir_apk, 'res', 'values-de', 'strings.xml')
+
+        with mock.patch('subprocess.run', side_effect=self._run_apktool):
+            self.gex.decompile()
+            self.assertEqual(1, self.n_decompiled)
+            self.assertEqual(1, len(os.listdir(self.gex.workdir.dir_decodecache)))
+
+            # Modify the decompiled app, the cached copy must stay pristine
+            lfile = lang_file.LangFile(file_lang)
+            lfile.replace_tree(lambda key, old: 'changed')
+            lfile.to_file()
+            self.gex._replace_in_file(self.gex.workdir.file_apktool, '8.8.0.1', '1.0')
+
+            # Restore from cache
+            shutil.rmtree(self.gex.workdir.dir_apk)
+            self.gex.decompile()
+            self.assertEqual(1, self.n_decompiled)
+
+            tests.assert_files_equal(self, os.path.join(tests.DIR_LANG, 'file1_withgender.xml'), file_lang)
+            self.assertEqual('8.8.0.1', self.gex.get_spotify_version())
+
+            # Different APK file
+            shutil.rmtree(self.gex.workdir.dir_apk)
+            with open(self.gex.workdir.file_apk, 'wb') as f:
+                f.write(b'apk 2')
+            self.gex.decompile()
+            self.assertEqual(2, self.n_decompiled)
+            self.assertEqual(2, len(os.listdir(self.gex.workdir.dir_decodecache)))
+
+
+class BlobStoreTest(unittest.TestCase):
+    def setUp(self):
+        tests.clear_tmp_folder()
+        self.store = blob_store.BlobStore(os.path.join(tests.DIR_TMP, 'blobs'))
+        self.app = appstore.App('8.8.0.1', {'x86', 'arm64-v8a'}, 'https://example.com/app.apk', 'Apkcombo')
+
+    def _write_apk(self, name: str, data: bytes):
+        file = os.path.join(tests.DIR_TMP, name)
+        with open(file, 'wb') as f:
+            f.write(data)
+        return file, hashlib.sha256(data).hexdigest()
+
+    def test_insert_get(self):
+        file, sha256 = self._write_apk('app.apk', b'apk1')
+        downloader.write_sha256(file, sha256)
+        self.assertIsNone(self.store.lookup(self.app))
+
+        self.store.insert(file, sha256, self.app)
+        # The shared file is not modified, so its stored hash stays valid
+        self.assertEqual(sha256, downloader.read_sha256(file))
+        self.assertEqual(sha256, self.store.lookup(self.app))
+        self.assertTrue(os.path.isfile(os.path.join(self.store.dir_index, 'Apkcombo-8.8.0.1-arm64-v8a+x86.json')))
+
+        # Other version, architecture or store
+        self.assertIsNone(self.store.lookup(appstore.App('8.8.0.2', self.app.cpu_archs, '', 'Apkcombo')))
+        self.assertIsNone(self.store.lookup(appstore.App('8.8.0.1', {'x86'}, '', 'Apkcombo')))
+        self.assertIsNone(self.store.lookup(appstore.App('8.8.0.1', self.app.cpu_archs, '', 'Uptodown')))
+
+        target = os.path.join(tests.DIR_TMP, 'workdir', 'app.apk')
+        os.makedirs(os.path.dirname(target))
+        self.assertTrue(self.store.get(sha256, target))
+
+        with open(target, 'rb') as f:
+            self.assertEqual(b'apk1', f.read())
+        self.assertEqual(os.stat(self.store.get_blob(sha256)).st_ino, os.stat(target).st_ino)
+        self.assertEqual(sha256, downloader.read_sha256(target))
+        self.assertEqual(sha256, downloader.read_sha256(file))
+
+        # Apps from an unknown store are not indexed
+        file, sha256 = self._write_apk('app2.apk', b'apk2')
+        self.store.insert(file, sha256, appstore.App('8.8.0.2', {'universal'}, ''))
+        self.assertTrue(os.path.isfile(self.store.get_blob(sha256)))
+        self.assertEqual(1, len(os.listdir(self.store.dir_index)))
+
+    def test_missing_blob(self):
+        file, sha256 = self._write_apk('app.apk', b'apk1')
+        self.store.insert(file, sha256, self.app)
+        os.remove(self.store.get_blob(sha256))
+
+        target = os.path.join(tests.DIR_TMP, 'target.apk')
+        self.assertIsNone(self.store.lookup(self.app))
+        self.assertFalse(self.store.get(sha256, target))
+        self.assertEqual(['app.apk', 'blobs'], sorted(os.listdir(tests.DIR_TMP)))
+
+    def test_corrupted_blob(self):
+        file, sha256 = self._write_apk('app.apk', b'apk1')
+        self.store.insert(file, sha256, self.app)
+
+        with open(file, 'wb') as f:
+            f.write(b'apk2')
+
+        target = os.path.join(tests.DIR_TMP, 'target.apk')
+        self.assertFalse(self.store.get(sha256, target))
+        self.assertFalse(os.path.exists(target))
+        self.assertIsNone(self.store.lookup(self.app))
+        self.assertEqual([], os.listdir(self.store.dir_blobs))
+
+    def test_evict(self):
+        hashes = []
+        for i in range(3):
+            app = appstore.App('8.8.0.%d' % i, {'universal'}, '', 'Uptodown')
+            file, sha256 = self._write_apk('app%d.apk' % i, b'%d' % i * 1000)
+            self.store.insert(file, sha256, app)
+            os.utime(os.path.dirname(self.store.get_blob(sha256)), (1000 + i, 1000 + i))
+            hashes.append(sha256)
+
+        stale_tmp = os.path.join(self.store.dir_blobs, 'x.apk.1.1' + cache.TMP_SUFFIX)
+        new_tmp = os.path.join(self.store.dir_blobs, 'y.apk.1.1' + cache.TMP_SUFFIX)
+        self._write_apk(stale_tmp, b'tmp')
+        os.utime(stale_tmp, (1000, 1000))
+        self._write_apk(new_tmp, b'tmp')
+
+        self.store.evict(2500)
+
+        self.assertFalse(os.path.exists(self.store.get_blob(hashes[0])))
+        self.assertTrue(os.path.exists(self.store.get_blob(hashes[1])))
+        self.assertTrue(os.path.exists(self.store.get_blob(hashes[2])))
+        self.assertEqual(['Uptodown-8.8.0.1-universal.json', 'Uptodown-8.8.0.2-universal.json'],
+                         sorted(os.listdir(self.store.dir_index)))
+
+        self.assertFalse(os.path.exists(stale_tmp))
+        self.assertTrue(os.path.exists(new_tmp))
+
+    def test_default_path(self):
+        with mock.patch.dict(os.environ, {'GEX_BLOB_STORE': '/srv/blobs'}):
+            self.assertEqual('/srv/blobs', blob_store.get_default_path())
+
+        with mock.patch.dict(os.environ, {'GEX_BLOB_STORE': '', 'XDG_CACHE_HOME': '/cache'}):
+            self.assertEqual(os.path.join('/cache', 'spotify-gender-ex', 'blobs'), blob_store.get_default_path())
+
+    def test_shared_download(self):
+        data = b'spotify' * 1000
+
+        with local_server.LocalServer({'/app.apk': lambda r: local_server.send_data(r, data)}) as server:
+            app = appstore.App('8.8.0.1', {'universal'}, server.url + '/app.apk', 'Uptodown')
+
+            with mock.patch.object(appstore, 'get_spotify_app', return_value=app):
+                gexs = [genderex.GenderEx(folder_out=os.path.join(tests.DIR_TMP, 'wd%d' % i), builtin=True,
+                                          no_interaction=True, blob_store_dir=self.store.path) for i in range(2)]
+
+            # The second working directory uses the file downloaded by the first one
+            for gex in gexs:
+                self.assertTrue(gex.download())
+
+                with open(gex.workdir.file_apk, 'rb') as f:
+                    self.assertEqual(data, f.read())
+
+            self.assertEqual(1, len(server.requests))
+
+        # The hashes written while downloading are still valid in both working directories
+        for gex in gexs:
+            with mock.patch.object(cache, 'sha256_file', side_effect=AssertionError):
+                self.assertEqual(hashlib.sha256(data).hexdigest(), gex.get_apk_sha256())
+
+
+class OutputCacheTest(unittest.TestCase):
+    def setUp(self):
+        tests.clear_tmp_folder()
+        self.gex = self._new_gex()
+
+    def _fake_run(self, verified=True, new_replacement=True):
+        self.gex.spotify_version = '8.8.0.1'
+        self.gex.verified = verified
+        self.gex.file_apkout = self.gex.workdir.get_file_apkout('8.8.0.1', 'b0')
+        with open(self.gex.file_apkout, 'wb') as f:
+            f.write(b'signed apk')
+
+        if new_replacement:
+            self.gex.rtm.insert_replacement('values-de/strings.xml', 'key', 'Künstler*innen', 'Künstler')
+
+        self.gex.file_rtabout = self.gex.workdir.get_file_newrepl('8.8.0.1', 'b0')
+        if not self.gex.rtm.write_new_replacements('8.8.0.1', self.gex.file_rtabout):
+            self.gex.file_rtabout = ''
+        self.gex._store_output()
+
+    @staticmethod
+    def _new_gex() -> genderex.GenderEx:
+        with mock.patch.object(appstore, 'get_spotify_app', side_effect=appstore.StoreException):
+            gex = genderex.GenderEx(folder_out=tests.DIR_TMP, builtin=True, no_interaction=True)
+
+        # The temporary folder is cleared on startup, so the app has to be "downloaded" again
+        with open(gex.workdir.file_apk, 'wb') as f:
+            f.write(b'apk')
+        return gex
+
+    def test_restore(self):
+        self._fake_run()
+
+        gex = self._new_gex()
+        self.assertTrue(gex.restore_cached_output())
+        self.assertEqual('8.8.0.1', gex.spotify_version)
+        self.assertEqual(self.gex.file_apkout, gex.file_apkout)
+        self.assertEqual(self.gex.file_rtabout, gex.file_rtabout)
+        self.assertEqual(1, gex.rtm.new_replacements.n_replacements())
+
+        with open(gex.workdir.file_version, 'r', encoding='utf-8') as f:
+            self.assertTrue(f.read().startswith('8.8.0.1-'))
+
+    def test_restore_without_replacements(self):
+        self._fake_run(new_replacement=False)
+
+        gex = self._new_gex()
+        self.assertTrue(gex.restore_cached_output())
+        self.assertEqual('', gex.file_rtabout)
+        self.assertTrue(gex.rtm.new_replacements.is_empty())
+
+    def test_miss(self):
+        self._fake_run(verified=False)
+
+        # Unverified output
+        gex = self._new_gex()
+        self.assertFalse(gex.restore_cached_output())
+        self.assertTrue(gex.restore_cached_output(False))
+
+        # Different APK file
+        with open(gex.workdir.file_apk, 'wb') as f:
+            f.write(b'apk 2')
+        self.assertFalse(gex.restore_cached_output(False))
+
+    def test_integrity(self):
+        self._fake_run()
+
+        with open(self.gex.file_rtabout, 'a', encoding='utf-8') as f:
+            f.write(' ')
+        self.assertFalse(self._new_gex().restore_cached_output())
+
+        self._fake_run()
+        os.remove(self.gex.file_apkout)
+        self.assertFalse(self._new_gex().restore_cached_output())
+
+
+class CheckpointTest(unittest.TestCase):
+    def setUp(self):
+        tests.clear_tmp_folder()
+        self.gex = self._new_gex(False)
+
+        with open(self.gex.workdir.file_apk, 'wb') as f:
+            f.write(b'apk')
+
+    @staticmethod
+    def _new_gex(resume: bool) -> genderex.GenderEx:
+        file_rtab = os.path.join(tests.DIR_TMP, 'replacements.json')
+        rtab = replacement_table.ReplacementTable(1, [], [{'path': 'res/values-de/strings.xml', 'replace': {}}])
+        rtab.to_file(file_rtab)
+
+        with mock.patch.object(appstore, 'get_spotify_app', side_effect=appstore.StoreException):
+            gex = genderex.GenderEx(folder_out=tests.DIR_TMP, replacement_tables=[file_rtab], no_internal=True,
+                                    no_interaction=True, resume=resume)
+
+        gex.file_apktool = os.path.join(tests.DIR_TMP, 'apktool.jar')
+        with open(gex.file_apktool, 'wb') as f:
+            f.write(b'apktool')
+        return gex
+
+    def _run_subprocess(self, cmd, **kwargs):
+        if cmd[3] != 'd':
+            return
+
+        os.makedirs(os.path.join(self.gex.workdir.dir_apk, 'res', 'values-de'))
+        with open(self.gex.workdir.file_apktool, 'w', encoding='utf-8') as f:
+            f.write('versionName: 8.8.0.1\n')
+        shutil.copyfile(os.path.join(tests.DIR_LANG, 'file1_withgender.xml'),
+                        os.path.join(self.gex.workdir.dir_apk, 'res', 'values-de', 'strings.xml'))
+
+    def _run_stages(self, verify=True, replace=True):
+        with mock.patch('subprocess.run', side_effect=self._run_subprocess):
+            self.assertTrue(self.gex.run_stage('download', self.gex.download))
+            self.assertTrue(self.gex.run_stage('verify', self.gex.verify if verify else lambda: None))
+            self.assertTrue(self.gex.run_stage('decompile', self.gex.decompile, self.gex.check_compatibility))
+            if replace:
+                self.assertTrue(self.gex.run_stage('replace', self.gex.replace))
+
+    def test_resume(self):
+        self._run_stages()
+        self.assertFalse(self.gex.rtm.new_replacements.is_empty())
+
+        with open(self.gex.workdir.file_checkpoints, 'r', encoding='utf-8') as f:
+            stages = json.load(f)
+        self.assertEqual(['download', 'verify', 'decompile', 'replace'], list(stages))
+        self.assertIn(self.gex.workdir.file_apk, stages['download']['outputs'])
+
+        # The temporary folder must be kept when resuming
+        gex = self._new_gex(True)
+        self.assertEqual('recompile', gex.resume())
+        self.assertTrue(gex.is_stage_done('replace'))
+        self.assertFalse(gex.is_stage_done('recompile'))
+
+        self.assertTrue(gex.verified)
+        self.assertEqual('8.8.0.1', gex.spotify_version)
+        self.assertEqual(self.gex.rtm.new_replacements.to_string(), gex.rtm.new_replacements.to_string())
+
+    def test_resume_replace(self):
+        self._run_stages(replace=False)
+
+        # The replacement stage has to restart from the decompilation
+        self.assertEqual('decompile', self._new_gex(True).resume())
+
+    def test_record_later_stage(self):
+        self._run_stages()
+
+        # Completed stages of a previous run are invalidated, stages of the same run are kept
+        gex = self._new_gex(True)
+        gex.run_stage('verify', lambda: None)
+        self.assertEqual(['download', 'verify'], list(gex.checkpoints.stages))
+
+        gex.run_stage('replace', lambda: None)
+        gex.run_stage('decompile', lambda: None)
+        self.assertEqual(['download', 'verify', 'replace', 'decompile'], list(gex.checkpoints.stages))
+
+    def test_resume_changed(self):
+        self._run_stages(verify=False)
+
+        # Unverified app
+        self.assertEqual('verify', self._new_gex(True).resume())
+        self.assertEqual('recompile', self._new_gex(True).resume(False))
+
+        # Changed app
+        with open(self.gex.workdir.file_apk, 'wb') as f:
+            f.write(b'apk 2')
+        self.assertEqual('download', self._new_gex(True).resume())
+
+    def test_no_resume(self):
+        self._run_stages()
+
+        gex = self._new_gex(False)
+        self.assertFalse(os.path.isfile(gex.workdir.file_checkpoints))
+        self.assertFalse(gex.is_stage_done('download'))
+        self.assertEqual({}, checkpoint.Checkpoints(gex.workdir.file_checkpoints).stages)
+
+
+class PipelineTest(unittest.TestCase):
+    def test_concurrent(self):
+        started = threading.Event()
+        order = []
+
+        def wait_for_b():
+            self.assertTrue(started.wait(10))
+            order.append('a')
+
+        def b():
+            started.set()
+            order.append('b')
+
+        pipeline.run_stages([
+            pipeline.Stage('c', lambda: order.append('c'), ['a', 'b']),
+            pipeline.Stage('a', wait_for_b),
+            pipeline.Stage('b', b),
+        ])
+        self.assertEqual(['b', 'a', 'c'], order)
+
+    def test_failure(self):
+        ran = []
+
+        def fail():
+            raise KeyError('fail')
+
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out), self.assertRaises(KeyError):
+            pipeline.run_stages([
+                pipeline.Stage('a', fail),
+                pipeline.Stage('b', lambda: ran.append('b'), ['a']),
+                pipeline.Stage('c', lambda: ran.append('c'), ['b']),
+                pipeline.Stage('d', lambda: ran.append('d')),
+            ])
+
+        self.assertEqual(['d'], ran)
+        self.assertIn('[a] Fehlgeschlagen', out.getvalue())
+        self.assertIn('[b] Abgebrochen', out.getvalue())
+        self.assertIn('[c] Abgebrochen', out.getvalue())
+
+        with contextlib.redirect_stdout(out), self.assertRaises(pipeline.StageException):
+            pipeline.run_stages([pipeline.Stage('e', lambda: False)])
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            pipeline.run_stages([pipeline.Stage('a', lambda: None, ['x'])])
+        with self.assertRaises(ValueError):
+            pipeline.run_stages([pipeline.Stage('a', lambda: None, ['b']), pipeline.Stage('b', lambda: None, ['a'])])
+
+    def test_output(self):
+        def stage_a():
+            print('Hello', end='')
+            print(' World')
+            pipeline.run_command([sys.executable, '-c', 'print("Sub"); print("process")'])
+
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            pipeline.run_stages([pipeline.Stage('a', stage_a, label='A')])
+            print('Done')
+
+        self.assertEqual('[A] Hello World\n[A] Sub\n[A] process\nDone\n', out.getvalue())
+
+        with contextlib.redirect_stdout(out), self.assertRaises(subprocess.CalledProcessError):
+            pipeline.run_stages([pipeline.Stage('a', lambda: pipeline.run_command(
+                [sys.executable, '-c', 'import sys; sys.exit(3)']))])
+
+
 class LangFileTest(unittest.TestCase):
     def test_from_file(self):
         self._test_from_file('file1_withgender.xml', 20)
@@ -139,6 +1241,168 @@ class LangFileTest(unittest.TestCase):
         lfile.to_file(path_out)
         tests.assert_files_equal(self, path_mod, path_out)
 
+    @staticmethod
+    def _walk_tree_fields(file):
+        """Language fields found by the original recursive tree walker of LangFile.replace_tree"""
+        fields = []
+
+        def walk(tree_node, key_list):
+            for elm in tree_node:
+                if len(elm.attrib) > 0:
+                    nkl = key_list + [list(elm.attrib.values())[0]]
+
+                    if elm.text and elm.text.strip():
+                        fields.append(('/'.join(nkl), elm.text.strip()))
+                    else:
+                        walk(elm, nkl)
+
+        walk(ElementTree.parse(file, parser=ElementTree.XMLParser(encoding='utf-8')).getroot(), [])
+        return fields
+
+    def test_iter_fields(self):
+        files = [os.path.join(tests.DIR_LANG, 'file1_withgender.xml'),
+                 os.path.join(tests.DIR_LANG, 'file2_withgender.xml'),
+                 os.path.join(tests.DIR_LANG, 'cdata.xml'),
+                 os.path.join(tests.DIR_TESTFILES, 'nogender', '8-6-4-971_plurals.xml'),
+                 os.path.join(tests.DIR_TESTFILES, 'nogender', '8-6-4-971_strings.xml')]
+
+        for file in files:
+            lfile = lang_file.LangFile(file)
+            fields = list(lfile.iter_fields())
+            expected = self._walk_tree_fields(file)
+            self.assertTrue(expected)
+
+            # Same fields as the original tree walker and the expat-based implementation
+            self.assertEqual(expected, [field[:2] for field in fields])
+            self.assertEqual(expected, [field[:2] for field in lang_file.SpliceLangFile(file).fields])
+
+            for key, text, elm in fields:
+                self.assertEqual(text, elm.text.strip())
+
+        fields = list(lang_file.LangFile(os.path.join(tests.DIR_LANG, 'file2_withgender.xml')).iter_fields())
+        self.assertEqual(('Urelex_Yeable/other', 'Künstler*innen'), fields[0][:2])
+        self.assertEqual(('Urelex_Yeable/one', 'Künstler*in'), fields[1][:2])
+        self.assertEqual(('Blatte_Greade/other', 'Spieler*innen'), fields[2][:2])
+
+    def test_get_fields(self):
+        file = os.path.join(tests.DIR_LANG, 'file2_withgender.xml')
+
+        for engine in (lang_file.LangFile, lang_file.SpliceLangFile):
+            tests.clear_tmp_folder()
+            lfile = engine(file)
+            keys, texts, handles = lfile.get_fields()
+
+            self.assertEqual([field[:2] for field in lang_file.LangFile(file).iter_fields()],
+                             list(zip(keys, texts)))
+
+            # Replace the first field only
+            lfile.set_texts(handles[:1], ['Künstler'])
+            lfile.to_file(os.path.join(tests.DIR_TMP, 'lang.xml'))
+
+            fields = list(lang_file.LangFile(os.path.join(tests.DIR_TMP, 'lang.xml')).iter_fields())
+            self.assertEqual(('Urelex_Yeable/other', 'Künstler'), fields[0][:2])
+            self.assertEqual(list(zip(keys, texts))[1:], [field[:2] for field in fields][1:])
+
+    def test_streaming(self):
+        files = [os.path.join(tests.DIR_LANG, 'file1_withgender.xml'),
+                 os.path.join(tests.DIR_LANG, 'file2_withgender.xml'),
+                 os.path.join(tests.DIR_TESTFILES, 'nogender', '8-6-4-971_plurals.xml'),
+                 os.path.join(tests.DIR_TESTFILES, 'nogender', '8-6-4-971_strings.xml')]
+
+        for file in files:
+            self._test_streaming(file)
+
+    def _test_streaming(self, file):
+        tests.clear_tmp_folder()
+        path_tree = os.path.join(tests.DIR_TMP, 'lang_tree.xml')
+        path_stream = os.path.join(tests.DIR_TMP, 'lang_stream.xml')
+
+        keys_tree = []
+        keys_stream = []
+
+        def fun_replace(keys, key, old):
+            keys.append(key)
+            if len(keys) % 3 == 0:
+                return '<%s> & "%s"' % (old.upper(), key)
+
+        lfile = lang_file.LangFile(file)
+        lfile.replace_tree(lambda key, old: fun_replace(keys_tree, key, old))
+        lfile.to_file(path_tree)
+
+        sfile = lang_file.StreamingLangFile(file)
+        sfile.replace_to_file(lambda key, old: fun_replace(keys_stream, key, old), path_stream)
+
+        self.assertEqual(keys_tree, keys_stream)
+
+        with open(path_tree, 'rb') as f_tree, open(path_stream, 'rb') as f_stream:
+            self.assertEqual(f_tree.read(), f_stream.read())
+
+    def test_splice(self):
+        files = [os.path.join(tests.DIR_LANG, 'file1_withgender.xml'),
+                 os.path.join(tests.DIR_LANG, 'file2_withgender.xml'),
+                 os.path.join(tests.DIR_TESTFILES, 'nogender', '8-6-4-971_plurals.xml'),
+                 os.path.join(tests.DIR_TESTFILES, 'nogender', '8-6-4-971_strings.xml'),
+                 # All CDATA fields are replaced, since ElementTree does not write CDATA sections
+                 os.path.join(tests.DIR_LANG, 'cdata.xml')]
+
+        # The test files are written by ElementTree, so both engines have to produce the same output
+        for file in files:
+            tests.clear_tmp_folder()
+            path_tree = os.path.join(tests.DIR_TMP, 'lang_tree.xml')
+            path_splice = os.path.join(tests.DIR_TMP, 'lang_splice.xml')
+
+            def fun_replace(key, old):
+                if key.startswith('a'):
+                    return '<%s> & "%s"' % (old.upper(), key)
+
+            lang_file.LangFile(file).replace_to_file(fun_replace, path_tree)
+            lang_file.SpliceLangFile(file).replace_to_file(fun_replace, path_splice)
+
+            with open(path_tree, 'rb') as f_tree, open(path_splice, 'rb') as f_splice:
+                self.assertEqual(f_tree.read(), f_splice.read())
+
+    def test_splice_preserve(self):
+        tests.clear_tmp_folder()
+        path = os.path.join(tests.DIR_TMP, 'lang.xml')
+
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('''<?xml version="1.0" encoding="utf-8"?>
+<resources>
+  <!-- Comment -->
+  <string name='Biblec' >Künstler*innen</string>
+  <string name="Laglog">&quot;Hallo&quot; Welt!</string>
+  <plurals name="Urelex_Yeable">
+    <item quantity="one">  &amp; Künstler*in  </item>
+    <item quantity="other"/>
+  </plurals>
+</resources>
+''')
+
+        lfile = lang_file.SpliceLangFile(path)
+        self.assertEqual([('Biblec', 'Künstler*innen'), ('Laglog', '"Hallo" Welt!'),
+                          ('Urelex_Yeable/one', '& Künstler*in')], [field[:2] for field in lfile.fields])
+
+        # Unchanged files are not written
+        mtime = os.stat(path).st_mtime_ns
+        lfile.replace_to_file(lambda key, old: old)
+        self.assertEqual(mtime, os.stat(path).st_mtime_ns)
+
+        replacements = {'Biblec': 'Künstler', 'Urelex_Yeable/one': '<Künstler>'}
+        lfile.replace_to_file(lambda key, old: replacements.get(key))
+
+        with open(path, encoding='utf-8') as f:
+            self.assertEqual('''<?xml version="1.0" encoding="utf-8"?>
+<resources>
+  <!-- Comment -->
+  <string name='Biblec' >Künstler</string>
+  <string name="Laglog">&quot;Hallo&quot; Welt!</string>
+  <plurals name="Urelex_Yeable">
+    <item quantity="one">&lt;Künstler&gt;</item>
+    <item quantity="other"/>
+  </plurals>
+</resources>
+''', f.read())
+
     def test_is_suspicious(self):
         test_data = {
             'Hallo Welt!': False,
@@ -149,11 +1413,25 @@ class LangFileTest(unittest.TestCase):
             'Tippe auf einer Folge auf {download}, um sie dir ohne Internetverbindung anzuhören.': False,
             'Ich stimme den &lt;a href=\"spotify:internal:signup:tos\"&gt;Nutzungsbedingungen&lt;/a&gt; und der &lt;a href=\"spotify:internal:signup:policy\"&gt;Datenschutzrichtlinie&lt;/a&gt; von Spotify zu.': False,
             'Ich stimme den &lt;a href=\"spotify:internal:signup:tos\"&gt;Nutzungsbedingung:innen&lt;/a&gt; und der &lt;a href=\"spotify:internal:signup:policy\"&gt;Datenschutzrichtlinie&lt;/a&gt; von Spotify zu.': True,
+            'Freund<b>I</b>nnen': True,
+            'Hinweis:<br>Informationen': True,
+            'Hinweis:<br>internal': False,
+            'Freund<x>y>I': False,
+            'Freund&amp;Innen': True,
+            'Freund&amp Innen': False,
+            '<b class="x*in">Hallo</b>': False,
         }
 
         for item in test_data.items():
             self.assertEqual(item[1], lang_file.is_suspicious(item[0]))
 
+        # Bulk check
+        strings = list(test_data.keys())
+        self.assertEqual([i for i, string in enumerate(strings) if test_data[string]],
+                         lang_file.find_suspicious(strings))
+        self.assertEqual([], lang_file.find_suspicious([]))
+        self.assertEqual([1], lang_file.find_suspicious(['Freund', 'Innen:innen', 'Hallo*']))
+
 
 class ReplacementTableTest(unittest.TestCase):
     def test_from_file(self):
@@ -186,6 +1464,75 @@ class ReplacementTableTest(unittest.TestCase):
         self.assertEqual(["unittest"], rt.spotify_versions)
         self.assertEqual(['file1_withgender.xml', 'file2_withgender.xml'], list(map(lambda s: s.path, rt.sets)))
 
+    def test_table_cache(self):
+        tests.clear_tmp_folder()
+        path = os.path.join(tests.DIR_TMP, 'replacements.json')
+        dir_cache = os.path.join(tests.DIR_TMP, 'cache')
+        shutil.copyfile(os.path.join(tests.DIR_REPLACE, 'replacements.json'), path)
+
+        rt = replacement_table.ReplacementTable.from_file(path, dir_cache)
+        cache_files = os.listdir(dir_cache)
+        self.assertEqual(1, len(cache_files))
+
+        # Load from cache (without reading the JSON file)
+        with mock.patch.object(replacement_table.json, 'loads', side_effect=AssertionError('JSON parsed')):
+            rt_cached = replacement_table.ReplacementTable.from_file(path, dir_cache)
+        self.assertEqual(path, rt_cached.path)
+        self.assertEqual(rt.to_string(), rt_cached.to_string())
+        self.assertEqual(rt.get_index(), rt_cached.get_index())
+        self.assertIs(rt_cached._index[1], rt_cached.get_index())
+        self.assertEqual(cache_files, os.listdir(dir_cache))
+
+        # The cached index is rebuilt after changes
+        rt_cached.sets[0].replace.clear()
+        self.assertEqual({}, rt_cached.get_index()[rt_cached.sets[0].path])
+
+        rt_cached = replacement_table.ReplacementTable.from_string(rt.to_string(), dir_cache)
+        self.assertEqual(rt.to_string(), rt_cached.to_string())
+        self.assertEqual(2, len(os.listdir(dir_cache)))
+
+        # Changed source file
+        rt.spotify_addversion('newver')
+        rt.to_file()
+        rt_changed = replacement_table.ReplacementTable.from_file(path, dir_cache)
+        self.assertEqual(rt.to_string(), rt_changed.to_string())
+        self.assertEqual(3, len(os.listdir(dir_cache)))
+
+        # Cache entries of recently changed files are verified by the content hash,
+        # since the file may change again without new timestamps
+        stat = os.stat(path)
+        source_id = ('file', os.path.abspath(path), stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns, stat.st_ino)
+        cache_file = replacement_table._get_cache_file(dir_cache, source_id)
+        digest, racy, _, _ = replacement_table._read_table_cache(cache_file, source_id)
+        self.assertTrue(racy)
+
+        replacement_table._write_table_cache(cache_file, source_id, 'stale', True,
+                                             json.loads(RT_STRING), {})
+        rt_changed = replacement_table.ReplacementTable.from_file(path, dir_cache)
+        self.assertEqual(rt.to_string(), rt_changed.to_string())
+        self.assertEqual(digest, replacement_table._read_table_cache(cache_file, source_id)[0])
+
+        # Afterwards, the entry is trusted without reading the file
+        with mock.patch.object(replacement_table, 'RTCACHE_RACY_NS', 0):
+            replacement_table.ReplacementTable.from_file(path, dir_cache)
+        self.assertFalse(replacement_table._read_table_cache(cache_file, source_id)[1])
+
+        def open_cache(file, *args, **kwargs):
+            self.assertNotEqual(path, file, 'JSON file read')
+            return io.open(file, *args, **kwargs)
+
+        with mock.patch('builtins.open', side_effect=open_cache):
+            rt_cached = replacement_table.ReplacementTable.from_file(path, dir_cache)
+        self.assertEqual(rt.to_string(), rt_cached.to_string())
+
+        # Broken cache file
+        for cache_file in os.listdir(dir_cache):
+            with open(os.path.join(dir_cache, cache_file), 'wb') as f:
+                f.write(b'broken')
+
+        rt_fallback = replacement_table.ReplacementTable.from_file(path, dir_cache)
+        self.assertEqual(rt.to_string(), rt_fallback.to_string())
+
     def test_set_from_langfile(self):
         path = os.path.join(tests.DIR_REPLACE, 'replacements_empty.json')
         rt = replacement_table.ReplacementTable.from_file(path)
@@ -219,6 +1566,35 @@ class ReplacementTableTest(unittest.TestCase):
 
         self.assertEqual(RT_STRING, rt.to_string())
 
+    def test_to_string_canonical(self):
+        rt = replacement_table.ReplacementTable.from_file(os.path.join(tests.DIR_REPLACE, 'replacements_issue.json'))
+        rt.make_set_from_langfile('missing"no.xml').add('Biblec\t', 'Künstler*innen\n', '\\n\x01')
+        rt.spotify_addversion('newver')
+
+        self.assertEqual(json.dumps(rt.to_json(), default=lambda obj: obj.to_json(), indent=2, ensure_ascii=False),
+                         rt.to_string())
+
+    def test_md5_hash(self):
+        rt = replacement_table.ReplacementTable.from_string(RT_STRING)
+        hashes = [rt.md5_hash()]
+
+        def assert_new_hash():
+            md5_hash = rt.md5_hash()
+            self.assertEqual(hashlib.md5(rt.to_string().encode('utf-8')).hexdigest(), md5_hash)
+            self.assertNotIn(md5_hash, hashes)
+            hashes.append(md5_hash)
+
+        self.assertEqual(hashes[0], rt.md5_hash())
+
+        rt.set_from_langfile('file1_withgender.xml').add('Biblec', 'Künstler*innen', 'Künstler')
+        assert_new_hash()
+        rt.make_set_from_langfile('missingno.xml')
+        assert_new_hash()
+        rt.spotify_addversion('newver')
+        assert_new_hash()
+        rt.version = 2
+        assert_new_hash()
+
     def test_count(self):
         path = os.path.join(tests.DIR_REPLACE, 'replacements.json')
         rt = replacement_table.ReplacementTable.from_file(path)
@@ -233,6 +1609,30 @@ class ReplacementTableTest(unittest.TestCase):
         self.assertEqual(6, rt.n_replacements())
         self.assertEqual(6, rt.n_suspicious())
 
+    def test_count_add(self):
+        rt = replacement_table.ReplacementTable.from_string(RT_STRING)
+        rset = rt.set_from_langfile('file1_withgender.xml')
+
+        self.assertEqual(0, rt.n_replacements())
+        self.assertEqual(0, rt.n_suspicious())
+
+        rset.add('Biblec', 'Künstler*innen', 'Künstler*innen')
+        rset.add('Lythro', 'Freund*in', 'Freund')
+        rt.make_set_from_langfile('missingno.xml').add('Housur', 'Nutzer*innen', 'Nutzer*innen')
+
+        self.assertEqual(3, rt.n_replacements())
+        self.assertEqual(2, rt.n_suspicious())
+
+        # Overwrite suspicious value
+        rset.add('Biblec', 'Künstler*innen', 'Künstler')
+        self.assertEqual(3, rt.n_replacements())
+        self.assertEqual(1, rt.n_suspicious())
+
+        # Overwrite value with suspicious one
+        rset.add('Lythro', 'Freund*in', 'Freund:in')
+        self.assertEqual(3, rt.n_replacements())
+        self.assertEqual(2, rt.n_suspicious())
+
 
 class ReplacementManagerTest(unittest.TestCase):
     def test_add_rtab(self):
@@ -260,7 +1660,80 @@ class ReplacementManagerTest(unittest.TestCase):
         self.assertEqual('a1 (2416a1dc), b1 (24464164)', rpm.get_rt_versions(True))
         self.assertEqual('', rpm.get_new_repl_string())
 
+    def test_get_replacement(self):
+        rt1 = replacement_table.ReplacementTable.from_string(RT_STRING)
+        rt2 = replacement_table.ReplacementTable.from_string(RT_STRING)
+        rt3 = replacement_table.ReplacementTable.from_string(RT_STRING)
+
+        rt1.set_from_langfile('file1_withgender.xml').add('Biblec', 'Künstler*innen', 'Künstler')
+        rt2.set_from_langfile('file1_withgender.xml').add('Biblec', 'Künstler*innen', 'Künstler_2')
+        rt2.set_from_langfile('file2_withgender.xml').add('Urelex_Yeable/one', 'Künstler*in', 'Künstler')
+
+        rpm = replacement_table.ReplacementManager('')
+        rpm.add_rtab(rt2, 'rt2')
+
+        self.assertEqual('Künstler_2', rpm.get_replacement('file1_withgender.xml', 'Biblec', 'Künstler*innen'))
+        self.assertIsNone(rpm.get_replacement('file1_withgender.xml', 'Biblec', 'Künstler'))
+        self.assertIsNone(rpm.get_replacement('missingno.xml', 'Biblec', 'Künstler*innen'))
+
+        # Adding a table rebuilds the index, the first table keeps priority
+        rt3.set_from_langfile('file1_withgender.xml').add('Laglog', 'Hallo Welt!', 'Hallo')
+        rpm.add_rtab(rt3, 'rt3')
+        rpm.add_rtab(rt1, 'rt1')
+
+        self.assertEqual('Künstler_2', rpm.get_replacement('file1_withgender.xml', 'Biblec', 'Künstler*innen'))
+        self.assertEqual('Künstler', rpm.get_replacement('file2_withgender.xml', 'Urelex_Yeable/one', 'Künstler*in'))
+        self.assertEqual('Hallo', rpm.get_replacement('file1_withgender.xml', 'Laglog', 'Hallo Welt!'))
+
+    def test_get_replacement_duplicate_set(self):
+        # Only the first set of a language file is used (like ReplacementTable.set_from_langfile)
+        rt = replacement_table.ReplacementTable.from_string(RT_STRING)
+        rt.sets.append(replacement_table.ReplacementSet('file1_withgender.xml', dict()))
+        rt.sets[0].add('Biblec', 'Künstler*innen', 'first')
+        rt.sets[-1].add('Biblec', 'Künstler*innen', 'second')
+        rt.sets[-1].add('Laglog', 'Hallo Welt!', 'Hallo')
+
+        rpm = replacement_table.ReplacementManager('')
+        rpm.add_rtab(rt, 'rt')
+
+        self.assertEqual('first', rpm.get_replacement('file1_withgender.xml', 'Biblec', 'Künstler*innen'))
+        self.assertIsNone(rpm.get_replacement('file1_withgender.xml', 'Laglog', 'Hallo Welt!'))
+
     def test_do_replacement(self):
+        self._test_do_replacement(1, 'tree')
+
+    def test_do_replacement_parallel(self):
+        self._test_do_replacement(2, 'tree')
+
+    def test_do_replacement_stream(self):
+        self._test_do_replacement(1, 'stream')
+        self._test_do_replacement(2, 'stream')
+
+    def test_do_replacement_splice(self):
+        self._test_do_replacement(1, 'splice')
+        self._test_do_replacement(2, 'splice')
+
+    def test_do_replacement_splice_unchanged(self):
+        # Files without replacements are not rewritten, neither by the main process nor by the workers
+        for processes in (1, 2):
+            tests.clear_tmp_folder()
+            files = []
+            for i in (1, 2):
+                files.append(os.path.join(tests.DIR_TMP, 'file%d_withgender.xml' % i))
+                shutil.copyfile(os.path.join(tests.DIR_LANG, 'file%d_nogender.xml' % i), files[-1])
+            stats = [os.stat(file) for file in files]
+
+            rpm = replacement_table.ReplacementManager(tests.DIR_TMP)
+            rpm.add_rtab(replacement_table.ReplacementTable.from_file(
+                os.path.join(tests.DIR_REPLACE, 'replacements_empty.json')), 'rt')
+
+            self.assertEqual((0, 0), rpm.do_replace(processes=processes, engine='splice'))
+
+            for file, stat in zip(files, stats):
+                self.assertEqual((stat.st_ino, stat.st_mtime_ns), (os.stat(file).st_ino, os.stat(file).st_mtime_ns))
+            self.assertEqual(sorted(os.path.basename(file) for file in files), sorted(os.listdir(tests.DIR_TMP)))
+
+    def _test_do_replacement(self, processes, engine):
         tests.clear_tmp_folder()
 
         shutil.copyfile(os.path.join(tests.DIR_LANG, 'file1_withgender.xml'),
@@ -278,7 +1751,7 @@ class ReplacementManagerTest(unittest.TestCase):
         rpm.add_rtab(rt1, 'rt1')
         rpm.add_rtab(rt2, 'rt2')
 
-        rpm.do_replace()
+        self.assertEqual((10, 0), rpm.do_replace(processes=processes, engine=engine))
 
         tests.assert_files_equal(self, os.path.join(tests.DIR_LANG, 'file1_nogender.xml'),
                                  os.path.join(tests.DIR_TMP, 'file1_withgender.xml'))
@@ -307,6 +1780,30 @@ class ReplacementManagerTest(unittest.TestCase):
         tests.assert_files_equal(self, os.path.join(tests.DIR_REPLACE, 'replacements_testwrite.json'), path)
         self.assertEqual('9S', rpm.get_new_repl_string())
 
+    def test_do_replacement_parallel_missing(self):
+        tests.clear_tmp_folder()
+
+        shutil.copyfile(os.path.join(tests.DIR_LANG, 'file1_withgender.xml'),
+                        os.path.join(tests.DIR_TMP, 'file1_withgender.xml'))
+        shutil.copyfile(os.path.join(tests.DIR_LANG, 'file2_withgender.xml'),
+                        os.path.join(tests.DIR_TMP, 'file2_withgender.xml'))
+
+        rt = replacement_table.ReplacementTable.from_file(os.path.join(tests.DIR_REPLACE, 'replacements_testadd.json'))
+
+        # Suspicious fields have to be prompted for in the main process
+        prompted = []
+
+        def get_missing_replacement(key, old):
+            prompted.append(key)
+            return old + '_MOD'
+
+        rpm = replacement_table.ReplacementManager(tests.DIR_TMP, get_missing_replacement)
+        rpm.add_rtab(rt, 'rt')
+
+        self.assertEqual((10, 9), rpm.do_replace(processes=2))
+        self.assertEqual(9, len(prompted))
+        self.assertEqual('9S', rpm.get_new_repl_string())
+
     def test_version_string(self):
         path1 = os.path.join(tests.DIR_REPLACE, 'replacements.json')
         path2 = os.path.join(tests.DIR_REPLACE, 'replacements_3N2S.json')
@@ -320,6 +1817,321 @@ class ReplacementManagerTest(unittest.TestCase):
         self.assertEqual('i1_3N2S', rpm.get_version_string())
 
 
+class ScannerTest(unittest.TestCase):
+    RESOURCES = {
+        'values/strings.xml': '<resources><string name="artists">Artists</string></resources>',
+        'values-de/strings.xml': '<resources><string name="Biblec">Künstler*innen</string>'
+                                 '<string name="styled">Hallo <b>Freund*in</b></string>'
+                                 '<string name="empty"> </string><string name="ok">Hallo</string></resources>',
+        'values-de/plurals.xml': '<resources><plurals name="listeners"><item quantity="one">%d Hörer*in</item>'
+                                 '<item quantity="other">%d Hörer*innen</item></plurals></resources>',
+        'values-de-rAT/arrays.xml': '<resources><string-array name="roles"><item>Admin</item>'
+                                    '<item>Nutzer:innen</item></string-array></resources>',
+        'values-de/colors.xml': '<resources><color name="x*in">#FFFFFF</color></resources>',
+        'drawable/strings.xml': '<resources><string name="x">Künstler*innen</string></resources>',
+    }
+
+    def setUp(self):
+        tests.clear_tmp_folder()
+
+        for path, content in self.RESOURCES.items():
+            file = os.path.join(tests.DIR_TMP, 'res', path)
+            os.makedirs(os.path.dirname(file), exist_ok=True)
+            with open(file, 'w', encoding='utf-8') as f:
+                f.write(content)
+
+    def test_find_resource_files(self):
+        self.assertEqual(['res/values/strings.xml', 'res/values-de/strings.xml', 'res/values-de/plurals.xml',
+                          'res/values-de-rAT/arrays.xml'], scanner.find_resource_files(tests.DIR_TMP))
+
+    def test_scan_resources(self):
+        expected = {
+            'res/values-de/strings.xml': {'Biblec': 'Künstler*innen'},
+            'res/values-de/plurals.xml': {'listeners/one': '%d Hörer*in', 'listeners/other': '%d Hörer*innen'},
+        }
+        # Texts which are not (completely) processed by the replacement
+        expected_unreplaceable = {
+            'res/values-de/strings.xml': {'styled': 'Hallo Freund*in'},
+            'res/values-de-rAT/arrays.xml': {'roles/1': 'Nutzer:innen'},
+        }
+
+        self.assertEqual((expected, expected_unreplaceable), scanner.scan_resources(tests.DIR_TMP))
+        self.assertEqual((expected, expected_unreplaceable), scanner.scan_resources(tests.DIR_TMP, processes=2))
+
+        # Fields with replacement rules are not reported
+        rt = replacement_table.ReplacementTable(1, ['unittest'], [{
+            'path': 'res/values-de/strings.xml',
+            'replace': {'Biblec|Künstler*innen': 'Künstler'},
+        }])
+        rtm = replacement_table.ReplacementManager(tests.DIR_TMP)
+        rtm.add_rtab(rt, 'test')
+
+        del expected['res/values-de/strings.xml']
+        self.assertEqual((expected, expected_unreplaceable), scanner.scan_resources(tests.DIR_TMP, rtm))
+
+    def test_report_matches_replacement(self):
+        # A rule for every reported field changes the field
+        report, _ = scanner.scan_resources(tests.DIR_TMP)
+        for lfpath, fields in report.items():
+            file = os.path.join(tests.DIR_TMP, lfpath)
+            lfile = lang_file.LangFile(file)
+            lfile.replace_tree(lambda key, old: 'neu' if fields.get(key) == old else None)
+
+            self.assertEqual({key: 'neu' for key in fields}, {key: text for key, text, _ in lfile.iter_fields()
+                                                             if key in fields})
+
+    def test_write_report(self):
+        report, unreplaceable = scanner.scan_resources(tests.DIR_TMP)
+        file = os.path.join(tests.DIR_TMP, 'scan.json')
+        scanner.write_report(report, '8.8.0', file, unreplaceable)
+
+        with open(file, encoding='utf-8') as f:
+            data = json.load(f)
+
+        self.assertEqual('8.8.0', data['spotify_version'])
+        self.assertEqual(2, data['n_files'])
+        self.assertEqual(3, data['n_fields'])
+        self.assertEqual(report, data['files'])
+        self.assertEqual(2, data['n_unreplaceable'])
+        self.assertEqual(unreplaceable, data['unreplaceable'])
+
+
+class ArscTest(unittest.TestCase):
+    RESOURCES = {
+        '': {
+            'string': {'artists': 'Artists', 'shared': 'Künstler*innen', 'greeting': 'Hallo'},
+        },
+        'de': {
+            'string': {'artists': 'Künstler*innen', 'shared': 'Künstler*innen', 'greeting': 'Hallo',
+                       'radio': 'Künstler*innen, die du liebst.\nHör\'s dir an', 'styled': 'Hallo Freund*in',
+                       'unknown': 'Podcaster*innen'},
+            'plurals': {'listeners': {'one': '%d Hörer*in', 'other': '%d Hörer*innen'}},
+        },
+        'de-rAT': {
+            'string': {'artists': 'Künstler*innen'},
+        },
+    }
+
+    REPLACEMENTS = {
+        'version': 1,
+        'spotify_versions': ['unittest'],
+        'files': [
+            {
+                'path': 'res/values-de/strings.xml',
+                'replace': {
+                    'artists|Künstler*innen': 'Künstler',
+                    'shared|Künstler*innen': 'Künstler',
+                    'radio|"Künstler*innen, die du liebst.\nHör\'s dir an"': '"Künstler, die du liebst.\nHör\'s dir an"',
+                },
+            },
+            {
+                'path': 'res/values-de/plurals.xml',
+                'replace': {
+                    'listeners/one|%d Hörer*in': '%d Hörer',
+                    'listeners/other|%d Hörer*innen': '%d Hörer',
+                },
+            },
+            {
+                'path': 'res/values-fr/strings.xml',
+                'replace': {'x|y': 'z'},
+            },
+        ],
+    }
+
+    def test_escape(self):
+        test_data = {
+            'Hallo': 'Hallo',
+            'Hör\'s dir an': '"Hör\'s dir an"',
+            'Zeile 1\nZeile 2': '"Zeile 1\nZeile 2"',
+            'Sag "Hallo"': 'Sag \\"Hallo\\"',
+            'C:\\Pfad': 'C:\\\\Pfad',
+            '@string/x': '\\@string/x',
+            ' Hallo': '" Hallo"',
+            'Hallo  Welt': '"Hallo  Welt"',
+            'Tab\tTab': 'Tab\\u0009Tab',
+        }
+
+        for string, escaped in test_data.items():
+            self.assertEqual(escaped, arsc.escape_resource_string(string))
+            self.assertEqual(string, arsc.unescape_resource_string(escaped))
+
+        self.assertEqual('Hallo Welt', arsc.unescape_resource_string('  Hallo\n   Welt '))
+        self.assertEqual('Hallo\nWelt', arsc.unescape_resource_string('Hallo\\nWelt'))
+
+    def test_read_fields(self):
+        for utf8 in (True, False):
+            table = arsc.ResourceTable(synthetic_apk.build_arsc(self.RESOURCES, ['Hallo Freund*in'], utf8))
+
+            keys, texts, _ = table.get_langfile('res/values-de/strings.xml').get_fields()
+            self.assertEqual(['artists', 'greeting', 'radio', 'shared', 'unknown'], keys)
+            self.assertEqual(['Künstler*innen', 'Hallo', '"Künstler*innen, die du liebst.\nHör\'s dir an"',
+                              'Künstler*innen', 'Podcaster*innen'], texts)
+
+            keys, texts, _ = table.get_langfile('res/values-de/plurals.xml').get_fields()
+            self.assertEqual(['listeners/one', 'listeners/other'], keys)
+            self.assertEqual(['%d Hörer*in', '%d Hörer*innen'], texts)
+
+            keys, _, _ = table.get_langfile('res/values-de-rAT/strings.xml').get_fields()
+            self.assertEqual(['artists'], keys)
+
+            self.assertIsNone(table.get_langfile('res/values-fr/strings.xml'))
+            self.assertIsNone(table.get_langfile('res/values-de-v21/strings.xml'))
+
+            # Unchanged tables are serialized byte-identical
+            self.assertEqual(synthetic_apk.build_arsc(self.RESOURCES, ['Hallo Freund*in'], utf8), table.to_bytes())
+
+    def test_replace(self):
+        tests.clear_tmp_folder()
+        file_apk = os.path.join(tests.DIR_TMP, 'app.apk')
+        file_apkout = os.path.join(tests.DIR_TMP, 'app_out.apk')
+
+        synthetic_apk.build_apk(file_apk, self.RESOURCES, '8.8.0.1', ['Hallo Freund*in'], files={
+            'assets/licenses.xhtml': b'<html><body></body></html>',
+            'classes.dex': b'dex',
+            'META-INF/MANIFEST.MF': b'Manifest-Version: 1.0',
+            'META-INF/CERT.SF': b'sf',
+            'META-INF/CERT.RSA': b'rsa',
+            'META-INF/services/x': b'service',
+        })
+
+        apk = arsc.ArscApk(file_apk)
+        self.assertEqual('8.8.0.1', apk.version_name)
+
+        prompts = []
+
+        def get_missing_replacement(key, old):
+            prompts.append(key)
+            return old.replace('*innen', '')
+
+        rtm = replacement_table.ReplacementManager('', get_missing_replacement)
+        rtm.add_rtab(replacement_table.ReplacementTable(**self.REPLACEMENTS), 'test')
+
+        self.assertEqual((6, 1), rtm.do_replace_table(apk.table))
+        self.assertEqual(['unknown'], prompts)
+
+        apk.write_file('assets/licenses.xhtml', b'<html><body>GenderEx</body></html>')
+        apk.to_file(file_apkout)
+
+        # Check the new APK file
+        apk_out = arsc.ArscApk(file_apkout)
+        self.assertEqual('8.8.0.1', apk_out.version_name)
+
+        _, texts, _ = apk_out.table.get_langfile('res/values-de/strings.xml').get_fields()
+        self.assertEqual(['Künstler', 'Hallo', '"Künstler, die du liebst.\nHör\'s dir an"', 'Künstler', 'Podcaster'],
+                         texts)
+        _, texts, _ = apk_out.table.get_langfile('res/values-de/plurals.xml').get_fields()
+        self.assertEqual(['%d Hörer', '%d Hörer'], texts)
+
+        # Strings of other languages sharing the same string are not affected
+        _, texts, _ = apk_out.table.get_langfile('res/values/strings.xml').get_fields()
+        self.assertEqual(['Artists', 'Hallo', 'Künstler*innen'], texts)
+        _, texts, _ = apk_out.table.get_langfile('res/values-de-rAT/strings.xml').get_fields()
+        self.assertEqual(['Künstler*innen'], texts)
+
+        with zipfile.ZipFile(file_apkout) as z:
+            self.assertEqual(['AndroidManifest.xml', 'resources.arsc', 'assets/licenses.xhtml', 'classes.dex',
+                              'META-INF/services/x'], z.namelist())
+            self.assertEqual(zipfile.ZIP_STORED, z.getinfo('resources.arsc').compress_type)
+            self.assertEqual(b'<html><body>GenderEx</body></html>', z.read('assets/licenses.xhtml'))
+            self.assertEqual(b'dex', z.read('classes.dex'))
+
+
+class RepackTest(unittest.TestCase):
+    @staticmethod
+    def _write_zip(file, entries):
+        with zipfile.ZipFile(file, 'w') as z:
+            for name, data, compress_type, level in entries:
+                info = zipfile.ZipInfo(name, (2022, 1, 1, 0, 0, 0))
+                info.compress_type = compress_type
+                z.writestr(info, data, compresslevel=level)
+
+    @staticmethod
+    def _raw_data(file, name):
+        """Returns the compressed bytes and the data offset of a zip entry"""
+        with zipfile.ZipFile(file) as z:
+            info = z.getinfo(name)
+        with open(file, 'rb') as f:
+            f.seek(info.header_offset)
+            header = f.read(30)
+            offset = info.header_offset + 30 + int.from_bytes(header[26:28], 'little') + \
+                int.from_bytes(header[28:30], 'little')
+            f.seek(offset)
+            return f.read(info.compress_size), offset
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.file_orig = os.path.join(tmp_dir.name, 'orig.apk')
+        self.file_built = os.path.join(tmp_dir.name, 'built.apk')
+        self.file_out = os.path.join(tmp_dir.name, 'out.apk')
+
+        dex = b'dex file ' * 10000
+        self._write_zip(self.file_orig, [
+            ('AndroidManifest.xml', b'manifest', zipfile.ZIP_DEFLATED, 9),
+            ('classes.dex', dex, zipfile.ZIP_DEFLATED, 9),
+            ('lib/arm64-v8a/libx.so', b'native' * 100, zipfile.ZIP_STORED, None),
+            ('resources.arsc', b'arsc', zipfile.ZIP_STORED, None),
+            ('res/drawable/x.png', b'png', zipfile.ZIP_STORED, None),
+            ('META-INF/MANIFEST.MF', b'mf', zipfile.ZIP_DEFLATED, 9),
+            ('META-INF/CERT.SF', b'sf', zipfile.ZIP_DEFLATED, 9),
+            ('META-INF/CERT.RSA', b'rsa', zipfile.ZIP_DEFLATED, 9),
+            ('META-INF/services/x', b'service', zipfile.ZIP_DEFLATED, 9),
+        ])
+
+        # apktool output: recompressed entries, new resource table and a new file
+        self._write_zip(self.file_built, [
+            ('AndroidManifest.xml', b'manifest', zipfile.ZIP_DEFLATED, 1),
+            ('classes.dex', dex, zipfile.ZIP_DEFLATED, 1),
+            ('lib/arm64-v8a/libx.so', b'native' * 100, zipfile.ZIP_DEFLATED, 1),
+            ('resources.arsc', b'new arsc', zipfile.ZIP_DEFLATED, 1),
+            ('res/drawable/x.png', b'png', zipfile.ZIP_STORED, None),
+            ('res/values/new.xml', b'new', zipfile.ZIP_DEFLATED, 1),
+            ('META-INF/services/x', b'service', zipfile.ZIP_DEFLATED, 1),
+        ])
+
+    def _check_alignment(self):
+        with zipfile.ZipFile(self.file_out) as z:
+            self.assertIsNone(z.testzip())
+            for info in z.infolist():
+                if info.compress_type == zipfile.ZIP_STORED:
+                    _, offset = self._raw_data(self.file_out, info.filename)
+                    self.assertEqual(0, offset % (4096 if info.filename.endswith('.so') else 4))
+
+    def test_repack_built(self):
+        repack.repack_apk(self.file_out, self.file_orig, self.file_built)
+        self._check_alignment()
+
+        with zipfile.ZipFile(self.file_out) as z:
+            self.assertEqual(['AndroidManifest.xml', 'classes.dex', 'lib/arm64-v8a/libx.so', 'resources.arsc',
+                              'res/drawable/x.png', 'res/values/new.xml', 'META-INF/services/x'], z.namelist())
+            self.assertEqual(b'new arsc', z.read('resources.arsc'))
+            self.assertEqual(zipfile.ZIP_STORED, z.getinfo('resources.arsc').compress_type)
+            self.assertEqual(zipfile.ZIP_STORED, z.getinfo('lib/arm64-v8a/libx.so').compress_type)
+            self.assertEqual(b'new', z.read('res/values/new.xml'))
+
+        # Unchanged entries are copied from the original APK, changed ones from the built APK
+        for name, src in (('classes.dex', self.file_orig), ('lib/arm64-v8a/libx.so', self.file_orig),
+                          ('res/values/new.xml', self.file_built)):
+            self.assertEqual(self._raw_data(src, name)[0], self._raw_data(self.file_out, name)[0])
+
+    def test_repack_changed(self):
+        repack.repack_apk(self.file_out, self.file_orig, changed_files={
+            'resources.arsc': b'changed arsc' * 3,
+            'AndroidManifest.xml': b'changed manifest',
+        })
+        self._check_alignment()
+
+        with zipfile.ZipFile(self.file_out) as z:
+            self.assertEqual(['AndroidManifest.xml', 'classes.dex', 'lib/arm64-v8a/libx.so', 'resources.arsc',
+                              'res/drawable/x.png', 'META-INF/services/x'], z.namelist())
+            self.assertEqual(b'changed arsc' * 3, z.read('resources.arsc'))
+            self.assertEqual(b'changed manifest', z.read('AndroidManifest.xml'))
+            self.assertEqual(zipfile.ZIP_DEFLATED, z.getinfo('AndroidManifest.xml').compress_type)
+
+        self.assertEqual(self._raw_data(self.file_orig, 'classes.dex')[0],
+                         self._raw_data(self.file_out, 'classes.dex')[0])
+
+
 class CreateIssueTest(unittest.TestCase):
     def test_create_issue(self):
         path = os.path.join(tests.DIR_REPLACE, 'replacements_issue.json')